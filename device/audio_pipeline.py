@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Audio Pipeline
+User-space phone -> sink path (parec | stages | pacat) with clock drift compensation
+"""
+
+import argparse
+import asyncio
+import fcntl
+import math
+import re
+import signal
+import struct
+import sys
+import termios
+import time
+from collections import deque
+
+import numpy as np
+
+from bluetooth_daemon import DEFAULT_CONFIG, CommandRunner, load_config, log
+from device_registry import DEFAULT_REGISTRY, DeviceRegistry
+from levels import LevelMeter
+from loudness import LoudnessNormalizer
+from metrics import Metrics
+from mixer import Mixer
+from recorder import Recorder
+from silence import SilenceDetector
+from spectrum import SpectrumAnalyzer
+from tool_parsers import parse_pactl_list, parse_pactl_short
+
+MAC_IN_NAME = re.compile(r"([0-9A-F]{2}[_:]){5}[0-9A-F]{2}", re.IGNORECASE)
+
+
+def _rounded(value, digits=2):
+    return None if value is None else round(value, digits)
+
+
+def pipe_backlog(stream):
+    """Bytes written to a child's stdin that the child has not read yet (our buffer + the pipe)"""
+    transport = getattr(stream, "transport", None)
+    if transport is None:
+        return 0
+    queued = transport.get_write_buffer_size()
+    pipe = transport.get_extra_info("pipe")
+    try:
+        return queued + struct.unpack("i", fcntl.ioctl(pipe.fileno(), termios.FIONREAD, b"\0" * 4))[0]
+    except (AttributeError, OSError, ValueError):
+        return queued
+
+
+class AdaptiveResampler:
+    """Cubic (Catmull-Rom) interpolator whose ratio may change on every block"""
+
+    def __init__(self, channels=2):
+        self.channels = channels
+        self._history = np.zeros((2, channels), dtype=np.float32)
+        self._position = 1.0  # index into _history of the next output frame
+
+    def process(self, block, step=1.0):
+        """(N, channels) input -> about N / step output frames; step > 1 shortens the audio"""
+        history = np.concatenate([self._history, block])
+        count = max(0, int(math.ceil((len(history) - 2 - self._position) / step)))
+        positions = self._position + step * np.arange(count)
+        base = positions.astype(np.int64)
+        t = (positions - base)[:, None].astype(np.float32)
+        p0, p1, p2, p3 = (history[base + offset] for offset in (-1, 0, 1, 2))
+        out = p1 + 0.5 * t * (p2 - p0 + t * (2 * p0 - 5 * p1 + 4 * p2 - p3 + t * (3 * (p1 - p2) + p3 - p0)))
+
+        self._position += step * count
+        keep = int(self._position) - 1
+        self._history = history[keep:]
+        self._position -= keep
+        return out
+
+
+class DriftEstimator:
+    """Clock drift from buffer fill over time, and the resampling correction that holds the target
+
+    The fill the sink would have without any correction is the measured fill plus every frame
+    the resampler has removed so far; its slope is the raw drift. Exponentially weighted least
+    squares keeps the estimate O(1) per update.
+    """
+
+    def __init__(self, sample_rate, target_frames, window_seconds=30.0, settle_seconds=10.0,
+                 max_correction_ppm=1000.0, warmup_seconds=2.0):
+        self.sample_rate = sample_rate
+        self.target_frames = target_frames
+        self.window_seconds = window_seconds
+        self.settle_seconds = settle_seconds
+        self.max_correction_ppm = max_correction_ppm
+        self.warmup_seconds = warmup_seconds
+        self.drift_ppm = 0.0
+        self.correction_ppm = 0.0
+        self._sums = np.zeros(5)  # weight, t, fill, t*t, t*fill with t relative to the last update
+        self._last = None
+        self._first = None
+
+    def restart(self):
+        """Forget the fill history (the sink was reopened) but keep the drift learned so far"""
+        self._sums[:] = 0.0
+        self._last = None
+        self._first = None
+
+    def update(self, now, fill_frames, removed_frames):
+        if self._last is None:
+            self._first = self._last = now
+        elapsed = now - self._last
+        self._last = now
+        weight, st, sf, stt, stf = self._sums * math.exp(-elapsed / self.window_seconds)
+        # Re-centre the sums on the new time origin
+        stt, st, stf = stt - 2 * elapsed * st + elapsed * elapsed * weight, st - elapsed * weight, stf - elapsed * sf
+        raw = fill_frames + removed_frames
+        self._sums = np.array([weight + 1, st, sf + raw, stt, stf])
+
+        weight, st, sf, stt, stf = self._sums
+        denominator = weight * stt - st * st
+        fitted = fill_frames
+        if now - self._first >= self.warmup_seconds and denominator > 0:
+            slope = (weight * stf - st * sf) / denominator
+            self.drift_ppm = slope / self.sample_rate * 1e6
+            # Fill read off the fitted line rather than the jittery last measurement
+            fitted = (sf - slope * st) / weight - removed_frames
+        error_seconds = (fitted - self.target_frames) / self.sample_rate
+        pull = error_seconds / self.settle_seconds * 1e6
+        self.correction_ppm = max(-self.max_correction_ppm, min(self.max_correction_ppm, self.drift_ppm + pull))
+        return self.correction_ppm
+
+
+class AudioPipeline:
+    """Capture blocks, run them through the stages, resample for drift, hand them to the sink"""
+
+    def __init__(self, config_file=DEFAULT_CONFIG, source=None, sink=None, runner=None):
+        config = load_config(config_file)
+        self.runner = runner or CommandRunner()
+        self.sample_rate = config.getint("audio", "sample_rate", fallback=44100)
+        self.channels = config.getint("pipeline", "channels", fallback=2)
+        self.block_frames = int(self.sample_rate * config.getfloat("pipeline", "block_ms", fallback=10.0) / 1000)
+        self.target_ms = config.getfloat("pipeline", "target_latency_ms", fallback=80.0)
+        self.stream_ms = config.getfloat("pipeline", "stream_latency_ms", fallback=self.target_ms / 4)
+        self.source = source or config.get("pipeline", "source", fallback="auto")
+        self.max_sources = config.getint("bluetooth", "max_connections", fallback=1)
+        self.duck_db = config.getfloat("pipeline", "duck_db", fallback=-15.0)
+        self.registry = DeviceRegistry(config.get("daemon", "registry_file", fallback=DEFAULT_REGISTRY))
+        self.mixer = None
+        self.loudness = config.getboolean("pipeline", "loudness", fallback=True)
+        self.target_lufs = config.getfloat("pipeline", "target_lufs", fallback=-16.0)
+        self.max_gain_db = config.getfloat("pipeline", "max_gain_db", fallback=12.0)
+        self.ceiling_db = config.getfloat("pipeline", "limiter_ceiling_db", fallback=-1.0)
+        self.normalizers = {}
+        default_sink = config.get("pulseaudio", "default_sink", fallback="auto")
+        self.sink = sink or config.get("pipeline", "sink", fallback=default_sink)
+        self.metrics_interval = config.getfloat("daemon", "metrics_interval", fallback=10.0)
+        self.latency_poll = config.getfloat("pipeline", "latency_poll_seconds", fallback=0.5)
+        self.metrics_file = config.get("pipeline", "metrics_file",
+                                       fallback="/tmp/bluetooth_speaker_pipeline.json")
+
+        self.silence = SilenceDetector(
+            self.sample_rate,
+            threshold_db=config.getfloat("pipeline", "silence_threshold_db", fallback=-60.0),
+            peak_db=config.getfloat("pipeline", "silence_peak_db", fallback=-40.0),
+            hangover_seconds=config.getfloat("pipeline", "silence_seconds", fallback=30.0),
+        )
+        self.stages = []
+        levels_file = config.get("pipeline", "levels_file", fallback="")
+        if levels_file:
+            self.stages.append(LevelMeter(
+                self.sample_rate, self.channels, levels_file,
+                hold_seconds=config.getfloat("pipeline", "peak_hold_seconds", fallback=1.5)))
+        spectrum_file = config.get("pipeline", "spectrum_file", fallback="")
+        if spectrum_file:
+            self.stages.append(SpectrumAnalyzer(
+                self.sample_rate, self.channels, spectrum_file,
+                rate_hz=config.getfloat("pipeline", "spectrum_rate", fallback=30.0)))
+        self.record_directory = config.get("recorder", "directory", fallback="")
+        self.record_on_start = config.getboolean("recorder", "record", fallback=False)
+        self.recorder_options = {
+            "pre_trigger_seconds": config.getfloat("recorder", "pre_trigger_seconds", fallback=60.0),
+            "segment_seconds": config.getfloat("recorder", "segment_seconds", fallback=900.0),
+            "segment_bytes": int(config.getfloat("recorder", "segment_mb", fallback=0) * (1 << 20)),
+            "fixup_seconds": config.getfloat("recorder", "fixup_seconds", fallback=1.0),
+            "sync_seconds": config.getfloat("recorder", "sync_seconds", fallback=0.0),
+        }
+        self.recorders = {}
+        self.resampler = AdaptiveResampler(self.channels)
+        self.drift = DriftEstimator(
+            self.sample_rate, self.target_ms * self.sample_rate / 1000,
+            window_seconds=config.getfloat("pipeline", "drift_window_seconds", fallback=30.0),
+            max_correction_ppm=config.getfloat("pipeline", "max_correction_ppm", fallback=1000.0),
+        )
+        self.metrics = Metrics()
+        self.metrics.set("target_latency_ms", self.target_ms)
+        self.stopping = asyncio.Event()
+        self._captured = 0
+        self._written = 0
+        self._started = None
+        self._playback = None
+        self._measured = None  # (time, frames queued, frames written by then) of the last measurement
+        self._fresh = False
+
+    def process(self, block, fill_frames, now):
+        """One captured (N, channels) float32 block -> block for the sink, given the sink's current fill
+
+        Once the queue is measured, the drift estimator only learns from blocks that carry a new
+        measurement; until then it follows the monotonic-clock model of the sink.
+        """
+        for stage in self.stages:
+            block = stage.process(block)
+        step = 1.0 + self.drift.correction_ppm * 1e-6
+        out = self.resampler.process(block, step)
+        self._captured += len(block)
+        self._written += len(out)
+
+        if self._fresh or self._measured is None:
+            self.drift.update(now, fill_frames, self._captured - self._written)
+            self._fresh = False
+        self.metrics.set("drift_ppm", round(self.drift.drift_ppm, 2))
+        self.metrics.set("correction_ppm", round(self.drift.correction_ppm, 2))
+        self.metrics.set("latency_ms", round(fill_frames * 1000 / self.sample_rate, 2))
+        return out
+
+    def record_latency(self, now, fill_frames):
+        """A measurement of the frames queued between us and the speaker, taken at `now`"""
+        if self._measured is None:
+            # The model's history does not line up with real measurements; keep only the drift
+            self.drift.restart()
+        self._measured = (now, fill_frames, self._written)
+        self._fresh = True
+
+    def estimated_fill(self, now):
+        """Frames queued at the sink: the last measurement carried forward to `now`, or, before the
+        first one, the sink modelled as draining at the nominal rate of the monotonic clock"""
+        if self._measured is not None:
+            at, fill, written = self._measured
+            return fill + (self._written - written) - (now - at) * self.sample_rate
+        return self._written - (now - self._started) * self.sample_rate
+
+    async def measure_playback(self, playback):
+        """Frames between the pipeline and the speaker: pacat's unread pipe, plus its stream buffer and
+        the sink's latency as the server reports them for pacat's sink input -> None if not found"""
+        success, output, _ = await self.runner.run(["pactl", "list", "sink-inputs"], timeout=2)
+        if not success:
+            return None
+        for stream in parse_pactl_list(output):
+            if (stream.kind == "sink-input" and stream.latency_usec is not None
+                    and stream.properties.get("application.process.id") == str(playback.pid)):
+                queued = stream.latency_usec * self.sample_rate / 1e6
+                return queued + pipe_backlog(playback.stdin) / (self.channels * 4)
+        return None
+
+    async def _measure_task(self):
+        """Measure the playback queue every latency_poll_seconds while pacat is running"""
+        while True:
+            await asyncio.sleep(self.latency_poll)
+            playback = self._playback
+            if playback is None:
+                continue
+            fill = await self.measure_playback(playback)
+            if fill is not None and playback is self._playback:
+                self.record_latency(time.monotonic(), fill)
+
+    async def find_sources(self):
+        """Configured sources, or every Bluetooth source up to [bluetooth] max_connections"""
+        if self.source != "auto":
+            return [name.strip() for name in self.source.split(",") if name.strip()]
+        success, output, _ = await self.runner.run(["pactl", "list", "short", "sources"], timeout=5)
+        sources = [entry.name for entry in (parse_pactl_short(output) if success else [])
+                   if entry.name.startswith(("bluez_source", "bluez_input"))]
+        return sources[:self.max_sources]
+
+    @staticmethod
+    def source_mac(name):
+        match = MAC_IN_NAME.search(name)
+        return match.group(0).replace("_", ":").upper() if match else None
+
+    def add_source(self, name):
+        """Register a source with the gain, priority and learned loudness its phone has in the registry"""
+        mac = self.source_mac(name)
+        entry = (self.registry.get(mac) if mac else None) or {}
+        self.mixer.add_source(name, entry.get("gain_db", 0.0), entry.get("priority", 0))
+        if self.loudness:
+            self.normalizers[name] = LoudnessNormalizer(
+                self.sample_rate, self.channels, self.target_lufs, self.max_gain_db,
+                initial_gain_db=entry.get("loudness_gain_db", 0.0), ceiling_db=self.ceiling_db)
+        if self.record_directory:
+            prefix = mac.replace(":", "") if mac else re.sub(r"[^\w.-]", "_", name)
+            recorder = Recorder(self.sample_rate, self.channels, self.record_directory, prefix,
+                                **self.recorder_options)
+            if self.record_on_start:
+                recorder.start(pre_trigger=False)
+            self.recorders[name] = recorder
+
+    def save_recordings(self):
+        """SIGUSR1: write what every phone sent in the last pre_trigger_seconds"""
+        for recorder in self.recorders.values():
+            path = recorder.save_last()
+            if path:
+                log(f"💾 Saving the last {recorder.buffered_seconds:.0f} s to {path}")
+
+    def toggle_recording(self):
+        """SIGUSR2: start recording every phone (from the buffered past onwards), or stop"""
+        recording = any(recorder.continuous for recorder in self.recorders.values())
+        for recorder in self.recorders.values():
+            if recording:
+                recorder.stop()
+            else:
+                recorder.start()
+        if self.recorders:
+            log(f"⏺️  Recording {'stopped' if recording else 'started'} in {self.record_directory}")
+
+    def save_learned_gains(self):
+        """Persist each phone's converged gain so its next connection starts at the right level"""
+        changed = False
+        for name, normalizer in self.normalizers.items():
+            mac = self.source_mac(name)
+            if mac and normalizer.meter.gated_seconds >= normalizer.min_seconds:
+                self.registry.update(mac, loudness_gain_db=round(normalizer.gain_db, 2))
+                changed = True
+        if changed:
+            try:
+                self.registry.save()
+            except OSError as e:
+                log(f"Registry error: {e}")
+
+    def _stream_args(self, tool, device):
+        args = [tool, "--format=float32le", f"--rate={self.sample_rate}", f"--channels={self.channels}",
+                f"--latency-msec={max(1, int(self.stream_ms))}"]
+        if device and device != "auto":
+            args.append(f"--device={device}")
+        return args
+
+    async def _open_playback(self):
+        """Start pacat with the latency budget prefilled; the latency bookkeeping starts over"""
+        playback = await self.runner.open_pipe(self._stream_args("pacat", self.sink), write=True)
+        prefill = np.zeros((int(self.drift.target_frames), self.channels), dtype=np.float32)
+        playback.stdin.write(prefill.tobytes())
+        self._written = len(prefill)
+        self._captured = 0
+        self._started = time.monotonic()
+        self._playback = playback
+        self._measured = None
+        return playback
+
+    async def _close_playback(self, playback):
+        """Let pacat play out what it has and exit, so the sink can idle (and suspend) without us"""
+        self._playback = None
+        playback.stdin.close()
+        try:
+            await asyncio.wait_for(playback.wait(), timeout=self.target_ms / 1000 + 1)
+        except asyncio.TimeoutError:
+            playback.kill()
+            await playback.wait()
+
+    async def _pump(self, name, process, backlog):
+        """Keep the newest few blocks of a secondary source; its clock is not the pipeline's.
+        Its recorder gets every block as captured, including the ones the backlog drops"""
+        block_bytes = self.block_frames * self.channels * 4
+        try:
+            while True:
+                data = await process.stdout.readexactly(block_bytes)
+                block = np.frombuffer(data, dtype=np.float32).reshape(-1, self.channels)
+                recorder = self.recorders.get(name)
+                if recorder is not None:
+                    recorder.process(block)
+                backlog.append(block)
+        except asyncio.IncompleteReadError:
+            pass
+
+    async def run(self):
+        sources = await self.find_sources()
+        if not sources:
+            log("❌ No Bluetooth source found - is a phone connected and playing?")
+            return 1
+        log(f"🎚️  {', '.join(sources)} -> {self.sink}, target latency {self.target_ms:.0f} ms")
+        self.mixer = Mixer(self.block_frames, self.channels, self.sample_rate, self.duck_db)
+        for name in sources:
+            self.add_source(name)
+        captures = [await self.runner.open_pipe(self._stream_args("parec", name), write=False) for name in sources]
+        # The first source paces the pipeline; the others are mixed in from short backlogs
+        primary, backlogs = sources[0], {name: deque(maxlen=4) for name in sources[1:]}
+        pumps = [asyncio.ensure_future(self._pump(name, process, backlogs[name]))
+                 for name, process in zip(sources[1:], captures[1:])]
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        loop.add_signal_handler(signal.SIGUSR1, self.save_recordings)
+        loop.add_signal_handler(signal.SIGUSR2, self.toggle_recording)
+
+        block_bytes = self.block_frames * self.channels * 4
+        playback = await self._open_playback()
+        measuring = asyncio.ensure_future(self._measure_task())
+        next_metrics = self._started + self.metrics_interval
+        blocks = {}
+        try:
+            while not self.stopping.is_set():
+                try:
+                    data = await captures[0].stdout.readexactly(block_bytes)
+                except asyncio.IncompleteReadError:
+                    log("⚠️  Capture stream ended")
+                    break
+                now = time.monotonic()
+                blocks[primary] = np.frombuffer(data, dtype=np.float32).reshape(-1, self.channels)
+                for name, backlog in backlogs.items():
+                    blocks[name] = backlog.popleft() if backlog else None
+                if primary in self.recorders:
+                    self.recorders[primary].process(blocks[primary])
+
+                event = self.silence.update(blocks.values())
+                if event == "suspend":
+                    log(f"💤 Silent for {self.silence.hangover_frames / self.sample_rate:.0f} s - suspending")
+                    await self._close_playback(playback)
+                    playback = None
+                    for stage in self.stages:
+                        if hasattr(stage, "suspend"):
+                            stage.suspend()
+                elif event == "resume":
+                    log("🔊 Sound again - resuming")
+                    for stage in self.stages:
+                        if hasattr(stage, "resume"):
+                            stage.resume()
+                    playback = await self._open_playback()
+                    self.drift.restart()
+
+                if playback is not None:
+                    for name, normalizer in self.normalizers.items():
+                        if blocks[name] is not None:
+                            blocks[name] = normalizer.process(blocks[name])
+                    mixed = self.mixer.mix(blocks)
+
+                    fill = self.estimated_fill(now)
+                    if fill < 0:
+                        # Underrun: the sink played silence; restart the latency budget from here
+                        self.metrics.inc("underruns")
+                        self._written -= int(fill)
+                        fill = 0
+                    out = self.process(mixed, fill, now)
+                    playback.stdin.write(np.ascontiguousarray(out, dtype=np.float32).tobytes())
+                    await playback.stdin.drain()
+                if now >= next_metrics:
+                    next_metrics = now + self.metrics_interval
+                    self.metrics.set("latency_source", "modelled" if self._measured is None else "measured")
+                    self.metrics.set("suspended", int(self.silence.suspended))
+                    self.metrics.set("suspended_seconds", round(self.silence.suspended_seconds, 1))
+                    self.metrics.set("suspensions", self.silence.suspensions)
+                    if self.recorders:
+                        self.metrics.set("recording", sum(recorder.recording for recorder in self.recorders.values()))
+                        self.metrics.set("recorded_seconds", round(sum(
+                            recorder.recorded_frames for recorder in self.recorders.values()) / self.sample_rate, 1))
+                        self.metrics.set("recorder_errors", sum(recorder.errors for recorder in self.recorders.values()))
+                    self.metrics.set("sources_active", sum(source.active for source in self.mixer.sources.values()))
+                    for name, normalizer in self.normalizers.items():
+                        key = self.source_mac(name) or name
+                        self.metrics.set(f"{key}.loudness_lufs", _rounded(normalizer.meter.integrated()))
+                        self.metrics.set(f"{key}.gain_db", round(normalizer.gain_db, 2))
+                        self.metrics.set(f"{key}.limiter_db", round(normalizer.limiter.reduction_db, 2))
+                    self.save_learned_gains()
+                    try:
+                        self.metrics.write(self.metrics_file)
+                    except OSError as e:
+                        log(f"Metrics error: {e}")
+        finally:
+            self.save_learned_gains()
+            for recorder in self.recorders.values():
+                recorder.close()
+            for stage in self.stages:
+                if hasattr(stage, "close"):
+                    stage.close()
+            measuring.cancel()
+            for pump in pumps:
+                pump.cancel()
+            for process in captures + [playback]:
+                if process is not None and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        return 0
+
+
+def simulate(drift_ppm=120.0, seconds=600.0, config_file=DEFAULT_CONFIG, jitter_ms=2.0, seed=1, sink_ppm=0.0,
+             measured=True, noise_ms=1.0):
+    """Capture clock off by `drift_ppm` and the sink's by `sink_ppm`, against the monotonic clock.
+
+    The true queue is measured every latency_poll_seconds with `noise_ms` of error, as run() does
+    through pactl; with `measured` False the pipeline only has its monotonic model of the sink.
+    Returns a (time, true latency ms, drift ppm, correction ppm) trace and the processing speed.
+    """
+    pipeline = AudioPipeline(config_file)
+    rng = np.random.default_rng(seed)
+    rate = pipeline.sample_rate
+    block = np.zeros((pipeline.block_frames, pipeline.channels), dtype=np.float32)
+    capture_rate = rate * (1 + drift_ppm * 1e-6)
+    sink_rate = rate * (1 + sink_ppm * 1e-6)
+    pipeline._written = int(pipeline.drift.target_frames)
+    pipeline._started = 0.0
+    next_poll = pipeline.latency_poll
+    trace = []
+    started = time.perf_counter()
+    blocks = int(seconds * capture_rate / len(block))
+    for index in range(blocks):
+        now = (index + 1) * len(block) / capture_rate
+        # Block arrival is jittered by the scheduler; the sink keeps draining meanwhile
+        seen = now + abs(rng.normal(0, jitter_ms / 1000))
+        fill = pipeline._written - seen * sink_rate
+        if measured and seen >= next_poll:
+            pipeline.record_latency(seen, fill + rng.normal(0, noise_ms / 1000) * rate)
+            next_poll += pipeline.latency_poll
+        pipeline.process(block, pipeline.estimated_fill(seen), seen)
+        if index % int(capture_rate / len(block)) == 0:
+            trace.append((now, fill * 1000 / rate, pipeline.drift.drift_ppm, pipeline.drift.correction_ppm))
+    cpu = time.perf_counter() - started
+    return trace, seconds / cpu
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bluetooth source -> sink pipeline with drift compensation")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--source", help="capture source(s), comma separated (default: [pipeline] source, "
+                                         "auto = every Bluetooth source)")
+    parser.add_argument("--sink", help="playback sink (default: [pipeline] sink)")
+    parser.add_argument("--simulate", type=float, metavar="PPM",
+                        help="run offline against a capture clock off by PPM and print the control trace")
+    parser.add_argument("--sink-ppm", type=float, default=0.0, help="simulated sink clock error")
+    parser.add_argument("--modelled", action="store_true",
+                        help="simulate without queue measurements (monotonic model of the sink only)")
+    parser.add_argument("--seconds", type=float, default=600.0, help="simulated duration")
+    args = parser.parse_args(argv)
+
+    if args.simulate is not None:
+        trace, speed = simulate(args.simulate, args.seconds, args.config, sink_ppm=args.sink_ppm,
+                                measured=not args.modelled)
+        print(f"{'time s':>7} {'latency ms':>11} {'drift ppm':>10} {'correction':>11}")
+        for now, latency, drift, correction in trace[::max(1, len(trace) // 20)] + trace[-1:]:
+            print(f"{now:>7.0f} {latency:>11.2f} {drift:>10.1f} {correction:>11.1f}")
+        print(f"processing: {speed:.0f}x real time")
+        final_latency = trace[-1][1]
+        target = AudioPipeline(args.config).target_ms
+        relative_ppm = args.simulate - args.sink_ppm
+        return 0 if abs(final_latency - target) < 5 and abs(trace[-1][2] - relative_ppm) < 5 else 1
+
+    return asyncio.run(AudioPipeline(args.config, args.source, args.sink).run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
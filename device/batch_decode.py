@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Batch Decoder
+Decode long recorded captures of the audio data channel across all CPU cores
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from bluetooth_daemon import DEFAULT_CONFIG
+from fec_framing import FrameCodec, frames_to_bits
+from ofdm_modem import OfdmModem
+from preamble_sync import PreambleSync, shift_frequency
+
+RAW_FORMATS = {"s16le": "<i2", "s32le": "<i4", "f32le": "<f4"}
+
+
+class Capture:
+    """Picklable description of a capture: a mapped file or a shared memory block, never the samples"""
+
+    def __init__(self, dtype, frames, sample_rate, channels=1, path=None, offset=0, shm_name=None):
+        self.dtype = np.dtype(dtype)
+        self.frames = frames
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.path = path
+        self.offset = offset
+        self.shm_name = shm_name
+
+    @classmethod
+    def from_wav(cls, path):
+        """Locate the PCM data of a WAV file without reading it"""
+        with open(path, "rb") as f:
+            riff, _, kind = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or kind != b"WAVE":
+                raise ValueError(f"{path} is not a WAV file")
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(f"{path} has no data chunk")
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = struct.unpack("<HHIIHH", f.read(16))
+                    f.seek(size - 16 + (size & 1), os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    offset = f.tell()
+                    break
+                else:
+                    f.seek(size + (size & 1), os.SEEK_CUR)
+        if fmt is None:
+            raise ValueError(f"{path} has no fmt chunk")
+        audio_format, channels, sample_rate, _, _, bits = fmt
+        if audio_format == 3 and bits == 32:
+            dtype = "<f4"
+        elif audio_format in (1, 0xFFFE) and bits in (16, 32):
+            dtype = f"<i{bits // 8}"
+        else:
+            raise ValueError(f"unsupported WAV sample format {audio_format}/{bits} bit")
+        available = (os.path.getsize(path) - offset) // (channels * bits // 8)
+        frames = min(size // (channels * bits // 8), available)
+        return cls(dtype, frames, sample_rate, channels, path=path, offset=offset)
+
+    @classmethod
+    def from_raw(cls, path, raw_format, sample_rate, channels=1):
+        dtype = np.dtype(RAW_FORMATS[raw_format])
+        frames = os.path.getsize(path) // (dtype.itemsize * channels)
+        return cls(dtype, frames, sample_rate, channels, path=path)
+
+    @classmethod
+    def share(cls, samples, sample_rate):
+        """Copy an in-memory signal into shared memory; returns (capture, handle to close/unlink)"""
+        samples = np.ascontiguousarray(samples, dtype=np.float32)
+        handle = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+        np.ndarray(samples.shape, np.float32, buffer=handle.buf)[:] = samples
+        return cls(np.float32, len(samples), sample_rate, shm_name=handle.name), handle
+
+    @property
+    def seconds(self):
+        return self.frames / self.sample_rate
+
+    def open(self):
+        """(first-channel view of the samples, handle that must stay referenced while the view is used)"""
+        if self.shm_name:
+            handle = _attach(self.shm_name)
+            data = np.ndarray((self.frames, self.channels), self.dtype, buffer=handle.buf)
+        else:
+            handle = None
+            data = np.memmap(self.path, self.dtype, "r", self.offset, (self.frames, self.channels))
+        return data[:, 0], handle
+
+    def scale(self):
+        return 1.0 if self.dtype.kind == "f" else 1.0 / (1 << (8 * self.dtype.itemsize - 1))
+
+
+def _attach(name):
+    """Attach to the creator's block; only the creator unlinks it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13: pool workers share the creator's resource tracker anyway
+        return shared_memory.SharedMemory(name=name)
+
+
+class BurstDecoder:
+    """One OFDM burst per FEC frame: detect, correct frequency offset, demodulate, RS-decode"""
+
+    def __init__(self, modem, codec):
+        self.modem = modem
+        self.codec = codec
+        self.symbols = -(-codec.frame_bits // modem.bits_per_symbol)
+        self.burst_samples = modem.frame_samples(self.symbols)
+
+    def encode(self, payloads):
+        """Payloads -> list of audio bursts"""
+        bits = frames_to_bits(self.codec.encode(payloads)).reshape(len(payloads), -1)
+        return [self.modem.modulate(row) for row in bits]
+
+    def decode(self, samples, offset=0):
+        """Decode every burst that starts in `samples` -> [(absolute position, score, payload or None)]"""
+        sync = PreambleSync.for_modem(self.modem)
+        detections = sync.feed(samples) + sync.flush()
+        results = []
+        for detection in detections:
+            burst = samples[detection.sample:detection.sample + self.burst_samples]
+            if len(burst) < self.burst_samples:
+                continue
+            burst = shift_frequency(burst, -detection.cfo_hz, self.modem.sample_rate)
+            bits = self.modem.demodulate(burst, self.symbols)[:self.codec.frame_bits]
+            payload = self.codec.decode(np.packbits(bits)[None, :])[0]
+            results.append((offset + detection.position, detection.score, payload))
+        return results
+
+
+# Per-worker state, set up once by the pool initializer
+_worker = {}
+
+
+def _init_worker(capture, config_file):
+    samples, handle = capture.open()
+    _worker.update(samples=samples, handle=handle, scale=capture.scale(),
+                   decoder=BurstDecoder(OfdmModem.from_config(config_file), FrameCodec()))
+
+
+def _decode_chunk(start, stop, owned_until):
+    samples = _worker["samples"][start:stop].astype(np.float64) * _worker["scale"]
+    results = _worker["decoder"].decode(samples, start)
+    # A burst belongs to the chunk its preamble starts in; the overlap only completes it
+    return [result for result in results if result[0] < owned_until]
+
+
+def plan_chunks(frames, chunk_samples, overlap):
+    """[(start, stop, owned_until)] covering the capture; each overlap holds a whole burst"""
+    chunks = []
+    for start in range(0, frames, chunk_samples):
+        owned_until = min(start + chunk_samples, frames)
+        chunks.append((start, min(owned_until + overlap, frames), owned_until))
+    return chunks
+
+
+def merge(results, holdoff):
+    """Order by position and drop repeats of the same burst found by two neighbouring chunks"""
+    merged = []
+    for result in sorted(results, key=lambda item: item[0]):
+        if merged and result[0] - merged[-1][0] < holdoff:
+            if result[1] > merged[-1][1]:
+                merged[-1] = result
+            continue
+        merged.append(result)
+    return merged
+
+
+def decode_capture(capture, workers=None, chunk_seconds=30.0, config_file=DEFAULT_CONFIG):
+    """Decode a whole capture across a process pool -> (merged results, elapsed seconds)"""
+    decoder = BurstDecoder(OfdmModem.from_config(config_file), FrameCodec())
+    overlap = decoder.burst_samples + PreambleSync.for_modem(decoder.modem).fft_size
+    chunks = plan_chunks(capture.frames, int(chunk_seconds * capture.sample_rate), overlap)
+    workers = workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+    results = []
+    if workers == 1:
+        _init_worker(capture, config_file)
+        for chunk in chunks:
+            results.extend(_decode_chunk(*chunk))
+        _worker.clear()
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(capture, config_file)) as pool:
+            for part in pool.map(_decode_chunk, *zip(*chunks)):
+                results.extend(part)
+    merged = merge(results, decoder.burst_samples // 2)
+    return merged, time.perf_counter() - started
+
+
+def decode_samples(samples, sample_rate, workers=None, chunk_seconds=30.0, config_file=DEFAULT_CONFIG):
+    """Decode a signal already in memory; workers attach to one shared-memory copy instead of pickling it"""
+    capture, handle = Capture.share(samples, sample_rate)
+    try:
+        return decode_capture(capture, workers, chunk_seconds, config_file)
+    finally:
+        handle.close()
+        handle.unlink()
+
+
+def make_capture(path, seconds, config_file=DEFAULT_CONFIG, profile="sbc", seed=11):
+    """Write a test capture: random payload bursts with random gaps through a simulated channel"""
+    from channel_sim import ChannelSimulator
+
+    rng = np.random.default_rng(seed)
+    modem = OfdmModem.from_config(config_file)
+    decoder = BurstDecoder(modem, FrameCodec())
+    signal = np.zeros(int(seconds * modem.sample_rate), dtype=np.float32)
+    payloads = []
+    position = int(rng.integers(1000, 5000))
+    while position + decoder.burst_samples < len(signal):
+        payload = rng.integers(0, 256, decoder.codec.payload_size, dtype=np.uint8).tobytes()
+        burst = decoder.encode([payload])[0]
+        signal[position:position + len(burst)] = burst
+        payloads.append(payload)
+        position += len(burst) + int(rng.integers(500, 4000))
+
+    received = ChannelSimulator.from_profile(profile, output_rate=modem.sample_rate, seed=seed).run(signal)
+    pcm = (np.clip(received[:len(signal)], -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(modem.sample_rate)
+        out.writeframes(pcm.tobytes())
+    return payloads
+
+
+def benchmark(seconds=120.0, config_file=DEFAULT_CONFIG, worker_counts=None):
+    worker_counts = worker_counts or sorted({1, os.cpu_count() or 1})
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.wav")
+        payloads = make_capture(path, seconds, config_file)
+        capture = Capture.from_wav(path)
+        view, _ = capture.open()
+        samples = view.astype(np.float32) * capture.scale()
+        del view
+        rows = []
+        for source in ("file", "memory"):
+            for workers in worker_counts:
+                if source == "file":
+                    merged, elapsed = decode_capture(capture, workers, config_file=config_file)
+                else:
+                    merged, elapsed = decode_samples(samples, capture.sample_rate, workers, config_file=config_file)
+                decoded = [payload for _, _, payload in merged if payload is not None]
+                rows.append((source, workers, capture.seconds / elapsed, len(decoded), decoded == payloads))
+    return len(payloads), rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode a recorded capture of the audio data channel")
+    parser.add_argument("capture", nargs="?", help="WAV file, or raw samples with --raw-format")
+    parser.add_argument("--raw-format", choices=sorted(RAW_FORMATS), help="treat the capture as headerless")
+    parser.add_argument("--rate", type=int, default=44100, help="sample rate of a raw capture")
+    parser.add_argument("--channels", type=int, default=1, help="channels of a raw capture (first is decoded)")
+    parser.add_argument("--workers", type=int, help="processes (default: one per CPU)")
+    parser.add_argument("--chunk-seconds", type=float, default=30.0)
+    parser.add_argument("--output", help="append decoded payloads, in order, to this file")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--make-capture", metavar="SECONDS", type=float, help="write a test capture to CAPTURE")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="decode speed vs worker count, from the mapped file and from shared memory")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        sent, rows = benchmark(config_file=args.config)
+        print(f"{sent} bursts sent")
+        print(f"{'source':>8} {'workers':>8} {'x real time':>12} {'decoded':>8} {'in order':>9}")
+        for source, workers, speed, decoded, exact in rows:
+            print(f"{source:>8} {workers:>8} {speed:>12.1f} {decoded:>8} {'yes' if exact else 'no':>9}")
+        return 0
+    if not args.capture:
+        parser.error("a capture file is required")
+    if args.make_capture:
+        payloads = make_capture(args.capture, args.make_capture, args.config)
+        print(f"Wrote {len(payloads)} bursts to {args.capture}")
+        return 0
+
+    if args.raw_format:
+        capture = Capture.from_raw(args.capture, args.raw_format, args.rate, args.channels)
+    else:
+        capture = Capture.from_wav(args.capture)
+    merged, elapsed = decode_capture(capture, args.workers, args.chunk_seconds, args.config)
+    good = [payload for _, _, payload in merged if payload is not None]
+    print(f"{len(merged)} bursts, {len(good)} decoded, {len(merged) - len(good)} failed")
+    print(f"{capture.seconds:.1f} s of audio in {elapsed:.1f} s ({capture.seconds / elapsed:.1f}x real time)")
+    if args.output:
+        with open(args.output, "ab") as f:
+            for payload in good:
+                f.write(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Daemon
+Runs pairing and playback as modes of one asyncio event loop that can be switched at runtime
+"""
+
+import argparse
+import asyncio
+import configparser
+import os
+import signal
+import sys
+import time
+
+from device_registry import DEFAULT_REGISTRY, DeviceRegistry
+from metrics import Metrics
+from tool_parsers import parse_controller_info, parse_device_info, parse_devices, parse_pactl_short
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.ini")
+MODES = ("pairing", "playback", "standby")
+
+BLUETOOTH_AUDIO_MODULES = [
+    "module-bluetooth-discover",
+    "module-bluetooth-policy",
+    "module-bluez5-discover",
+    "module-bluez5-device",
+]
+
+
+def log(message):
+    """Simple logging with timestamp"""
+    timestamp = time.strftime("%H:%M:%S")
+    print(f"[{timestamp}] {message}", flush=True)
+
+
+def load_config(config_file=DEFAULT_CONFIG, profile=None):
+    """Read config.ini, falling back to built-in defaults for missing keys, with the latency profile applied"""
+    from profiles import apply_profile
+
+    config = configparser.ConfigParser()
+    if os.path.exists(config_file):
+        config.read(config_file)
+    apply_profile(config, profile)
+    return config
+
+
+class CommandRunner:
+    """Runs external tools through asyncio subprocesses"""
+
+    async def run(self, args, input=None, timeout=10):
+        """Run a command without a shell, returning (success, stdout, stderr)"""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            return False, "", str(e)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(input.encode() if input is not None else None), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return False, "", "Command timed out"
+        except asyncio.CancelledError:
+            # Don't leave the tool running behind a cancelled caller
+            process.kill()
+            await process.wait()
+            raise
+
+        return process.returncode == 0, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    async def bluetoothctl(self, commands, controller=None, timeout=10):
+        """Feed a batch of commands to a single bluetoothctl session"""
+        lines = []
+        if controller:
+            lines.append(f"select {controller}")
+        lines.extend(commands)
+        lines.append("quit")
+        return await self.run(["bluetoothctl"], input="\n".join(lines) + "\n", timeout=timeout)
+
+    async def open_session(self, args):
+        """Start a long-running interactive process (e.g. the pairing agent)"""
+        return await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+
+    async def open_pipe(self, args, write=False):
+        """Start a binary stream process (e.g. parec/pacat), piping stdin if `write` else stdout"""
+        return await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if write else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL if write else asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+
+
+class BluetoothDaemon:
+    def __init__(self, config_file=DEFAULT_CONFIG, mode=None, runner=None, controller=None):
+        self.config = load_config(config_file)
+        self.device_name = self.config.get("bluetooth", "device_name", fallback="Ubuntu-Speaker")
+        self.auto_accept_pairing = self.config.getboolean("bluetooth", "auto_accept_pairing", fallback=True)
+        self.max_connections = self.config.getint("bluetooth", "max_connections", fallback=1)
+        self.poll_interval = self.config.getfloat("daemon", "poll_interval", fallback=5.0)
+        self.standby_poll_interval = self.config.getfloat("daemon", "standby_poll_interval", fallback=60.0)
+        self.reconnect_interval = self.config.getfloat("daemon", "reconnect_interval", fallback=30.0)
+        self.metrics_interval = self.config.getfloat("daemon", "metrics_interval", fallback=10.0)
+        self.metrics_file = self.config.get("daemon", "metrics_file",
+                                            fallback="/tmp/bluetooth_speaker_metrics.json")
+        self.exit_to_standby = self.config.getboolean("daemon", "exit_to_standby", fallback=False)
+        self.registry = DeviceRegistry(self.config.get("daemon", "registry_file", fallback=DEFAULT_REGISTRY))
+        self.diagnostics_at_start = self.config.getboolean("diagnostics", "at_start", fallback=True)
+        self.diagnostics_file = self.config.get("diagnostics", "report_file",
+                                                fallback="/tmp/bluetooth_speaker_diagnostics.json")
+        self.audio_backend = self.config.get("pulseaudio", "backend", fallback="auto")
+        self.profile = self.config.get("audio", "profile", fallback="custom")
+        self.quantum = self.config.getint("audio", "buffer_size", fallback=0)
+        self.loopback_latency_ms = self.config.getint("pulseaudio", "loopback_latency_ms", fallback=0)
+        self.suspend_on_silence = self.config.getboolean("pulseaudio", "suspend_on_silence", fallback=True)
+
+        self.mode = mode or self.config.get("daemon", "mode", fallback="playback")
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown mode: {self.mode}")
+
+        self.runner = runner or CommandRunner()
+        self.controller = controller
+        self.metrics = Metrics()
+        self.connected = {}
+        self.held = set()  # phones that connected in standby; routed when it ends
+        self.audio = None  # PipeWireBackend/PulseBackend when the graph is modelled in memory, else pactl calls
+        self.router = None  # routing.Router when [route:*] rules or default_sink need deciding
+        self.silence = None  # silence.SilenceWatch dropping the routes while every phone is silent
+        self.zone = None
+        self.mode_changed = None
+        self.stopping = None
+        self.tasks = []
+
+    async def bluetoothctl(self, commands, timeout=10):
+        """Run bluetoothctl commands against this daemon's controller"""
+        return await self.runner.bluetoothctl(commands, controller=self.controller, timeout=timeout)
+
+    async def adapter_is_warm(self):
+        """True if the adapter is already powered and named, e.g. left in standby"""
+        success, output, _ = await self.bluetoothctl(["show"])
+        if not success:
+            return False
+        return any(controller.powered and controller.alias == self.device_name
+                   for controller in parse_controller_info(output))
+
+    async def setup_adapter(self):
+        """Unblock, power on and name the adapter, skipping all of it when already warm"""
+        if await self.adapter_is_warm():
+            log("⚡ Bluetooth adapter already warm")
+            return True
+
+        log("🔧 Setting up Bluetooth adapter...")
+        await self.runner.run(["rfkill", "unblock", "bluetooth"])
+        success, _, _ = await self.bluetoothctl([
+            "power on",
+            f"system-alias {self.device_name}",
+        ])
+        if success:
+            log("✅ Bluetooth adapter ready")
+        else:
+            log("⚠️  Adapter setup did not report success, continuing")
+        return success
+
+    async def apply_mode(self):
+        """Make the adapter match the current mode"""
+        if self.mode == "pairing":
+            await asyncio.gather(self.bluetoothctl(["discoverable on", "pairable on"]),
+                                 self.suspend_bluetooth_sources(False))
+            await self.route_held()
+            log(f"🔵 Pairing mode: '{self.device_name}' is discoverable")
+        elif self.mode == "playback":
+            await asyncio.gather(self.bluetoothctl(["discoverable off", "pairable off"]),
+                                 self.suspend_bluetooth_sources(False))
+            await self.route_held()
+            log("🎵 Playback mode: accepting paired devices only")
+        else:
+            await asyncio.gather(self.bluetoothctl(["discoverable off", "pairable off"]),
+                                 self.suspend_bluetooth_sources(True))
+            log("💤 Standby: adapter warm, agent registered, audio not routed")
+        self.metrics.set("mode", self.mode)
+        self.metrics.inc("mode_switches")
+
+    async def route_held(self):
+        """Route the phones that connected while in standby"""
+        held, self.held = self.held, set()
+        for mac in held:
+            await self.route_device(mac)
+
+    async def suspend_bluetooth_sources(self, suspend):
+        """Suspend or resume every Bluetooth audio source so nothing is routed while in standby"""
+        if self.audio is not None:
+            sources = [node.name for node in self.audio.bluetooth_sources()]
+        else:
+            success, output, _ = await self.runner.run(["pactl", "list", "short", "sources"], timeout=5)
+            if not success:
+                return
+            sources = [entry.name for entry in parse_pactl_short(output) if entry.name.startswith("bluez")]
+        await asyncio.gather(*[
+            self.runner.run(["pactl", "suspend-source", source, "1" if suspend else "0"], timeout=5)
+            for source in sources
+        ])
+
+    async def suspend_phone_source(self, mac):
+        """Suspend one phone's Bluetooth source, giving the audio model a moment to see it appear"""
+        key = mac.upper().replace(":", "_")
+        if self.audio is not None:
+            source = await self.audio.wait_for(
+                lambda: next((node.name for node in self.audio.bluetooth_sources() if key in node.name), None),
+                timeout=2)
+        else:
+            success, output, _ = await self.runner.run(["pactl", "list", "short", "sources"], timeout=5)
+            source = next((entry.name for entry in parse_pactl_short(output) if key in entry.name),
+                          None) if success else None
+        if source:
+            await self.runner.run(["pactl", "suspend-source", source, "1"], timeout=5)
+
+    async def set_mode(self, mode):
+        """Switch between pairing, playback and standby without tearing anything down"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+        if mode == self.mode:
+            return
+        log(f"🔀 Switching mode: {self.mode} -> {mode}")
+        started = time.monotonic()
+        previous, self.mode = self.mode, mode
+        await self.apply_mode()
+        if previous == "standby":
+            resume = time.monotonic() - started
+            self.metrics.set("resume_seconds", round(resume, 4))
+            log(f"⚡ Resumed from standby in {resume * 1000:.0f} ms")
+
+        # Wake every task sleeping in wait_interval so it picks up the new mode immediately
+        if self.mode_changed is not None:
+            changed, self.mode_changed = self.mode_changed, asyncio.Event()
+            changed.set()
+
+    async def wait_interval(self, seconds):
+        """Sleep for `seconds`, returning early if the mode changes"""
+        # asyncio.wait rather than wait_for: wait_for can swallow a cancel that races the event
+        waiter = asyncio.ensure_future(self.mode_changed.wait())
+        try:
+            await asyncio.wait([waiter], timeout=seconds)
+        finally:
+            waiter.cancel()
+
+    def toggle_mode(self):
+        """Signal handler entry point: flip between pairing and playback"""
+        next_mode = "playback" if self.mode == "pairing" else "pairing"
+        asyncio.ensure_future(self.set_mode(next_mode))
+
+    def toggle_standby(self):
+        """Signal handler entry point: flip between standby and playback"""
+        next_mode = "playback" if self.mode == "standby" else "standby"
+        asyncio.ensure_future(self.set_mode(next_mode))
+
+    async def list_devices(self, *filters):
+        """Return {mac: name} for `bluetoothctl devices [filter]`"""
+        success, output, _ = await self.bluetoothctl(["devices " + " ".join(filters)] if filters else ["devices"])
+        if not success:
+            return {}
+        return {device.mac: device.name for device in parse_devices(output)}
+
+    async def monitor_task(self):
+        """Track connections; in pairing mode, trust new devices for later reconnects"""
+        log("👁️  Monitoring connections...")
+        while True:
+            started = time.monotonic()
+            current = await self.list_devices("Connected")
+
+            for mac in current.keys() - self.connected.keys():
+                log(f"🎉 Device connected: {current[mac]} ({mac})")
+                self.metrics.inc("connections_total")
+                await self.on_connect(mac, current[mac])
+
+            for mac in self.connected.keys() - current.keys():
+                log(f"📱 Device disconnected: {self.connected[mac]}")
+                self.metrics.inc("disconnections_total")
+                await self.on_disconnect(mac, self.connected[mac])
+
+            # A connection on_connect turned away is not tracked, so it never reaches on_disconnect
+            self.connected = {mac: name for mac, name in current.items() if self.keeps_connection(mac)}
+            self.metrics.set("connected_devices", len(self.connected))
+            self.metrics.set("monitor_poll_seconds", round(time.monotonic() - started, 4))
+            await self.wait_interval(self.standby_poll_interval if self.mode == "standby" else self.poll_interval)
+
+    async def on_connect(self, mac, name):
+        """Per-connection hook; records the device and, in pairing mode, trusts it for later reconnects"""
+        self.registry.record_connection(mac, name)
+        try:
+            self.registry.save()
+        except OSError as e:
+            log(f"Registry error: {e}")
+        if self.mode == "pairing":
+            await self.bluetoothctl([f"trust {mac}"])
+            log(f"🔐 Trusted {name} for future connections")
+        if self.mode == "standby":
+            # Standby routes nothing: keep the new phone's source suspended until the mode changes
+            self.held.add(mac)
+            await self.suspend_phone_source(mac)
+            log(f"💤 {name} connected in standby, not routed")
+            return
+        await self.route_device(mac)
+
+    def keeps_connection(self, mac):
+        """Whether on_connect kept `mac`; the hub's controllers turn phones over their limit away"""
+        return True
+
+    async def on_disconnect(self, mac, name):
+        """Per-disconnection hook"""
+        self.held.discard(mac)
+        await self.unroute_device(mac)
+
+    async def route_device(self, mac):
+        """Hand a connected phone to the routing rules; its class is looked up only if a rule filters on it"""
+        if self.router is None:
+            return
+        classes = ()
+        if self.router.engine.uses_class:
+            from routing import device_classes
+
+            success, output, _ = await self.bluetoothctl([f"info {mac}"])
+            classes = device_classes(next(parse_device_info(output), None) if success else None)
+        await self.router.connect(mac, classes, self.zone)
+
+    async def unroute_device(self, mac):
+        if self.router is not None:
+            await self.router.disconnect(mac)
+
+    async def reconnect_task(self):
+        """In playback mode, try to bring back paired devices while nothing is connected"""
+        while True:
+            if self.mode == "playback" and len(self.connected) < self.max_connections:
+                paired = await self.list_devices("Paired")
+                connected = len(self.connected)
+                for mac, name in paired.items():
+                    if mac in self.connected or connected >= self.max_connections:
+                        continue
+                    success, output, _ = await self.bluetoothctl([f"connect {mac}"], timeout=15)
+                    self.metrics.inc("reconnect_attempts")
+                    if success and "Connection successful" in output:
+                        connected += 1
+                        log(f"🔗 Reconnected to {name}")
+            await self.wait_interval(self.reconnect_interval)
+
+    async def agent_task(self):
+        """Keep a NoInputNoOutput agent registered and answer its prompts"""
+        while True:
+            try:
+                session = await self.runner.open_session(["bluetoothctl"])
+            except OSError as e:
+                log(f"Agent error: {e}")
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+
+            session.stdin.write(b"agent NoInputNoOutput\ndefault-agent\n")
+            await session.stdin.drain()
+            self.metrics.set("agent_registered", 1)
+            log("🔓 Pairing agent registered")
+
+            buffer = ""
+            while True:
+                chunk = await session.stdout.read(1024)
+                if not chunk:
+                    break
+                buffer = (buffer + chunk.decode(errors="replace"))[-4096:]
+                # bluetoothctl prompts do not end in a newline, so look at the raw buffer
+                if "(yes/no):" in buffer:
+                    accept = self.auto_accept_pairing and self.mode == "pairing"
+                    session.stdin.write(b"yes\n" if accept else b"no\n")
+                    await session.stdin.drain()
+                    self.metrics.inc("agent_prompts_accepted" if accept else "agent_prompts_rejected")
+                    buffer = ""
+
+            self.metrics.set("agent_registered", 0)
+            await session.wait()
+            log("⚠️  Pairing agent exited, restarting")
+            await asyncio.sleep(1)
+
+    async def metrics_task(self):
+        """Periodically dump metrics for external readers"""
+        last_cpu, last_wall = time.process_time(), time.monotonic()
+        while True:
+            cpu, wall = time.process_time(), time.monotonic()
+            cpu_percent = round(100.0 * (cpu - last_cpu) / max(wall - last_wall, 1e-6), 3)
+            last_cpu, last_wall = cpu, wall
+            self.metrics.set("cpu_seconds", round(cpu, 3))
+            self.metrics.set("cpu_percent", cpu_percent)
+            if self.mode == "standby":
+                self.metrics.set("standby_cpu_percent", cpu_percent)
+            self.metrics.set("profile", self.profile)
+            if self.router is not None:
+                self.metrics.set("routes", len(self.router.routes))
+                self.metrics.set("routing_syncs", self.router.syncs)
+                self.metrics.set("routes_suspended", int(self.router.suspended))
+            if self.metrics_file:
+                try:
+                    self.metrics.write(self.metrics_file)
+                except OSError as e:
+                    log(f"Metrics error: {e}")
+            await asyncio.sleep(self.metrics_interval)
+
+    async def cleanup_audio(self):
+        """Stop audio servers and drop Bluetooth audio modules"""
+        log("🎵 Stopping audio applications...")
+        await asyncio.gather(
+            self.runner.run(["pkill", "-f", "pulseaudio"], timeout=5),
+            self.runner.run(["pkill", "-f", "pipewire"], timeout=5),
+        )
+        await asyncio.sleep(1)
+
+        log("🔊 Cleaning up audio system...")
+        await asyncio.gather(*[
+            self.runner.run(["pactl", "unload-module", module], timeout=5)
+            for module in BLUETOOTH_AUDIO_MODULES
+        ])
+        await self.runner.run(["pactl", "set-default-sink", "@DEFAULT_SINK@"], timeout=5)
+
+        log("🔄 Restarting audio system...")
+        await self.runner.run(["systemctl", "--user", "restart", "pulseaudio"], timeout=10)
+        await asyncio.sleep(2)
+
+    async def cleanup_adapter(self, disconnect=True):
+        """Disconnect devices, disable pairing and power cycle the adapter"""
+        if disconnect:
+            for mac, name in (await self.list_devices("Connected")).items():
+                log(f"Disconnecting {name}...")
+                await self.bluetoothctl([f"disconnect {mac}"])
+
+        log("🔄 Disabling pairing and power cycling Bluetooth...")
+        success, _, _ = await self.bluetoothctl(["discoverable off", "pairable off", "power off", "power on"])
+        if success:
+            log("✅ Bluetooth cleaned up and power cycled")
+        else:
+            log("⚠️  Cleanup did not report success, but likely succeeded")
+
+    async def cleanup_bluetooth(self, disconnect=True):
+        """Full cleanup: audio routes first, then the adapter"""
+        log("🧹 Cleaning up Bluetooth connections and audio routes...")
+        await self.cleanup_audio()
+        await self.cleanup_adapter(disconnect)
+        log("✅ Complete cleanup finished - Bluetooth speaker mode disabled")
+
+    def stop(self):
+        """Ask the main loop to shut down"""
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def open_audio(self):
+        """An in-memory model of the audio server (PipeWire graph or PulseAudio index), else None for pactl calls"""
+        if self.audio_backend not in ("auto", "pipewire", "pulse"):
+            return None
+        from pipewire_graph import PipeWireBackend, is_pipewire
+        from pulse_model import PulseBackend
+
+        if self.audio_backend == "auto":
+            pipewire = await is_pipewire(self.runner)
+        else:
+            pipewire = self.audio_backend == "pipewire"
+        backend = PipeWireBackend(self.runner) if pipewire else PulseBackend(self.runner)
+        try:
+            await backend.start()
+        except (OSError, asyncio.TimeoutError) as e:
+            backend.close()
+            log(f"⚠️  {backend.name} model unavailable ({e or type(e).__name__}); using pactl")
+            return None
+        log(f"🕸️  Audio model ({backend.name}): {len(backend.sinks())} sinks, {len(backend.sources())} sources")
+        backend.loopback_latency_ms = self.loopback_latency_ms
+        if self.quantum and await backend.set_quantum(self.quantum):
+            log(f"⏱️  {self.profile} profile: quantum {self.quantum} frames")
+        return backend
+
+    async def start(self, run_agent=True):
+        """Bring the adapter up and start the background tasks"""
+        self.mode_changed = asyncio.Event()
+        self.stopping = asyncio.Event()
+
+        if self.audio_backend != "shared":
+            self.audio = await self.open_audio()
+            if self.audio is not None:
+                from routing import Router, RoutingEngine
+
+                engine = RoutingEngine.from_config(self.config)
+                if engine.active:
+                    self.router = Router(engine, self.audio)
+        await self.setup_adapter()
+        await self.apply_mode()
+
+        self.tasks = [
+            asyncio.ensure_future(self.monitor_task()),
+            asyncio.ensure_future(self.reconnect_task()),
+            asyncio.ensure_future(self.metrics_task()),
+        ]
+        if run_agent:
+            self.tasks.append(asyncio.ensure_future(self.agent_task()))
+        if self.router is not None and self.audio_backend != "shared":
+            self.tasks.append(asyncio.ensure_future(self.router.run()))
+            if self.suspend_on_silence:
+                self.silence = self.watch_silence(lambda: self.router.sources.values(), self.router.suspend)
+                self.tasks.append(asyncio.ensure_future(self.silence.run()))
+
+    def watch_silence(self, sources, on_change):
+        """SilenceWatch over the routed phone sources, configured like the pipeline's detector"""
+        from silence import SilenceWatch
+
+        return SilenceWatch.from_config(self.config, self.runner, sources, on_change)
+
+    async def shutdown(self, cleanup_audio=True):
+        """Cancel the background tasks and clean up"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.router is not None and self.audio_backend != "shared":
+            await self.router.clear()
+            self.router = None
+        if self.exit_to_standby:
+            # Leave the adapter powered and the audio server alone so the next start is warm
+            self.mode = "standby"
+            await self.apply_mode()
+        elif cleanup_audio:
+            await self.cleanup_bluetooth()
+        else:
+            await self.cleanup_adapter()
+        if self.audio is not None and self.audio_backend != "shared":
+            if self.quantum:
+                await self.audio.set_quantum(0)
+            self.audio.close()
+            self.audio = None
+        if self.metrics_file:
+            self.metrics.write(self.metrics_file)
+
+    async def diagnostics_task(self):
+        """System checks once the adapter is up; cached facts keep this to the live checks"""
+        from diagnostics import Diagnostics, write_report
+
+        report = await Diagnostics.from_config(self.config, runner=self.runner).run()
+        self.metrics.set("diagnostics_errors", report["errors"])
+        self.metrics.set("diagnostics_seconds", report["seconds"])
+        for result in report["checks"]:
+            if result["status"] in ("fail", "warn"):
+                log(f"⚠️  {result['name']}: {result['detail']}" + (f" (try: {result['fix']})" if result["fix"] else ""))
+        log(f"🩺 Diagnostics: {report['errors']} error(s) in {report['seconds'] * 1000:.0f} ms")
+        if self.diagnostics_file:
+            try:
+                write_report(report, self.diagnostics_file)
+            except OSError as e:
+                log(f"Diagnostics report error: {e}")
+
+    async def run(self):
+        """Main entry: set up once, then run all tasks concurrently until stopped"""
+        log("🎵 Bluetooth Speaker - Daemon")
+        await self.start()
+        if self.diagnostics_at_start:
+            self.tasks.append(asyncio.ensure_future(self.diagnostics_task()))
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+        loop.add_signal_handler(signal.SIGUSR1, self.toggle_mode)
+        loop.add_signal_handler(signal.SIGUSR2, self.toggle_standby)
+        log(f"⏹️  Press Ctrl+C to stop; kill -USR1 {os.getpid()} toggles pairing, -USR2 toggles standby")
+
+        try:
+            await self.stopping.wait()
+        finally:
+            log("🛑 Stopping daemon...")
+            await self.shutdown()
+        return True
+
+
+async def measure_standby(daemon, seconds):
+    """Idle in standby for `seconds`, then time the resume to playback"""
+    await daemon.start()
+    await daemon.set_mode("standby")
+    cpu, wall = time.process_time(), time.monotonic()
+    await asyncio.sleep(seconds)
+    cpu_percent = 100.0 * (time.process_time() - cpu) / (time.monotonic() - wall)
+    await daemon.set_mode("playback")
+    resume = daemon.metrics.get("resume_seconds")
+    daemon.exit_to_standby = True
+    await daemon.shutdown()
+    return cpu_percent, resume
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bluetooth speaker daemon")
+    parser.add_argument("--mode", choices=MODES, help="initial mode (default from config.ini)")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--measure-standby", type=float, metavar="SECONDS",
+                        help="idle in standby, then report CPU use and resume latency")
+    parser.add_argument("--fake", action="store_true", help="use simulated tools (with --measure-standby)")
+    args = parser.parse_args(argv)
+
+    runner = None
+    if args.fake:
+        from fake_tools import FakeRunner, make_adapters
+        runner = FakeRunner(make_adapters(1, latency=0.02))
+
+    daemon = BluetoothDaemon(config_file=args.config, mode=args.mode, runner=runner)
+    if args.measure_standby:
+        daemon.metrics_file = None
+        cpu_percent, resume = asyncio.run(measure_standby(daemon, args.measure_standby))
+        print(f"standby CPU: {cpu_percent:.3f}%  resume to playback: {resume * 1000:.1f} ms")
+        return 0
+    try:
+        asyncio.run(daemon.run())
+    except Exception as e:
+        log(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
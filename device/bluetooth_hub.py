@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Multi-Adapter Hub
+Drives several hci controllers from one process, one state machine per adapter
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from bluetooth_daemon import DEFAULT_CONFIG, BluetoothDaemon, CommandRunner, load_config, log
+from metrics import Metrics
+from routing import Router, RoutingEngine
+from tool_parsers import parse_pactl_short
+
+PAIRING_POLICIES = ("open", "closed")
+
+
+class AdapterConfig:
+    def __init__(self, name, address, alias, pairing_policy="closed", max_connections=1, sink=None):
+        if pairing_policy not in PAIRING_POLICIES:
+            raise ValueError(f"Unknown pairing policy for {name}: {pairing_policy}")
+        self.name = name
+        self.address = address
+        self.alias = alias
+        self.pairing_policy = pairing_policy
+        self.max_connections = max_connections
+        self.sink = sink
+
+    @classmethod
+    def from_section(cls, name, section):
+        """Build from an `[adapter:<name>]` config section"""
+        return cls(
+            name=name,
+            address=section.get("address"),
+            alias=section.get("alias", fallback=name),
+            pairing_policy=section.get("pairing_policy", fallback="closed"),
+            max_connections=section.getint("max_connections", fallback=1),
+            sink=section.get("sink", fallback=None) or None,
+        )
+
+
+def load_adapters(config):
+    """All `[adapter:*]` sections of config.ini, in file order"""
+    return [
+        AdapterConfig.from_section(section.split(":", 1)[1], config[section])
+        for section in config.sections()
+        if section.startswith("adapter:")
+    ]
+
+
+class AdapterController(BluetoothDaemon):
+    """Per-adapter state machine: idle -> starting -> ready -> stopping -> stopped (or failed)"""
+
+    def __init__(self, adapter, config_file=DEFAULT_CONFIG, runner=None):
+        mode = "pairing" if adapter.pairing_policy == "open" else "playback"
+        super().__init__(config_file=config_file, mode=mode, runner=runner, controller=adapter.address)
+        self.adapter = adapter
+        self.device_name = adapter.alias
+        self.auto_accept_pairing = adapter.pairing_policy == "open"
+        self.max_connections = adapter.max_connections
+        self.metrics_file = None
+        self.zone = adapter.name
+        self.state = "idle"
+        self.loopbacks = {}  # mac -> (source, loopback module, None while suspended)
+        self.loopbacks_suspended = False
+        self.accepted = set()
+
+    def set_state(self, state):
+        self.state = state
+        self.metrics.set("state", state)
+
+    async def start(self, run_agent=False):
+        self.set_state("starting")
+        try:
+            await super().start(run_agent=run_agent)
+        except Exception:
+            self.set_state("failed")
+            raise
+        self.set_state("ready")
+
+    async def shutdown(self, cleanup_audio=False):
+        self.set_state("stopping")
+        for mac in list(self.loopbacks):
+            await self.unroute_device(mac)
+        await super().shutdown(cleanup_audio=cleanup_audio)
+        self.set_state("stopped")
+
+    async def on_connect(self, mac, name):
+        # Count accepted connections as they happen: one poll can report a burst of new phones
+        if len(self.accepted) >= self.max_connections:
+            log(f"⛔ [{self.adapter.name}] Connection limit reached, disconnecting {name}")
+            await self.bluetoothctl([f"disconnect {mac}"])
+            self.metrics.inc("connections_rejected")
+            return
+        self.accepted.add(mac)
+        await super().on_connect(mac, name)
+
+    def keeps_connection(self, mac):
+        return mac in self.accepted
+
+    async def on_disconnect(self, mac, name):
+        self.accepted.discard(mac)
+        await super().on_disconnect(mac, name)
+
+    async def route_device(self, mac):
+        """Loop the phone's Bluetooth source into this adapter's mapped sink"""
+        if self.router is not None:
+            await super().route_device(mac)
+            return
+        if not self.adapter.sink:
+            return
+        key = mac.replace(":", "_")
+        source = f"bluez_source.{key}.a2dp_source"
+        success, output, _ = await self.runner.run(["pactl", "list", "short", "sources"])
+        if success:
+            for entry in parse_pactl_short(output):
+                if key in entry.name:
+                    source = entry.name
+                    break
+        module = None if self.loopbacks_suspended else await self._load_loopback(source)
+        if module is None and not self.loopbacks_suspended:
+            return
+        self.loopbacks[mac] = (source, module)
+        log(f"🔊 [{self.adapter.name}] Routing {mac} -> {self.adapter.sink}")
+
+    async def _load_loopback(self, source):
+        latency = [f"latency_msec={self.loopback_latency_ms}"] if self.loopback_latency_ms else []
+        success, output, _ = await self.runner.run([
+            "pactl", "load-module", "module-loopback", f"source={source}", f"sink={self.adapter.sink}", *latency,
+        ])
+        return output.strip() if success and output.strip().isdigit() else None
+
+    async def unroute_device(self, mac):
+        if self.router is not None:
+            await super().unroute_device(mac)
+            return
+        _, module = self.loopbacks.pop(mac, (None, None))
+        if module is not None:
+            await self.runner.run(["pactl", "unload-module", module])
+
+    async def suspend_loopbacks(self, suspended):
+        """Unload this adapter's loopbacks while every phone is silent, and load them again after"""
+        self.loopbacks_suspended = suspended
+        for mac, (source, module) in list(self.loopbacks.items()):
+            if suspended and module is not None:
+                await self.runner.run(["pactl", "unload-module", module])
+                self.loopbacks[mac] = (source, None)
+            elif not suspended and module is None:
+                self.loopbacks[mac] = (source, await self._load_loopback(source))
+
+
+class BluetoothHub:
+    def __init__(self, adapters, config_file=DEFAULT_CONFIG, runner=None, setup_timeout=30):
+        config = self.config = load_config(config_file)
+        self.config_file = config_file
+        self.runner = runner or CommandRunner()
+        self.controllers = [AdapterController(adapter, config_file, self.runner) for adapter in adapters]
+        for controller in self.controllers[1:]:
+            controller.registry = self.controllers[0].registry
+        self.setup_timeout = setup_timeout
+        self.metrics = Metrics()
+        self.metrics_interval = config.getfloat("daemon", "metrics_interval", fallback=10.0)
+        self.metrics_file = config.get("daemon", "metrics_file", fallback="/tmp/bluetooth_speaker_metrics.json")
+        self.agent = None
+        self.audio = None
+        self.router = None
+        self.silence = None
+        self.tasks = []
+        self.stopping = None
+
+    async def start_controller(self, controller):
+        """Start one adapter; a slow or broken adapter only fails itself"""
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(controller.start(), self.setup_timeout)
+            controller.metrics.set("startup_seconds", round(time.monotonic() - started, 4))
+            log(f"✅ [{controller.adapter.name}] {controller.adapter.address} ready ({controller.mode})")
+        except Exception as e:
+            controller.set_state("failed")
+            log(f"❌ [{controller.adapter.name}] Failed to start: {e or type(e).__name__}")
+
+    async def start(self, run_agent=True):
+        """Start every adapter concurrently"""
+        self.stopping = asyncio.Event()
+        if self.controllers:
+            # One audio model and one set of routes serve every adapter
+            self.audio = await self.controllers[0].open_audio()
+            if self.audio is not None:
+                engine = RoutingEngine.from_config(self.config, [c.adapter for c in self.controllers])
+                if engine.active:
+                    self.router = Router(engine, self.audio)
+                    self.tasks.append(asyncio.ensure_future(self.router.run()))
+            for controller in self.controllers:
+                controller.audio, controller.router, controller.audio_backend = self.audio, self.router, "shared"
+            if self.controllers[0].suspend_on_silence:
+                if self.router is not None:
+                    self.silence = self.controllers[0].watch_silence(
+                        lambda: self.router.sources.values(), self.router.suspend)
+                else:
+                    self.silence = self.controllers[0].watch_silence(self.loopback_sources, self.suspend_loopbacks)
+                self.tasks.append(asyncio.ensure_future(self.silence.run()))
+        await asyncio.gather(*[self.start_controller(c) for c in self.controllers])
+        if run_agent:
+            # BlueZ has one default agent per system, so the hub owns it and defers to adapter policies
+            self.agent = BluetoothDaemon(config_file=self.config_file, mode="pairing", runner=self.runner)
+            self.agent.auto_accept_pairing = any(c.auto_accept_pairing for c in self.controllers)
+            self.agent.metrics = self.metrics
+            self.tasks.append(asyncio.ensure_future(self.agent.agent_task()))
+        self.tasks.append(asyncio.ensure_future(self.metrics_task()))
+
+    async def shutdown(self):
+        """Stop every adapter concurrently, then clean up audio once"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.router is not None:
+            await self.router.clear()
+        await asyncio.gather(*[c.shutdown() for c in self.controllers if c.state != "failed"],
+                             return_exceptions=True)
+        if self.audio is not None:
+            if self.controllers[0].quantum:
+                await self.audio.set_quantum(0)
+            self.audio.close()
+        if self.controllers:
+            await self.controllers[0].cleanup_audio()
+
+    def loopback_sources(self):
+        """Phone sources of the per-adapter loopbacks (the path used without an audio model)"""
+        return {source for controller in self.controllers for source, _ in controller.loopbacks.values()}
+
+    async def suspend_loopbacks(self, suspended):
+        log("💤 Silent - unloading loopbacks" if suspended else "🔊 Sound again - reloading loopbacks")
+        await asyncio.gather(*[c.suspend_loopbacks(suspended) for c in self.controllers])
+
+    def collect_metrics(self):
+        for controller in self.controllers:
+            for key, value in controller.metrics.values.items():
+                self.metrics.set(f"{controller.adapter.name}.{key}", value)
+        self.metrics.set("adapters_ready", sum(c.state == "ready" for c in self.controllers))
+
+    async def metrics_task(self):
+        while True:
+            self.collect_metrics()
+            self.metrics.set("cpu_seconds", round(time.process_time(), 3))
+            if self.metrics_file:
+                try:
+                    self.metrics.write(self.metrics_file)
+                except OSError as e:
+                    log(f"Metrics error: {e}")
+            await asyncio.sleep(self.metrics_interval)
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def run(self):
+        log(f"🎵 Bluetooth Speaker - Hub ({len(self.controllers)} adapters)")
+        await self.start()
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+        log(f"⏹️  Press Ctrl+C to stop (pid {os.getpid()})")
+
+        try:
+            await self.stopping.wait()
+        finally:
+            log("🛑 Stopping hub...")
+            await self.shutdown()
+        return True
+
+
+async def benchmark(counts=(1, 4, 16), latency=0.02, slow_latency=0.5, polls=5):
+    """Time start-up and monitor polling for N simulated adapters, one of them slow"""
+    from fake_tools import FakeRunner, make_adapters
+
+    results = []
+    for count in counts:
+        fakes = make_adapters(count, latency=latency, slow_latency=slow_latency if count > 1 else None)
+        runner = FakeRunner(fakes)
+        adapters = [AdapterConfig(f"zone{i}", fake.address, f"Speaker-{i}") for i, fake in enumerate(fakes)]
+        hub = BluetoothHub(adapters, runner=runner)
+        hub.metrics_file = None
+        for controller in hub.controllers:
+            controller.poll_interval = 3600
+            controller.reconnect_interval = 3600
+
+        started = time.perf_counter()
+        await hub.start(run_agent=False)
+        startup = time.perf_counter() - started
+
+        # Fast adapters must come up and poll without waiting for the slow one
+        fast = hub.controllers[1:] or hub.controllers
+        fast_startup = max(c.metrics.get("startup_seconds") for c in fast)
+        durations = []
+
+        async def timed_poll(controller):
+            started = time.perf_counter()
+            await controller.list_devices("Connected")
+            durations.append(time.perf_counter() - started)
+
+        for _ in range(polls):
+            await asyncio.gather(*[timed_poll(c) for c in fast])
+        poll = sum(durations) / len(durations)
+
+        await hub.shutdown()
+
+        serial = sum(fake.commands * fake.latency for fake in fakes)
+        results.append((count, startup, fast_startup, poll, serial))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive several Bluetooth adapters from one process")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--benchmark", action="store_true", help="benchmark with simulated adapters")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        results = asyncio.run(benchmark())
+        print(f"{'adapters':>8} {'all up s':>9} {'fast up s':>10} {'poll s':>8} {'serial-equiv s':>15}")
+        for count, startup, fast_startup, poll, serial in results:
+            print(f"{count:>8} {startup:>9.3f} {fast_startup:>10.3f} {poll:>8.3f} {serial:>15.3f}")
+        return 0
+
+    adapters = load_adapters(load_config(args.config))
+    if not adapters:
+        log("❌ No [adapter:*] sections in config.ini")
+        return 1
+    try:
+        asyncio.run(BluetoothHub(adapters, config_file=args.config).run())
+    except Exception as e:
+        log(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
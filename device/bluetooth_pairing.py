@@ -4,11 +4,16 @@ Bluetooth Speaker - Pairing Mode
 Enables pairing mode so new devices can connect to your laptop as a Bluetooth speaker
 """
 
+import asyncio
 import subprocess
 import time
 import signal
 import sys
 
+from bluetooth_daemon import BluetoothDaemon
+from pairing_maintenance import PairingMaintenance
+from tool_parsers import parse_controller_info, parse_device_info, parse_devices
+
 class BluetoothPairing:
     def __init__(self):
         self.device_name = "Ubuntu-Speaker"
@@ -34,15 +39,11 @@ class BluetoothPairing:
         """Remove any existing problematic pairings"""
         self.log("🧹 Clearing old pairings...")
         
-        success, output, _ = self.run_command("bluetoothctl paired-devices")
-        if success and output.strip():
-            for line in output.strip().split('\n'):
-                if line.strip() and 'Device' in line:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        mac = parts[1]
-                        self.log(f"Removing old pairing: {mac}")
-                        self.run_command(f"echo 'remove {mac}' | bluetoothctl")
+        try:
+            removed = asyncio.run(PairingMaintenance(progress=lambda *args: None).remove_all())
+            self.log(f"Removed {len(removed)} old pairing(s)")
+        except Exception as e:
+            self.log(f"Could not clear pairings: {e}")
     
     def setup_pairing_mode(self):
         """Enable pairing mode for new device connections"""
@@ -94,15 +95,12 @@ quit
         # Get bluetooth status
         success, output, _ = self.run_command("bluetoothctl show")
         if success:
-            for line in output.split('\n'):
-                if 'Alias:' in line:
-                    print(f"✅ {line.strip()}")
-                elif 'Powered:' in line:
-                    print(f"✅ {line.strip()}")
-                elif 'Discoverable:' in line:
-                    print(f"✅ {line.strip()}")
-                elif 'Pairable:' in line:
-                    print(f"✅ {line.strip()}")
+            yes_no = lambda flag: "yes" if flag else "no"
+            for controller in parse_controller_info(output):
+                print(f"✅ Alias: {controller.alias}")
+                print(f"✅ Powered: {yes_no(controller.powered)}")
+                print(f"✅ Discoverable: {yes_no(controller.discoverable)}")
+                print(f"✅ Pairable: {yes_no(controller.pairable)}")
         
         print("=" * 50)
     
@@ -117,19 +115,13 @@ quit
                 success, output, _ = self.run_command("bluetoothctl devices")
                 
                 if success and output.strip():
-                    for line in output.strip().split('\n'):
-                        if line.strip() and 'Device' in line:
-                            parts = line.split(' ', 2)
-                            if len(parts) >= 3:
-                                mac = parts[1]
-                                name = parts[2]
-                                
-                                # Check if device is connected
-                                conn_success, conn_output, _ = self.run_command(f"bluetoothctl info {mac}")
-                                if conn_success and "Connected: yes" in conn_output:
-                                    self.log(f"🎉 Device paired and connected: {name} ({mac})")
-                                    # Auto-trust for future connections
-                                    self.run_command(f"echo 'trust {mac}' | bluetoothctl")
+                    for device in parse_devices(output):
+                        # Check if device is connected
+                        conn_success, conn_output, _ = self.run_command(f"bluetoothctl info {device.mac}")
+                        if conn_success and any(info.connected for info in parse_device_info(conn_output)):
+                            self.log(f"🎉 Device paired and connected: {device.name} ({device.mac})")
+                            # Auto-trust for future connections
+                            self.run_command(f"echo 'trust {device.mac}' | bluetoothctl")
                 
                 time.sleep(5)
                 
@@ -141,80 +133,8 @@ quit
     
     def cleanup_bluetooth(self):
         """Clean up Bluetooth pairing mode, audio routes, and disable pairing/discoverable mode"""
-        self.log("🧹 Cleaning up Bluetooth pairing mode and audio routes...")
-        
         try:
-            # Stop all audio applications first
-            self.log("🎵 Stopping audio applications...")
-            self.run_command("pkill -f pulseaudio", timeout=5)
-            self.run_command("pkill -f pipewire", timeout=5)
-            time.sleep(1)
-            
-            # Clean up audio system
-            self.log("🔊 Cleaning up audio system...")
-            
-            # Remove Bluetooth audio modules from PulseAudio
-            audio_cleanup_commands = [
-                "pactl unload-module module-bluetooth-discover",
-                "pactl unload-module module-bluetooth-policy", 
-                "pactl unload-module module-bluez5-discover",
-                "pactl unload-module module-bluez5-device",
-            ]
-            
-            for cmd in audio_cleanup_commands:
-                self.run_command(cmd, timeout=5)
-            
-            # Reset audio to default state
-            self.run_command("pactl set-default-sink @DEFAULT_SINK@", timeout=5)
-            
-            # Restart audio system to clean state
-            self.log("🔄 Restarting audio system...")
-            self.run_command("systemctl --user restart pulseaudio", timeout=10)
-            time.sleep(2)
-            
-            # Disable pairing and discoverable mode
-            bt_cleanup = """
-discoverable off
-pairable off
-quit
-"""
-            
-            process = subprocess.Popen(['bluetoothctl'], 
-                                     stdin=subprocess.PIPE, 
-                                     stdout=subprocess.PIPE, 
-                                     stderr=subprocess.PIPE,
-                                     text=True)
-            
-            try:
-                process.communicate(input=bt_cleanup, timeout=10)
-                self.log("✅ Pairing mode disabled")
-            except subprocess.TimeoutExpired:
-                process.kill()
-                self.log("⚠️  Cleanup timeout, but likely succeeded")
-            
-            # Power cycle Bluetooth to ensure clean state
-            self.log("🔄 Power cycling Bluetooth...")
-            bt_power_cycle = """
-power off
-power on
-quit
-"""
-            
-            process = subprocess.Popen(['bluetoothctl'], 
-                                     stdin=subprocess.PIPE, 
-                                     stdout=subprocess.PIPE, 
-                                     stderr=subprocess.PIPE,
-                                     text=True)
-            
-            try:
-                process.communicate(input=bt_power_cycle, timeout=10)
-                self.log("✅ Bluetooth power cycled")
-            except subprocess.TimeoutExpired:
-                process.kill()
-                self.log("⚠️  Power cycle timeout")
-            
-            self.log("✅ Complete cleanup finished - Bluetooth speaker mode disabled")
-                
+            asyncio.run(BluetoothDaemon().cleanup_bluetooth(disconnect=False))
         except Exception as e:
             self.log(f"Cleanup error: {e}")
 
@@ -4,11 +4,15 @@ Bluetooth Speaker - Audio Player
 Connects to already paired devices and routes audio to laptop speakers
 """
 
+import asyncio
 import subprocess
 import time
 import signal
 import sys
 
+from bluetooth_daemon import BluetoothDaemon
+from tool_parsers import parse_devices, parse_pactl_short
+
 class BluetoothPlayer:
     def __init__(self):
         self.device_name = "Ubuntu-Speaker"
@@ -77,14 +81,9 @@ quit
         
         if success and output.strip():
             print("📋 Paired devices:")
-            for line in output.strip().split('\n'):
-                if line.strip() and 'Device' in line:
-                    parts = line.split(' ', 2)
-                    if len(parts) >= 3:
-                        mac = parts[1]
-                        name = parts[2]
-                        devices.append((mac, name))
-                        print(f"   • {name} ({mac})")
+            for device in parse_devices(output):
+                devices.append((device.mac, device.name))
+                print(f"   • {device.name} ({device.mac})")
         else:
             print("   No paired devices found")
             
@@ -117,11 +116,8 @@ quit
         success, output, _ = self.run_command("pactl list short sinks")
         if success and output.strip():
             print("🔊 Available audio outputs:")
-            for line in output.strip().split('\n'):
-                if line.strip():
-                    parts = line.split('\t')
-                    if len(parts) >= 2:
-                        print(f"   • {parts[1]}")
+            for sink in parse_pactl_short(output):
+                print(f"   • {sink.name}")
         
         print("=" * 50)
     
@@ -129,35 +125,25 @@ quit
         """Monitor connected devices and audio"""
         self.log("👁️  Monitoring connections...")
         
-        last_connected = set()
+        last_connected = {}
         
         while self.running:
             try:
                 # Get currently connected devices
                 success, output, _ = self.run_command("bluetoothctl devices Connected")
                 
-                current_connected = set()
-                if success and output.strip():
-                    for line in output.strip().split('\n'):
-                        if line.strip():
-                            current_connected.add(line.strip())
+                current_connected = {}
+                if success:
+                    current_connected = {device.mac: device.name for device in parse_devices(output)}
                 
                 # Check for new connections
-                new_connections = current_connected - last_connected
-                for device in new_connections:
-                    device_info = device.split(' ', 2)
-                    if len(device_info) >= 3:
-                        name = device_info[2]
-                        self.log(f"🎉 Device connected: {name}")
-                        self.log("🎵 Ready to receive audio!")
+                for mac in current_connected.keys() - last_connected.keys():
+                    self.log(f"🎉 Device connected: {current_connected[mac]}")
+                    self.log("🎵 Ready to receive audio!")
                 
                 # Check for disconnections
-                lost_connections = last_connected - current_connected
-                for device in lost_connections:
-                    device_info = device.split(' ', 2)
-                    if len(device_info) >= 3:
-                        name = device_info[2]
-                        self.log(f"📱 Device disconnected: {name}")
+                for mac in last_connected.keys() - current_connected.keys():
+                    self.log(f"📱 Device disconnected: {last_connected[mac]}")
                 
                 last_connected = current_connected
                 
@@ -166,11 +152,8 @@ quit
                     if len(current_connected) != len(last_connected):  # Status changed
                         print("\n" + "=" * 50)
                         print("📱 Currently connected devices:")
-                        for device in current_connected:
-                            device_info = device.split(' ', 2)
-                            if len(device_info) >= 3:
-                                name = device_info[2]
-                                print(f"   • {name}")
+                        for name in current_connected.values():
+                            print(f"   • {name}")
                         print("🎵 Play music from your phone - audio will play through laptop speakers!")
                         print("=" * 50)
                 else:
@@ -188,92 +171,8 @@ quit
     
     def cleanup_bluetooth(self):
         """Clean up Bluetooth connections, audio routes, and disable discoverable mode"""
-        self.log("🧹 Cleaning up Bluetooth connections and audio routes...")
-        
         try:
-            # Stop all audio applications first
-            self.log("🎵 Stopping audio applications...")
-            self.run_command("pkill -f pulseaudio", timeout=5)
-            self.run_command("pkill -f pipewire", timeout=5)
-            time.sleep(1)
-            
-            # Get currently connected devices and disconnect them
-            success, output, _ = self.run_command("bluetoothctl devices Connected")
-            if success and output.strip():
-                for line in output.strip().split('\n'):
-                    if line.strip() and 'Device' in line:
-                        parts = line.split(' ', 2)
-                        if len(parts) >= 3:
-                            mac = parts[1]
-                            name = parts[2]
-                            self.log(f"Disconnecting {name}...")
-                            self.run_command(f"echo 'disconnect {mac}' | bluetoothctl")
-            
-            # Clean up audio system
-            self.log("🔊 Cleaning up audio system...")
-            
-            # Remove Bluetooth audio modules from PulseAudio
-            audio_cleanup_commands = [
-                "pactl unload-module module-bluetooth-discover",
-                "pactl unload-module module-bluetooth-policy", 
-                "pactl unload-module module-bluez5-discover",
-                "pactl unload-module module-bluez5-device",
-            ]
-            
-            for cmd in audio_cleanup_commands:
-                self.run_command(cmd, timeout=5)
-            
-            # Reset audio to default state
-            self.run_command("pactl set-default-sink @DEFAULT_SINK@", timeout=5)
-            
-            # Restart audio system to clean state
-            self.log("🔄 Restarting audio system...")
-            self.run_command("systemctl --user restart pulseaudio", timeout=10)
-            time.sleep(2)
-            
-            # Reset Bluetooth to non-discoverable state
-            bt_cleanup = """
-discoverable off
-pairable off
-quit
-"""
-            
-            process = subprocess.Popen(['bluetoothctl'], 
-                                     stdin=subprocess.PIPE, 
-                                     stdout=subprocess.PIPE, 
-                                     stderr=subprocess.PIPE,
-                                     text=True)
-            
-            try:
-                process.communicate(input=bt_cleanup, timeout=10)
-                self.log("✅ Bluetooth cleaned up")
-            except subprocess.TimeoutExpired:
-                process.kill()
-                self.log("⚠️  Cleanup timeout, but likely succeeded")
-                
-            # Power cycle Bluetooth to ensure clean state
-            self.log("🔄 Power cycling Bluetooth...")
-            bt_power_cycle = """
-power off
-power on
-quit
-"""
-            
-            process = subprocess.Popen(['bluetoothctl'], 
-                                     stdin=subprocess.PIPE, 
-                                     stdout=subprocess.PIPE, 
-                                     stderr=subprocess.PIPE,
-                                     text=True)
-            
-            try:
-                process.communicate(input=bt_power_cycle, timeout=10)
-                self.log("✅ Bluetooth power cycled")
-            except subprocess.TimeoutExpired:
-                process.kill()
-                self.log("⚠️  Power cycle timeout")
-            
-            self.log("✅ Complete cleanup finished - Bluetooth speaker mode disabled")
-                
+            asyncio.run(BluetoothDaemon().cleanup_bluetooth(disconnect=True))
         except Exception as e:
             self.log(f"Cleanup error: {e}")
 
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - btsnoop Analyzer
+A2DP media packet timing from HCI captures (`btmon -w`), to tell radio dropouts from our own
+
+The file is read in fixed-size chunks; only record boundaries are walked in Python. Header
+fields of every record in a chunk are gathered with NumPy, and what is kept per media packet
+(arrival time, length, RTP sequence/timestamp) is a few bytes, so multi-GB captures need
+memory for their packet count, not their size.
+
+Supported link types: 1001 (HCI, no packet type byte), 1002 (H4 UART) and 2001 (Linux
+monitor, what btmon writes). Media channels are the second and later AVDTP (PSM 0x19) L2CAP
+channels of a connection when the capture has their setup; otherwise a dynamic channel
+carrying RTP version 2 with one SSRC and consecutive sequence numbers is taken as media.
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+MAGIC = b"btsnoop\0"
+FILE_HEADER = struct.Struct(">8sII")
+RECORD = struct.Struct(">IIIIq")
+_INCLUDED = struct.Struct(">I")
+# Microseconds from 0000-01-01 to 1970-01-01, the btsnoop time base
+EPOCH_US = 0x00DCDDB30F2F8000
+
+LINK_HCI = 1001
+LINK_H4 = 1002
+LINK_MONITOR = 2001
+MONITOR_ACL_TX = 4
+MONITOR_ACL_RX = 5
+H4_ACL = 2
+
+SIGNALLING_CID = 0x0001
+FIRST_DYNAMIC_CID = 0x0040
+PSM_AVDTP = 0x0019
+RTP_HEADER = 12
+RTP_CLOCKS = (8000, 16000, 32000, 44100, 48000, 88200, 96000)
+CHUNK_BYTES = 16 << 20
+
+# Per media packet: arrival (us), L2CAP payload length, RTP fields, media frames in the packet
+PACKET_FIELDS = ("time", "length", "sequence", "timestamp", "ssrc", "payload_type", "frames")
+
+
+def _gather(data, positions, width, dtype):
+    """Big- or little-endian field of `width` bytes at each position, as one vectorized read"""
+    raw = data[positions[:, None] + np.arange(width)]
+    return np.ascontiguousarray(raw).view(dtype).ravel()
+
+
+class Capture:
+    """Streaming pass over a btsnoop file: L2CAP setup per connection, media candidates per channel"""
+
+    def __init__(self, path, chunk_bytes=CHUNK_BYTES):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.link_type = None
+        self.records = 0
+        self.truncated = 0       # records saved with fewer bytes than were on the air (snaplen)
+        self.dropped = 0         # records the capture tool itself reported losing
+        self.first_us = None
+        self.last_us = None
+        self.bytes = 0
+        # (index, handle) -> {cid: (psm, order of the channel among that PSM's channels)}
+        self.channels = defaultdict(dict)
+        self._pending = {}       # (index, handle, identifier) -> PSM of a connection request
+        self._opened = defaultdict(int)  # (index, handle, psm) -> channels opened so far
+        self._parts = defaultdict(list)  # stream key -> list of per-chunk field arrays
+        self._dynamic = defaultdict(int)  # stream key -> dynamic-channel packets seen
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                raise ValueError(f"{self.path} is too short for a btsnoop file")
+            magic, version, self.link_type = FILE_HEADER.unpack(header)
+            if magic != MAGIC or version != 1:
+                raise ValueError(f"{self.path} is not a version 1 btsnoop file")
+            if self.link_type not in (LINK_HCI, LINK_H4, LINK_MONITOR):
+                raise ValueError(f"unsupported btsnoop link type {self.link_type}")
+            self.bytes = FILE_HEADER.size
+            carry = b""
+            while True:
+                chunk = f.read(self.chunk_bytes)
+                if not chunk:
+                    break
+                buffer = carry + chunk if carry else chunk
+                consumed = self._chunk(buffer)
+                carry = buffer[consumed:]
+                self.bytes += consumed
+        return self
+
+    def _chunk(self, buffer):
+        """Parse the complete records at the start of `buffer`; returns the bytes they span"""
+        offsets = []
+        position, end = 0, len(buffer)
+        unpack = _INCLUDED.unpack_from
+        while position + RECORD.size <= end:
+            record_end = position + RECORD.size + unpack(buffer, position + 4)[0]
+            if record_end > end:
+                break
+            offsets.append(position)
+            position = record_end
+        if not offsets:
+            return position
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        offsets = np.array(offsets, dtype=np.int64)
+        original = _gather(data, offsets, 4, ">u4")
+        included = _gather(data, offsets + 4, 4, ">u4").astype(np.int64)
+        flags = _gather(data, offsets + 8, 4, ">u4")
+        drops = _gather(data, offsets + 12, 4, ">u4")
+        stamps = _gather(data, offsets + 16, 8, ">i8")
+        self.records += len(offsets)
+        self.truncated += int(np.count_nonzero(included < original))
+        self.dropped = max(self.dropped, int(drops.max()))
+        if self.first_us is None:
+            self.first_us = int(stamps[0])
+        self.last_us = int(stamps[-1])
+
+        start = offsets + RECORD.size
+        if self.link_type == LINK_MONITOR:
+            opcode = flags & 0xFFFF
+            acl = (opcode == MONITOR_ACL_TX) | (opcode == MONITOR_ACL_RX)
+            received = opcode == MONITOR_ACL_RX
+            index = (flags >> 16).astype(np.int64)
+        else:
+            received = (flags & 1) == 1
+            index = np.zeros(len(offsets), dtype=np.int64)
+            if self.link_type == LINK_H4:
+                acl = (included > 0) & (data[np.minimum(start, len(data) - 1)] == H4_ACL)
+                start = start + 1
+            else:
+                acl = (flags & 2) == 0
+        available = included - (start - offsets - RECORD.size)
+        # ACL header (4) + L2CAP header (4); only first fragments carry the L2CAP header
+        keep = acl & (available >= 8)
+        start, available, index, received, stamps = (
+            start[keep], available[keep], index[keep], received[keep], stamps[keep])
+        handle_flags = _gather(data, start, 2, "<u2")
+        first = ((handle_flags >> 12) & 3) != 1
+        handle = (handle_flags & 0x0FFF).astype(np.int64)
+        cid = _gather(data, start + 6, 2, "<u2").astype(np.int64)
+
+        for row in np.flatnonzero(first & (cid == SIGNALLING_CID)):
+            begin = int(start[row]) + 8
+            self._signalling(int(index[row]), int(handle[row]),
+                             buffer[begin:begin + int(available[row]) - 8])
+
+        dynamic = first & (cid >= FIRST_DYNAMIC_CID)
+        keys = (index << 29) | (received.astype(np.int64) << 28) | (handle << 16) | cid
+        unique, counts = np.unique(keys[dynamic], return_counts=True)
+        for key, count in zip(unique.tolist(), counts.tolist()):
+            self._dynamic[key] += count
+
+        media = dynamic & (available >= 8 + RTP_HEADER)
+        media[media] = (data[start[media] + 8] & 0xC0) == 0x80  # RTP version 2
+        rows = np.flatnonzero(media)
+        if len(rows):
+            rtp = start[rows] + 8
+            fields = {
+                "time": stamps[rows],
+                "length": _gather(data, start[rows] + 4, 2, "<u2").astype(np.int32),
+                "sequence": _gather(data, rtp + 2, 2, ">u2"),
+                "timestamp": _gather(data, rtp + 4, 4, ">u4"),
+                "ssrc": _gather(data, rtp + 8, 4, ">u4"),
+                "payload_type": data[rtp + 1] & 0x7F,
+                # SBC/MPEG media payload header: frame count in the low bits of the first byte
+                "frames": np.where(available[rows] > 8 + RTP_HEADER,
+                                   data[np.minimum(rtp + RTP_HEADER, len(data) - 1)] & 0x0F, 0),
+            }
+            media_keys = keys[rows]
+            for key in np.unique(media_keys).tolist():
+                selected = media_keys == key
+                self._parts[key].append({name: values[selected] for name, values in fields.items()})
+        return position
+
+    def _signalling(self, index, handle, payload):
+        """L2CAP connection requests/responses, to know which channel is AVDTP"""
+        position = 0
+        while position + 4 <= len(payload):
+            code, identifier, length = struct.unpack_from("<BBH", payload, position)
+            body = payload[position + 4:position + 4 + length]
+            position += 4 + length
+            if code == 0x02 and len(body) >= 4:  # Connection Request: PSM, source CID
+                self._pending[(index, handle, identifier)] = struct.unpack_from("<H", body, 0)[0]
+            elif code == 0x03 and len(body) >= 6:  # Connection Response: dest CID, source CID, result
+                destination, source, result = struct.unpack_from("<HHH", body, 0)
+                psm = self._pending.pop((index, handle, identifier), None)
+                if psm is None or result != 0:
+                    continue
+                order = self._opened[(index, handle, psm)]
+                self._opened[(index, handle, psm)] += 1
+                for channel in (destination, source):
+                    self.channels[(index, handle)][channel] = (psm, order)
+
+    def _is_media(self, key, packets):
+        index, handle, cid = key >> 29, (key >> 16) & 0x0FFF, key & 0xFFFF
+        known = self.channels.get((index, handle), {}).get(cid)
+        if known is not None:
+            psm, order = known
+            return psm == PSM_AVDTP and order >= 1
+        # No setup in the capture: RTP v2, a dynamic payload type, one SSRC, counting sequence
+        if len(packets["time"]) < 20 or len(packets["time"]) < 0.95 * self._dynamic[key]:
+            return False
+        _, inverse = np.unique(packets["ssrc"], return_inverse=True)
+        ssrc_share = np.bincount(inverse).max() / len(inverse)
+        steps = np.diff(packets["sequence"].astype(np.int64)) % 65536
+        return (ssrc_share >= 0.95 and np.mean(packets["payload_type"] >= 96) >= 0.95
+                and np.median(steps) == 1)
+
+    def streams(self):
+        """Stream key -> dict of packet field arrays, for media channels only (once: the parts are consumed)"""
+        result = {}
+        while self._parts:
+            key, parts = self._parts.popitem()
+            packets = {name: np.concatenate([part.pop(name) for part in parts]) for name in PACKET_FIELDS}
+            if self._is_media(key, packets):
+                result[key] = packets
+        return result
+
+
+def _unwrap32(values):
+    steps = np.diff(values.astype(np.int64)) % (1 << 32)
+    steps[steps >= 1 << 31] -= 1 << 32
+    return np.concatenate([[0], np.cumsum(steps)])
+
+
+def _line(x, y):
+    """Least-squares slope and intercept without polyfit's (n, 2) design matrix"""
+    x_mean, y_mean = x.mean(), y.mean()
+    slope = np.dot(x - x_mean, y - y_mean) / np.dot(x - x_mean, x - x_mean)
+    return slope, y_mean - slope * x_mean
+
+
+def stream_stats(packets, gap_factor=3.0, max_gaps=10):
+    """Timing, rate and loss indicators of one media stream, all vectorized over its packets"""
+    arrival = (packets["time"] - packets["time"][0]) / 1e6
+    count = len(arrival)
+    duration = float(arrival[-1]) if count > 1 else 0.0
+    intervals = np.diff(arrival) * 1000
+    median = float(np.median(intervals)) if count > 1 else 0.0
+    stats = {
+        "packets": count,
+        "start_seconds": round((int(packets["time"][0]) - EPOCH_US) / 1e6, 6),
+        "duration_seconds": round(duration, 3),
+        "kbps": round(float(packets["length"][1:].sum()) * 8 / duration / 1000, 1) if duration else None,
+        "frames_per_packet": int(np.median(packets["frames"])),
+    }
+    values, inverse = np.unique(packets["ssrc"], return_inverse=True)
+    stats["ssrc"] = int(values[np.bincount(inverse).argmax()])
+    if count < 3:
+        return stats
+
+    # RTP clock from the media timestamps against arrival, snapped to a standard rate
+    media = _unwrap32(packets["timestamp"]).astype(np.float64)
+    slope = _line(arrival, media)[0]
+    clock = min(RTP_CLOCKS, key=lambda rate: abs(rate - slope))
+    if abs(clock - slope) > 0.02 * clock:
+        clock = slope
+    # Transit = arrival - media time; its trend is clock drift between phone and speaker, the
+    # rest is delivery jitter (RFC 3550 uses the same difference, smoothed)
+    transit = arrival - media / clock
+    slope, intercept = _line(arrival, transit)
+    transit -= slope * arrival + intercept
+    late = (transit - np.percentile(transit, 1)) * 1000
+
+    gap_ms = gap_factor * median
+    gap_rows = np.flatnonzero(intervals > gap_ms)
+    bunched = intervals < 0.25 * median
+    steps = np.diff(packets["sequence"].astype(np.int64)) % 65536
+    forward = (steps > 0) & (steps < 32768)
+    # A radio stall delays packets and then delivers the backlog at once: count gaps that
+    # are followed by bunched packets as (re)transmission bursts
+    after_gap = gap_rows + 1
+    after_gap = after_gap[after_gap < len(bunched)]
+    stats.update({
+        "rtp_clock_hz": round(float(clock), 1),
+        "interval_ms": {
+            "median": round(median, 3),
+            "mean": round(float(intervals.mean()), 3),
+            "p99": round(float(np.percentile(intervals, 99)), 3),
+            "max": round(float(intervals.max()), 3),
+        },
+        "jitter_ms": round(float(np.abs(np.diff(transit)).mean() * 1000), 3),
+        "late_ms": {"p99": round(float(np.percentile(late, 99)), 3), "max": round(float(late.max()), 3)},
+        "gaps": int(len(gap_rows)),
+        "gap_threshold_ms": round(gap_ms, 3),
+        "longest_gap_ms": round(float(intervals[gap_rows].max()), 3) if len(gap_rows) else 0.0,
+        "gap_seconds": round(float(intervals[gap_rows].sum()) / 1000, 3),
+        "gap_list": [[round(float(arrival[row]), 3), round(float(intervals[row]), 3)]
+                     for row in gap_rows[np.argsort(intervals[gap_rows])[::-1][:max_gaps]]],
+        "lost": int((steps[forward] - 1).sum()),
+        "duplicates": int(np.count_nonzero(steps == 0)),
+        "reordered": int(np.count_nonzero(~forward & (steps != 0))),
+        "bunched": int(np.count_nonzero(bunched)),
+        "bursts_after_gaps": int(np.count_nonzero(bunched[after_gap])),
+    })
+    return stats
+
+
+def analyze(path, gap_factor=3.0, chunk_bytes=CHUNK_BYTES):
+    """Report dict for a btsnoop file: capture summary plus one entry per media stream"""
+    capture = Capture(path, chunk_bytes).read()
+    streams = []
+    for key, packets in sorted(capture.streams().items()):
+        entry = {
+            "index": key >> 29,
+            "handle": (key >> 16) & 0x0FFF,
+            "cid": key & 0xFFFF,
+            "direction": "rx" if (key >> 28) & 1 else "tx",
+        }
+        entry.update(stream_stats(packets, gap_factor))
+        streams.append(entry)
+    span = (capture.last_us - capture.first_us) / 1e6 if capture.records else 0.0
+    return {
+        "link_type": capture.link_type,
+        "records": capture.records,
+        "bytes": capture.bytes,
+        "capture_seconds": round(span, 3),
+        "truncated_records": capture.truncated,
+        "capture_drops": capture.dropped,
+        "streams": streams,
+    }
+
+
+class FixtureWriter:
+    """Writes a synthetic btsnoop file record by record"""
+
+    def __init__(self, path, link_type=LINK_MONITOR, snaplen=None):
+        self.link_type = link_type
+        self.snaplen = snaplen
+        self._file = open(path, "wb")
+        self._file.write(FILE_HEADER.pack(MAGIC, 1, link_type))
+
+    def record(self, time_us, data, flags):
+        included = data if self.snaplen is None else data[:self.snaplen]
+        self._file.write(RECORD.pack(len(data), len(included), flags, 0, EPOCH_US + time_us) + included)
+
+    def acl(self, time_us, handle, payload, received, index=0, fragment=None):
+        """One L2CAP frame as ACL data, split into `fragment`-byte ACL packets if given"""
+        pieces = [payload] if not fragment else [payload[i:i + fragment] for i in range(0, len(payload), fragment)]
+        for number, piece in enumerate(pieces):
+            boundary = 0b10 if number == 0 else 0b01
+            data = struct.pack("<HH", handle | boundary << 12, len(piece)) + piece
+            if self.link_type == LINK_MONITOR:
+                flags = index << 16 | (MONITOR_ACL_RX if received else MONITOR_ACL_TX)
+            else:
+                flags = int(received)
+                if self.link_type == LINK_H4:
+                    data = bytes([H4_ACL]) + data
+            self.record(time_us + number * 50, data, flags)
+
+    def event(self, time_us, payload, index=0):
+        if self.link_type == LINK_MONITOR:
+            self.record(time_us, payload, index << 16 | 3)
+        else:
+            self.record(time_us, (bytes([4]) if self.link_type == LINK_H4 else b"") + payload, 3)
+
+    def close(self):
+        self._file.close()
+
+
+def _l2cap(cid, payload):
+    return struct.pack("<HH", len(payload), cid) + payload
+
+
+def make_fixture(path, seconds=5.0, link_type=LINK_MONITOR, setup=True, snaplen=None, fragment=None,
+                 sample_rate=44100, frames_per_packet=5, frame_bytes=119, jitter_ms=1.0,
+                 gaps=((2.0, 0.12),), lost=(100,), duplicates=(200,), seed=5, handle=0x0B):
+    """A phone streaming SBC to the speaker, with a radio stall, a flushed packet and a duplicate
+
+    `gaps` are (time, seconds) stalls during which nothing arrives; the packets due meanwhile
+    arrive together when the stall ends. `lost` and `duplicates` are packet numbers. Returns
+    the ground truth the analyzer should find.
+    """
+    rng = np.random.default_rng(seed)
+    writer = FixtureWriter(path, link_type, snaplen)
+    local_signalling, local_media, local_control = 0x0041, 0x0043, 0x0045
+    remote_signalling, remote_media, remote_control = 0x0040, 0x0042, 0x0044
+    now = 0
+    if link_type == LINK_MONITOR:
+        writer.record(now, struct.pack("<BB6s8s", 0, 0, b"\x00\x1a\x7d\xda\x71\x13", b"hci0\0\0\0\0"), 0)
+    writer.event(now + 100, bytes([0x03, 11, 0, handle, 0]) + b"\x01\x02\x03\x04\x05\x06\x01\x00")
+    now += 1000
+    if setup:
+        # AVDTP signalling, AVCTP control and AVDTP media channels, requested by the phone
+        for identifier, (psm, remote, local) in enumerate(
+                ((PSM_AVDTP, remote_signalling, local_signalling), (0x0017, remote_control, local_control),
+                 (PSM_AVDTP, remote_media, local_media)), start=1):
+            writer.acl(now, handle, _l2cap(SIGNALLING_CID, struct.pack("<BBHHH", 0x02, identifier, 4, psm, remote)),
+                       received=True)
+            writer.acl(now + 300, handle, _l2cap(SIGNALLING_CID, struct.pack(
+                "<BBHHHHH", 0x03, identifier, 8, local, remote, 0, 0)), received=False)
+            now += 2000
+    # AVDTP and AVCTP traffic whose first byte happens to look like RTP version 2
+    writer.acl(now, handle, _l2cap(local_signalling, bytes([0x80, 0x07, 0x04])), received=True)
+    writer.acl(now + 500, handle, _l2cap(remote_signalling, bytes([0x82, 0x07])), received=False)
+    for number in range(3):
+        writer.acl(now + 800 + number * 1000, handle, _l2cap(local_control, bytes([0x80, 0x00, 0x11, 0x0E]) + bytes(16)),
+                   received=True)
+    now += 10000
+
+    samples = frames_per_packet * 128  # SBC: 16 blocks x 8 subbands per frame
+    interval = samples / sample_rate
+    count = int(seconds / interval)
+    due = now / 1e6 + np.arange(count) * interval + np.abs(rng.normal(0, jitter_ms / 1000, count))
+    for start, length in gaps:
+        stalled = (due >= start) & (due < start + length)
+        due[stalled] = start + length + np.arange(np.count_nonzero(stalled)) * 0.0003
+    lost, duplicates = set(lost), set(duplicates)
+    payload = bytes(frames_per_packet * frame_bytes)
+    delivered = 0
+    for number in range(count):
+        if number in lost:
+            continue
+        rtp = struct.pack(">BBHII", 0x80, 96, number & 0xFFFF, (number * samples) & 0xFFFFFFFF, 0x1234)
+        frame = _l2cap(local_media, rtp + bytes([frames_per_packet]) + payload)
+        for repeat in range(2 if number in duplicates else 1):
+            writer.acl(int(due[number] * 1e6) + repeat * 200, handle, frame, received=True, fragment=fragment)
+            delivered += 1
+        if number % 20 == 0:  # Number of Completed Packets for our own (signalling) traffic
+            writer.event(int(due[number] * 1e6) + 100, struct.pack("<BBBHH", 0x13, 5, 1, handle, 1))
+    writer.close()
+    return {"packets": delivered, "lost": len(lost), "duplicates": len(duplicates), "gaps": len(gaps),
+            "interval_ms": interval * 1000, "kbps": (RTP_HEADER + 1 + len(payload)) * 8 / interval / 1000,
+            "rtp_clock_hz": sample_rate}
+
+
+def benchmark(size_mb=200.0, chunk_bytes=CHUNK_BYTES):
+    """Analyze a large full-payload capture; throughput and peak memory"""
+    import resource
+    import tempfile
+
+    packet_bytes = 24 + 8 + RTP_HEADER + 1 + 5 * 119
+    seconds = size_mb * (1 << 20) / packet_bytes * (5 * 128 / 44100)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large.btsnoop")
+        started = time.perf_counter()
+        truth = make_fixture(path, seconds, gaps=((60.0, 0.2), (seconds / 2, 0.5)), lost=(1000, 5000),
+                             duplicates=(3000,))
+        generate = time.perf_counter() - started
+        size = os.path.getsize(path)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        report = analyze(path, chunk_bytes=chunk_bytes)
+        elapsed = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"size_mb": size / (1 << 20), "seconds": seconds, "generate_seconds": generate,
+            "analyze_seconds": elapsed, "mb_per_second": size / (1 << 20) / elapsed,
+            "peak_growth_mb": (rss_after - rss_before) / 1024, "report": report, "truth": truth}
+
+
+def print_report(report):
+    print(f"capture:  {report['records']} records, {report['bytes'] / (1 << 20):.1f} MB, "
+          f"{report['capture_seconds']:.1f} s, link type {report['link_type']}, "
+          f"{report['capture_drops']} dropped by the capture, {report['truncated_records']} truncated")
+    if not report["streams"]:
+        print("no A2DP media streams found")
+    for stream in report["streams"]:
+        print(f"\nstream:   hci{stream['index']} handle 0x{stream['handle']:04x} cid 0x{stream['cid']:04x} "
+              f"{stream['direction']}, ssrc 0x{stream['ssrc']:08x}")
+        print(f"  packets {stream['packets']} over {stream['duration_seconds']:.1f} s, {stream['kbps']} kbps, "
+              f"{stream['frames_per_packet']} frames/packet")
+        if "interval_ms" not in stream:
+            continue
+        interval = stream["interval_ms"]
+        print(f"  interval median {interval['median']:.2f} ms, p99 {interval['p99']:.2f} ms, "
+              f"max {interval['max']:.1f} ms; jitter {stream['jitter_ms']:.2f} ms, "
+              f"late p99 {stream['late_ms']['p99']:.1f} ms (RTP clock {stream['rtp_clock_hz']:.0f} Hz)")
+        print(f"  gaps {stream['gaps']} over {stream['gap_threshold_ms']:.0f} ms "
+              f"(longest {stream['longest_gap_ms']:.0f} ms, {stream['gap_seconds']:.2f} s total)")
+        for at, length in stream["gap_list"]:
+            print(f"    at {at:9.3f} s: {length:.0f} ms")
+        print(f"  lost {stream['lost']}, duplicates {stream['duplicates']}, reordered {stream['reordered']}, "
+              f"bunched {stream['bunched']} ({stream['bursts_after_gaps']} right after a gap)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="A2DP packet timing from btsnoop captures (btmon -w)")
+    parser.add_argument("capture", nargs="?", help="btsnoop file")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--gap-factor", type=float, default=3.0,
+                        help="an interval this many times the median is a gap")
+    parser.add_argument("--make-fixture", type=float, metavar="SECONDS",
+                        help="write a synthetic capture of SECONDS to the capture path")
+    parser.add_argument("--benchmark", action="store_true", help="throughput and memory on a large capture")
+    parser.add_argument("--size-mb", type=float, default=200.0, help="benchmark capture size")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        result = benchmark(args.size_mb)
+        stream = result["report"]["streams"][0]
+        truth = result["truth"]
+        print(f"capture:  {result['size_mb']:.0f} MB ({result['seconds'] / 60:.0f} min of A2DP), "
+              f"written in {result['generate_seconds']:.1f} s")
+        print(f"analyze:  {result['analyze_seconds']:.2f} s, {result['mb_per_second']:.0f} MB/s, "
+              f"peak memory +{result['peak_growth_mb']:.0f} MB")
+        print(f"found:    {stream['packets']} packets (expected {truth['packets']}), lost {stream['lost']}/"
+              f"{truth['lost']}, duplicates {stream['duplicates']}/{truth['duplicates']}, "
+              f"gaps {stream['gaps']}/{truth['gaps']}")
+        ok = (stream["packets"] == truth["packets"] and stream["lost"] == truth["lost"]
+              and stream["duplicates"] == truth["duplicates"] and stream["gaps"] == truth["gaps"])
+        return 0 if ok else 1
+    if not args.capture:
+        parser.print_help()
+        return 0
+    if args.make_fixture is not None:
+        truth = make_fixture(args.capture, args.make_fixture)
+        print(json.dumps(truth, indent=2))
+        return 0
+    report = analyze(args.capture, args.gap_factor)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
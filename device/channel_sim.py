@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Channel Simulator
+Offline model of the phone -> A2DP -> sink -> room path, for tests that have no phone
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+
+class CodecModel:
+    """MDCT band-limiting and per-band quantization, roughly what SBC/AAC do to the signal"""
+
+    def __init__(self, sample_rate=44100, cutoff_hz=16000.0, bits=6, hop=128, band_bins=8):
+        self.hop = hop
+        self.band_bins = band_bins
+        self.bits = bits
+        n = np.arange(2 * hop)
+        k = np.arange(hop)
+        self._window = np.sin(np.pi * (n + 0.5) / (2 * hop))
+        self._basis = np.cos(np.pi / hop * (n[:, None] + 0.5 + hop / 2) * (k[None, :] + 0.5))
+        self._cutoff_bin = min(hop, int(cutoff_hz / (sample_rate / 2 / hop)))
+        self._input = np.zeros(hop)
+        self._overlap = np.zeros(hop)
+
+    def process(self, chunk):
+        buffer = np.concatenate([self._input, chunk])
+        count = (len(buffer) - self.hop) // self.hop
+        if count <= 0:
+            self._input = buffer
+            return np.zeros(0)
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, 2 * self.hop)[::self.hop][:count]
+        self._input = buffer[count * self.hop:]
+
+        coefficients = (frames * self._window) @ self._basis
+        coefficients[:, self._cutoff_bin:] = 0
+        coefficients = self._quantize(coefficients)
+        frames = (coefficients @ self._basis.T) * self._window * (2 / self.hop)
+
+        out = frames[:, :self.hop].copy()
+        out[0] += self._overlap
+        out[1:] += frames[:-1, self.hop:]
+        self._overlap = frames[-1, self.hop:].copy()
+        return out.reshape(-1)
+
+    def _quantize(self, coefficients):
+        if not self.bits:
+            return coefficients
+        frames = coefficients.shape[0]
+        bands = coefficients.reshape(frames, -1, self.band_bins)
+        energy = np.mean(bands ** 2, axis=2) + 1e-20
+        # Loudness-style allocation: louder bands get more bits, quiet ones fewer
+        relative = 0.5 * np.log2(energy / np.mean(energy, axis=1, keepdims=True))
+        bits = np.clip(np.round(self.bits + relative), 1, 15)
+        levels = (2 ** (bits - 1))[..., None]
+        scale = np.max(np.abs(bands), axis=2, keepdims=True) + 1e-20
+        return (np.round(bands / scale * levels) / levels * scale).reshape(frames, -1)
+
+
+class Dropouts:
+    """Zero whole packets at random, as the sink does when A2DP packets are lost"""
+
+    def __init__(self, probability=0.0, packet_samples=512, rng=None):
+        self.probability = probability
+        self.packet_samples = packet_samples
+        self.rng = rng or np.random.default_rng()
+        self._phase = 0
+        self.dropped = 0
+
+    def process(self, chunk):
+        if not self.probability or not len(chunk):
+            return chunk
+        packets = (np.arange(len(chunk)) + self._phase) // self.packet_samples
+        lost = self.rng.random(packets[-1] + 1) < self.probability
+        self.dropped += int(np.count_nonzero(lost))
+        self._phase = (self._phase + len(chunk)) % self.packet_samples
+        return np.where(lost[packets], 0.0, chunk)
+
+
+class Resampler:
+    """Polyphase windowed-sinc resampler with clock drift and slow timing jitter"""
+
+    def __init__(self, input_rate=44100, output_rate=48000, drift_ppm=0.0, jitter_samples=0.0,
+                 jitter_period=4096, taps=16, phases=512, rng=None):
+        self.step = input_rate / output_rate * (1 + drift_ppm * 1e-6)
+        self.jitter_samples = jitter_samples
+        self.jitter_period = jitter_period
+        self.half = taps // 2
+        self.phases = phases
+        self.rng = rng or np.random.default_rng()
+
+        cutoff = min(1.0, output_rate / input_rate) * 0.95
+        offsets = np.arange(-self.half + 1, self.half + 1)
+        fractions = np.arange(phases + 1) / phases
+        t = offsets[None, :] - fractions[:, None]
+        window = np.kaiser(2 * self.half + 1, 8.0)[np.clip(np.round(t + self.half).astype(int), 0, 2 * self.half)]
+        self._table = cutoff * np.sinc(cutoff * t) * window
+        self._table /= self._table.sum(axis=1, keepdims=True)
+        self._offsets = offsets
+
+        self._history = np.zeros(self.half)
+        self._position = float(self.half)  # input index (into _history) of the next output sample
+        self._anchor = 0.0                 # jitter value at the start of the next output chunk
+
+    def process(self, chunk):
+        self._history = np.concatenate([self._history, chunk])
+        margin = self.half + 3 * self.jitter_samples + 1
+        count = int((len(self._history) - margin - self._position) / self.step)
+        if count <= 0:
+            return np.zeros(0)
+
+        positions = self._position + self.step * np.arange(count)
+        if self.jitter_samples:
+            anchors = np.concatenate([[self._anchor], self.rng.normal(0, self.jitter_samples,
+                                                                       count // self.jitter_period + 1)])
+            anchors = np.clip(anchors, -3 * self.jitter_samples, 3 * self.jitter_samples)
+            positions += np.interp(np.arange(count), np.arange(len(anchors)) * self.jitter_period, anchors)
+            self._anchor = float(np.interp(count, np.arange(len(anchors)) * self.jitter_period, anchors))
+
+        base = np.floor(positions).astype(np.int64)
+        phase = np.round((positions - base) * self.phases).astype(np.int64)
+        out = np.empty(count)
+        for start in range(0, count, 65536):
+            part = slice(start, start + 65536)
+            samples = self._history[base[part, None] + self._offsets[None, :]]
+            out[part] = np.einsum("ij,ij->i", samples, self._table[phase[part]])
+
+        self._position += self.step * count
+        drop = int(self._position) - self.half
+        self._history = self._history[drop:]
+        self._position -= drop
+        return out
+
+
+class Room:
+    """Direct path plus an exponentially decaying diffuse tail, applied by FFT convolution"""
+
+    def __init__(self, sample_rate=48000, rt60=0.3, level=0.2, predelay_ms=5.0, rng=None):
+        rng = rng or np.random.default_rng(7)
+        length = max(1, int(rt60 * sample_rate))
+        t = np.arange(length) / sample_rate
+        tail = rng.normal(0, 1, length) * np.exp(-6.9 * t / rt60) * level / np.sqrt(sample_rate * rt60 / 13.8)
+        tail[:int(predelay_ms * sample_rate / 1000)] = 0
+        tail[0] = 1.0
+        self.impulse = tail
+        self._tail = np.zeros(length - 1)
+
+    def process(self, chunk):
+        if not len(chunk):
+            return chunk
+        size = 1 << int(np.ceil(np.log2(len(chunk) + len(self.impulse) - 1)))
+        full = np.fft.irfft(np.fft.rfft(chunk, size) * np.fft.rfft(self.impulse, size), size)
+        full = full[:len(chunk) + len(self.impulse) - 1]
+        full[:len(self._tail)] += self._tail
+        self._tail = full[len(chunk):].copy()
+        return full[:len(chunk)]
+
+
+PROFILES = {
+    "ideal": {},
+    "sbc": {"codec": "sbc"},
+    "aac": {"codec": "aac"},
+    "speaker": {"codec": "sbc", "output_rate": 48000, "drift_ppm": 40.0, "jitter_samples": 0.2,
+                "dropout_probability": 1e-3, "rt60": 0.3, "reverb_level": 0.1, "snr_db": 30.0},
+    "harsh": {"codec": "aac", "output_rate": 48000, "drift_ppm": 200.0, "jitter_samples": 1.0,
+              "dropout_probability": 1e-2, "rt60": 0.6, "reverb_level": 0.3, "snr_db": 15.0},
+}
+
+CODECS = {"sbc": {"cutoff_hz": 17000.0, "bits": 6}, "aac": {"cutoff_hz": 15000.0, "bits": 7}}
+
+
+class ChannelSimulator:
+    """codec -> packet loss -> sample-rate conversion with drift -> room -> noise, chunk by chunk"""
+
+    def __init__(self, input_rate=44100, output_rate=None, codec=None, dropout_probability=0.0,
+                 drift_ppm=0.0, jitter_samples=0.0, rt60=0.0, reverb_level=0.0, snr_db=None,
+                 latency_ms=0.0, seed=1):
+        self.input_rate = input_rate
+        self.output_rate = output_rate or input_rate
+        self.snr_db = snr_db
+        self.rng = np.random.default_rng(seed)
+        self.stages = []
+        if codec:
+            self.stages.append(CodecModel(input_rate, **CODECS[codec]))
+        if dropout_probability:
+            self.dropouts = Dropouts(dropout_probability, rng=self.rng)
+            self.stages.append(self.dropouts)
+        if self.output_rate != input_rate or drift_ppm or jitter_samples:
+            self.stages.append(Resampler(input_rate, self.output_rate, drift_ppm, jitter_samples, rng=self.rng))
+        if rt60 and reverb_level:
+            self.stages.append(Room(self.output_rate, rt60, reverb_level, rng=self.rng))
+        self._latency = int(latency_ms * self.output_rate / 1000)
+
+    @classmethod
+    def from_profile(cls, name, **overrides):
+        if name not in PROFILES:
+            raise ValueError(f"Unknown channel profile: {name}")
+        return cls(**{**PROFILES[name], **overrides})
+
+    def process(self, chunk):
+        out = np.asarray(chunk, dtype=np.float64)
+        for stage in self.stages:
+            out = stage.process(out)
+        if self.snr_db is not None and len(out):
+            power = np.mean(out ** 2)
+            if power > 0:
+                out = out + self.rng.normal(0, np.sqrt(power / 10 ** (self.snr_db / 10)), len(out))
+        if self._latency:
+            out = np.concatenate([np.zeros(self._latency), out])
+            self._latency = 0
+        return out
+
+    def run(self, signal, chunk_seconds=10.0):
+        """Whole signal through the channel in large chunks; trailing filter delay is flushed with silence"""
+        chunk = int(chunk_seconds * self.input_rate)
+        parts = [self.process(signal[start:start + chunk]) for start in range(0, len(signal), chunk)]
+        parts.append(self.process(np.zeros(4096)))
+        return np.concatenate(parts).astype(np.float32)
+
+
+def match_detections(detections, starts, tolerance):
+    """Pair detections with transmitted frame starts -> ({detection index: frame index}, false alarms).
+
+    The channel delays frames and stretches them by its clock drift, so a line fitted through the
+    offsets to the nearest starts is removed first; a detection then matches the frame whose start
+    lies within `tolerance` samples, the closest one winning when two claim the same frame.
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    if not detections or not len(starts):
+        return {}, len(detections)
+    positions = np.array([detection.position for detection in detections])
+    nearest = np.abs(positions[:, None] - starts[None, :]).argmin(axis=1)
+    offsets = positions - starts[nearest]
+    inliers = np.abs(offsets - np.median(offsets)) <= 4 * tolerance
+    if inliers.sum() >= 2:
+        fit = np.polyfit(starts[nearest][inliers], offsets[inliers], 1)
+    else:
+        fit = (0.0, float(np.median(offsets)))
+    residuals = np.abs(offsets - np.polyval(fit, starts[nearest]))
+
+    matches = {}
+    for index in np.argsort(residuals):
+        if residuals[index] > tolerance:
+            break
+        if int(nearest[index]) not in matches.values():
+            matches[int(index)] = int(nearest[index])
+    return matches, len(detections) - len(matches)
+
+
+def modem_check(profile, seconds=20.0, seed=5):
+    """Frames through a profile (kept at the modem rate) -> (frames, detected, false alarms, payload BER)"""
+    from ofdm_modem import OfdmModem
+    from preamble_sync import PreambleSync, shift_frequency, synthetic_stream
+
+    modem = OfdmModem()
+    rng = np.random.default_rng(seed)
+    symbols = 8
+    clean, starts, payloads = synthetic_stream(modem, seconds, rng, symbols, snr_db=200.0, cfo_hz=0.0)
+    channel = ChannelSimulator.from_profile(profile, output_rate=modem.sample_rate, seed=seed)
+    received = channel.run(clean)
+
+    sync = PreambleSync.for_modem(modem)
+    detections = sync.feed(received) + sync.flush()
+    matches, false_alarms = match_detections(detections, starts, modem.cyclic_prefix // 2)
+    errors = total = 0
+    for index, frame_index in matches.items():
+        detection, bits = detections[index], payloads[frame_index]
+        frame = received[detection.sample:detection.sample + modem.frame_samples(symbols)]
+        if len(frame) < modem.frame_samples(symbols):
+            continue
+        out = modem.demodulate(shift_frequency(frame, -detection.cfo_hz, modem.sample_rate), symbols)
+        errors += int(np.sum(out[:len(bits)] != bits))
+        total += len(bits)
+    # Missed frames are not in the BER; they show as detected < frames
+    return len(starts), len(matches), false_alarms, errors / total if total else None
+
+
+def benchmark(seconds=60.0, profiles=tuple(PROFILES), modem=True):
+    rng = np.random.default_rng(4)
+    signal = rng.normal(0, 0.1, int(seconds * 44100))
+    rows = []
+    for name in profiles:
+        channel = ChannelSimulator.from_profile(name)
+        started = time.perf_counter()
+        channel.run(signal)
+        speed = seconds / (time.perf_counter() - started)
+        frames, detected, false_alarms, ber = modem_check(name) if modem else (None, None, None, None)
+        rows.append((name, speed, frames, detected, false_alarms, ber))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated A2DP/speaker channel for offline tests")
+    parser.add_argument("--benchmark", action="store_true", help="speed of every profile, plus modem BER")
+    parser.add_argument("--seconds", type=float, default=60.0, help="signal length for the speed test")
+    parser.add_argument("--no-modem", action="store_true", help="skip the OFDM modem check")
+    parser.add_argument("--profile", choices=sorted(PROFILES), action="append", help="limit to these profiles")
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        for name, settings in PROFILES.items():
+            print(f"{name:>8}: {settings or 'pass-through'}")
+        return 0
+
+    print(f"{'profile':>8} {'x real time':>12} {'frames':>8} {'false':>6} {'BER':>10}")
+    for name, speed, frames, detected, false_alarms, ber in benchmark(args.seconds, args.profile or tuple(PROFILES),
+                                                        not args.no_modem):
+        ber = f"{ber:>10.2e}" if ber is not None else f"{'-':>10}"
+        detail = f"{detected:>3}/{frames:<4} {false_alarms:>6} {ber}" if frames else f"{'-':>8} {'-':>6} {'-':>10}"
+        print(f"{name:>8} {speed:>12.0f} {detail}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Device Registry
+Remembers every phone seen (first/last connection) in a small JSON file
+"""
+
+import json
+import os
+import time
+
+DEFAULT_REGISTRY = os.path.expanduser("~/.local/share/bluetooth_speaker/devices.json")
+
+
+class DeviceRegistry:
+    def __init__(self, path=DEFAULT_REGISTRY):
+        self.path = os.path.expanduser(path)
+        self.devices = {}
+        self.load()
+
+    def load(self):
+        """Read the registry; a missing or unreadable file starts empty"""
+        try:
+            with open(self.path) as f:
+                self.devices = json.load(f)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    def save(self):
+        """Atomically write the registry back to disk"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.devices, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get(self, mac):
+        return self.devices.get(mac)
+
+    def record_connection(self, mac, name, now=None):
+        """Note that a device connected just now"""
+        now = now if now is not None else time.time()
+        entry = self.devices.setdefault(mac, {"name": name, "first_seen": now, "connections": 0})
+        entry["name"] = name
+        entry["last_seen"] = now
+        entry["connections"] += 1
+        return entry
+
+    def update(self, mac, **fields):
+        """Store extra per-device settings (e.g. learned gain), creating the entry if needed"""
+        entry = self.devices.setdefault(mac, {"name": mac, "first_seen": time.time(), "connections": 0})
+        entry.update(fields)
+        return entry
+
+    def forget(self, macs):
+        """Drop devices, e.g. after their pairing was removed"""
+        for mac in macs:
+            self.devices.pop(mac, None)
+
+    def last_seen_before(self, cutoff):
+        """MACs whose last connection is older than `cutoff` (epoch seconds)"""
+        return [mac for mac, entry in self.devices.items()
+                if entry.get("last_seen", entry.get("first_seen", 0)) < cutoff]
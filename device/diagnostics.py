@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Diagnostics
+Concurrent system checks with per-check timeouts, cached facts and a JSON report
+
+Every check runs at once; tool output that several checks need (`bluetoothctl show`,
+`pactl list short modules`, ...) is fetched once per run and shared. Facts that only change
+when the system does are kept between runs: the package list until dpkg's status file
+changes, adapter capabilities until the set of adapters or the installed packages change (or
+`capabilities_max_age_hours` passes). A warm run only waits for the live checks.
+"""
+
+import argparse
+import asyncio
+import grp
+import importlib.util
+import json
+import os
+import pwd
+import shutil
+import sys
+import time
+
+from bluetooth_daemon import DEFAULT_CONFIG, CommandRunner, load_config, log
+from tool_parsers import parse_controller_info, parse_controller_list, parse_pactl_modules, parse_pactl_short
+
+DEFAULT_CACHE = os.path.expanduser("~/.cache/bluetooth_speaker/diagnostics.json")
+DPKG_STATUS = "/var/lib/dpkg/status"
+SYSFS_BLUETOOTH = "/sys/class/bluetooth"
+SYSFS_RFKILL = "/sys/class/rfkill"
+PACKAGES = ("bluez", "pulseaudio-module-bluetooth", "python3")
+PYTHON_MODULES = {"pexpect": "required", "numpy": "needed for the audio pipeline and data channel tools"}
+A2DP_SINK_UUID = "0000110b-0000-1000-8000-00805f9b34fb"
+
+
+def _result(status, detail="", fix=None):
+    return {"status": status, "detail": detail, "fix": fix}
+
+
+class FactCache:
+    """Facts kept between runs, each stored with the key it was valid for"""
+
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = os.path.expanduser(path) if path else None
+        self.entries = {}
+        self.changed = False
+        if self.path:
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, name, key, max_age=None):
+        """The stored value if it was stored under `key` (and is young enough), else None"""
+        entry = self.entries.get(name)
+        if entry is None or entry.get("key") != key:
+            return None
+        if max_age is not None and time.time() - entry.get("stored", 0) > max_age:
+            return None
+        return entry["value"]
+
+    def put(self, name, key, value):
+        self.entries[name] = {"key": key, "value": value, "stored": time.time()}
+        self.changed = True
+
+    def save(self):
+        """Atomically write the cache back, if anything changed"""
+        if not self.path or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+
+class Diagnostics:
+    """Runs the checks below concurrently; `run()` returns the machine-readable report"""
+
+    def __init__(self, runner=None, cache_file=DEFAULT_CACHE, timeout=3.0, capabilities_max_age_hours=168.0,
+                 dpkg_status=DPKG_STATUS, sysfs_bluetooth=SYSFS_BLUETOOTH, sysfs_rfkill=SYSFS_RFKILL):
+        self.runner = runner or CommandRunner()
+        self.cache = FactCache(cache_file)
+        self.timeout = timeout
+        self.capabilities_max_age = capabilities_max_age_hours * 3600
+        self.dpkg_status = dpkg_status
+        self.sysfs_bluetooth = sysfs_bluetooth
+        self.sysfs_rfkill = sysfs_rfkill
+        self._facts = {}
+        self.cache_hits = []
+        self.cache_misses = []
+        self.checks = [
+            ("bluetoothctl", self.check_bluetoothctl),
+            ("bluetooth_service", self.check_bluetooth_service),
+            ("rfkill", self.check_rfkill),
+            ("adapter", self.check_adapter),
+            ("adapter_powered", self.check_adapter_powered),
+            ("adapter_capabilities", self.check_adapter_capabilities),
+            ("audio_server", self.check_audio_server),
+            ("bluetooth_modules", self.check_bluetooth_modules),
+            ("audio_outputs", self.check_audio_outputs),
+            ("packages", self.check_packages),
+            ("python_modules", self.check_python_modules),
+            ("bluetooth_group", self.check_bluetooth_group),
+        ]
+        # Checks whose failure means the speaker cannot work (warnings do not count)
+        self.essential = {"bluetoothctl", "bluetooth_service", "adapter", "adapter_powered", "audio_server",
+                          "packages", "python_modules"}
+
+    @classmethod
+    def from_config(cls, config, runner=None):
+        return cls(
+            runner=runner,
+            cache_file=config.get("diagnostics", "cache_file", fallback=DEFAULT_CACHE),
+            timeout=config.getfloat("diagnostics", "timeout", fallback=3.0),
+            capabilities_max_age_hours=config.getfloat("diagnostics", "capabilities_max_age_hours",
+                                                       fallback=168.0),
+        )
+
+    # Facts: fetched at most once per run, shared by every check that needs them
+
+    def fact(self, name):
+        """Awaitable for a fact; shielded so one check timing out does not cancel it for the others"""
+        if name not in self._facts:
+            self._facts[name] = asyncio.ensure_future(getattr(self, f"_fact_{name}")())
+        return asyncio.shield(self._facts[name])
+
+    async def _tool(self, *args):
+        success, output, error = await self.runner.run(list(args), timeout=self.timeout)
+        if not success and "No such file or directory" in error:
+            error = f"{args[0]} not found"
+        return success, output, error
+
+    async def _fact_show(self):
+        return await self._tool("bluetoothctl", "show")
+
+    async def _fact_controllers(self):
+        return await self._tool("bluetoothctl", "list")
+
+    async def _fact_pactl_info(self):
+        return await self._tool("pactl", "info")
+
+    async def _fact_modules(self):
+        return await self._tool("pactl", "list", "short", "modules")
+
+    async def _fact_sinks(self):
+        return await self._tool("pactl", "list", "short", "sinks")
+
+    def _packages_key(self):
+        try:
+            status = os.stat(self.dpkg_status)
+        except OSError:
+            return None
+        return [status.st_mtime_ns, status.st_size, list(PACKAGES)]
+
+    async def _fact_packages(self):
+        """{package: version or None} for PACKAGES; cached until dpkg's database changes"""
+        key = self._packages_key()
+        if key is not None:
+            cached = self.cache.get("packages", key)
+            if cached is not None:
+                self.cache_hits.append("packages")
+                return cached
+        self.cache_misses.append("packages")
+        success, output, error = await self._tool(
+            "dpkg-query", "-W", "-f=${Package}\\t${db:Status-Abbrev}\\t${Version}\\n", *PACKAGES)
+        if not success and not output:
+            raise RuntimeError(error.strip() or "dpkg-query failed (not a dpkg-based system?)")
+        packages = {name: None for name in PACKAGES}
+        for line in output.splitlines():
+            parts = line.split("\t")
+            if len(parts) == 3 and parts[1].startswith("ii"):
+                packages[parts[0].split(":")[0]] = parts[2]
+        if key is not None:
+            self.cache.put("packages", key, packages)
+        return packages
+
+    def _adapters_key(self):
+        try:
+            names = sorted(os.listdir(self.sysfs_bluetooth))
+        except OSError:
+            names = []
+        # The device link changes when an adapter is swapped for another on the same hciN
+        return [[name, os.path.realpath(os.path.join(self.sysfs_bluetooth, name))] for name in names]
+
+    async def _fact_capabilities(self):
+        """{address: {"settings": [...], "version", "manufacturer"}} from `btmgmt info`; cached"""
+        # Any package change (a bluez or kernel upgrade among them) invalidates it too
+        key = [self._adapters_key(), self._packages_key()]
+        cached = self.cache.get("capabilities", key, self.capabilities_max_age)
+        if cached is not None:
+            self.cache_hits.append("capabilities")
+            return cached
+        self.cache_misses.append("capabilities")
+        success, output, error = await self._tool("btmgmt", "info")
+        if not success:
+            raise RuntimeError(error.strip() or "btmgmt info failed")
+        adapters, current = {}, None
+        for line in output.splitlines():
+            words = line.split()
+            if line.startswith("\taddr ") and len(words) >= 6:
+                current = adapters.setdefault(words[1].upper(), {
+                    "version": int(words[3]), "manufacturer": int(words[5]), "settings": []})
+            elif current is not None and line.strip().startswith("supported settings:"):
+                current["settings"] = line.split(":", 1)[1].split()
+        self.cache.put("capabilities", key, adapters)
+        return adapters
+
+    # Checks: each returns _result(status, detail, fix); status is ok, warn, fail or skip
+
+    async def check_bluetoothctl(self):
+        if shutil.which("bluetoothctl"):
+            return _result("ok", "bluetoothctl is available")
+        return _result("fail", "bluetoothctl not found", "sudo apt-get install bluez")
+
+    async def check_bluetooth_service(self):
+        success, output, _ = await self._tool("systemctl", "is-active", "bluetooth")
+        if success:
+            return _result("ok", "bluetooth service is running")
+        return _result("fail", f"bluetooth service is {output.strip() or 'not running'}",
+                       "sudo systemctl start bluetooth")
+
+    async def check_rfkill(self):
+        try:
+            names = os.listdir(self.sysfs_rfkill)
+        except OSError:
+            return _result("skip", "no rfkill information")
+        blocked = []
+        for name in names:
+            base = os.path.join(self.sysfs_rfkill, name)
+            try:
+                with open(os.path.join(base, "type")) as f:
+                    if f.read().strip() != "bluetooth":
+                        continue
+                with open(os.path.join(base, "soft")) as f:
+                    soft = f.read().strip() == "1"
+                with open(os.path.join(base, "hard")) as f:
+                    hard = f.read().strip() == "1"
+            except OSError:
+                continue
+            if hard:
+                blocked.append(f"{name} (hardware switch)")
+            elif soft:
+                blocked.append(name)
+        if blocked:
+            return _result("fail", f"blocked: {', '.join(blocked)}", "rfkill unblock bluetooth")
+        return _result("ok", "bluetooth radios are not blocked")
+
+    async def check_adapter(self):
+        success, output, error = await self.fact("controllers")
+        controllers = list(parse_controller_list(output)) if success else []
+        if controllers:
+            return _result("ok", ", ".join(controller.address for controller in controllers))
+        return _result("fail", error.strip() or "no Bluetooth adapter found",
+                       "check `rfkill list` and that the adapter is plugged in")
+
+    async def check_adapter_powered(self):
+        success, output, error = await self.fact("show")
+        controllers = list(parse_controller_info(output)) if success else []
+        if not controllers:
+            return _result("fail", error.strip() or "no default adapter")
+        controller = controllers[0]
+        if not controller.powered:
+            return _result("fail", f"{controller.address} is powered off", "bluetoothctl power on")
+        if not any(uuid["uuid"] == A2DP_SINK_UUID for uuid in controller.uuids or []):
+            return _result("warn", f"{controller.address} is on but does not offer Audio Sink yet",
+                           "start the audio server so it registers the A2DP endpoint")
+        return _result("ok", f"{controller.address} is powered and offers Audio Sink")
+
+    async def check_adapter_capabilities(self):
+        try:
+            adapters = await self.fact("capabilities")
+        except RuntimeError as e:
+            return _result("skip", str(e))
+        if not adapters:
+            return _result("fail", "no adapters reported by btmgmt")
+        missing = {address: [setting for setting in ("br/edr", "ssp") if setting not in info["settings"]]
+                   for address, info in adapters.items()}
+        missing = {address: settings for address, settings in missing.items() if settings}
+        if missing:
+            return _result("fail", "; ".join(f"{address} lacks {', '.join(settings)}"
+                                             for address, settings in missing.items()),
+                           "A2DP needs a BR/EDR adapter with Secure Simple Pairing")
+        return _result("ok", ", ".join(f"{address}: BT version code {info['version']}"
+                                       for address, info in adapters.items()))
+
+    async def check_audio_server(self):
+        success, output, error = await self.fact("pactl_info")
+        if not success:
+            return _result("fail", error.strip() or "audio server is not running", "pulseaudio --start")
+        for line in output.splitlines():
+            if line.startswith("Server Name:"):
+                return _result("ok", line.split(":", 1)[1].strip())
+        return _result("ok", "audio server is running")
+
+    async def check_bluetooth_modules(self):
+        success, info, _ = await self.fact("pactl_info")
+        if not success:
+            return _result("skip", "audio server is not running")
+        if "PipeWire" in info:
+            return _result("ok", "PipeWire handles Bluetooth itself")
+        success, output, error = await self.fact("modules")
+        if success and any("bluetooth" in module.name for module in parse_pactl_modules(output)):
+            return _result("ok", "Bluetooth modules are loaded")
+        return _result("fail", error.strip() or "Bluetooth modules are not loaded",
+                       "pactl load-module module-bluetooth-discover")
+
+    async def check_audio_outputs(self):
+        success, output, error = await self.fact("sinks")
+        if not success:
+            return _result("skip", error.strip() or "audio server is not running")
+        sinks = [entry.name for entry in parse_pactl_short(output) if entry.name.startswith("alsa_output")]
+        if sinks:
+            return _result("ok", ", ".join(sinks))
+        return _result("fail", "no ALSA output devices found")
+
+    async def check_packages(self):
+        try:
+            packages = await self.fact("packages")
+        except RuntimeError as e:
+            return _result("skip", str(e))
+        missing = [name for name, version in packages.items() if version is None]
+        if missing:
+            return _result("fail", f"not installed: {', '.join(missing)}",
+                           f"sudo apt-get install {' '.join(missing)}")
+        return _result("ok", ", ".join(f"{name} {version}" for name, version in packages.items()))
+
+    async def check_python_modules(self):
+        missing = [name for name in PYTHON_MODULES if importlib.util.find_spec(name) is None]
+        if not missing:
+            return _result("ok", ", ".join(PYTHON_MODULES))
+        status = "fail" if any(PYTHON_MODULES[name] == "required" for name in missing) else "warn"
+        return _result(status, "; ".join(f"{name} not found ({PYTHON_MODULES[name]})" for name in missing),
+                       f"sudo apt-get install {' '.join('python3-' + name for name in missing)}")
+
+    async def check_bluetooth_group(self):
+        user = pwd.getpwuid(os.getuid()).pw_name
+        try:
+            group = grp.getgrnam("bluetooth")
+        except KeyError:
+            return _result("skip", "no bluetooth group on this system")
+        if user == "root" or group.gr_gid in os.getgroups() or user in group.gr_mem:
+            return _result("ok", f"{user} can use Bluetooth")
+        return _result("warn", f"{user} is not in the bluetooth group",
+                       f"sudo usermod -a -G bluetooth {user}, then log in again")
+
+    async def _timed(self, name, check):
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(check(), self.timeout)
+        except asyncio.TimeoutError:
+            result = _result("fail", f"no answer within {self.timeout:g} s")
+            result["timed_out"] = True
+        except Exception as e:  # a broken check must not take the others down
+            result = _result("fail", f"check failed: {e}")
+        result["name"] = name
+        result["essential"] = name in self.essential
+        result["seconds"] = round(time.monotonic() - started, 3)
+        return result
+
+    async def run(self, only=None):
+        started = time.monotonic()
+        self._facts = {}
+        self.cache_hits, self.cache_misses = [], []
+        checks = [(name, check) for name, check in self.checks if not only or name in only]
+        results = await asyncio.gather(*[self._timed(name, check) for name, check in checks])
+        for task in self._facts.values():
+            if not task.done():
+                task.cancel()
+        try:
+            self.cache.save()
+        except OSError as e:
+            log(f"Diagnostics cache error: {e}")
+        errors = sum(result["status"] == "fail" and result["essential"] for result in results)
+        return {
+            "time": time.time(),
+            "seconds": round(time.monotonic() - started, 3),
+            "ok": errors == 0,
+            "errors": errors,
+            "warnings": sum(result["status"] in ("warn", "fail") and not result["essential"]
+                            for result in results),
+            "cache": {"hits": self.cache_hits, "misses": self.cache_misses},
+            "checks": results,
+        }
+
+
+def write_report(report, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def print_report(report):
+    marks = {"ok": "✓", "warn": "!", "fail": "✗", "skip": "-"}
+    for result in report["checks"]:
+        print(f"{marks[result['status']]} {result['name']:<21} {result['detail']}")
+        if result["fix"] and result["status"] in ("fail", "warn"):
+            print(f"  {'':<21} Try: {result['fix']}")
+    cache = report["cache"]
+    print(f"\n{len(report['checks'])} checks in {report['seconds'] * 1000:.0f} ms "
+          f"(cached: {', '.join(cache['hits']) or 'nothing'})")
+    if report["ok"]:
+        print("✓ System appears ready for Bluetooth speaker functionality!")
+    else:
+        print(f"✗ Found {report['errors']} issue(s) that need to be resolved.")
+
+
+def benchmark(directory):
+    """A slow box: every tool takes a while. Serial (the old script) vs concurrent, cold vs warm cache"""
+    from fake_tools import FakeRunner, make_adapters
+
+    latency = {"systemctl": 0.3, "bluetoothctl": 0.4, "pactl": 0.2, "dpkg-query": 1.5, "btmgmt": 0.8}
+    adapters = make_adapters(1)
+    adapters[0].powered = True
+    runner = FakeRunner(adapters, tool_latency=latency)
+    status = os.path.join(directory, "status")
+    with open(status, "w") as f:
+        f.write("Package: bluez\n")
+    sysfs = os.path.join(directory, "bluetooth")
+    os.makedirs(os.path.join(sysfs, "hci0"))
+    options = {"runner": runner, "cache_file": os.path.join(directory, "cache.json"), "dpkg_status": status,
+               "sysfs_bluetooth": sysfs}
+    # Each tool run once, one after another, like system_check.sh
+    serial = sum(latency[tool] * count for tool, count in
+                 (("systemctl", 1), ("bluetoothctl", 2), ("pactl", 3), ("dpkg-query", 1), ("btmgmt", 1)))
+
+    def run(diagnostics):
+        return asyncio.run(diagnostics.run())
+
+    cold = run(Diagnostics(**options))
+    warm = run(Diagnostics(**options))
+    os.utime(status, ns=(time.time_ns(), time.time_ns() + 10**9))  # apt installed something
+    invalidated = run(Diagnostics(**options))
+    runner.tool_latency["systemctl"] = 10.0
+    hung = run(Diagnostics(timeout=1.0, **options))
+    return {"serial": serial, "cold": cold, "warm": warm, "invalidated": invalidated, "hung": hung}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the system is ready for the Bluetooth speaker")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--output", help="also write the JSON report here")
+    parser.add_argument("--no-cache", action="store_true", help="fetch every fact again")
+    parser.add_argument("--check", action="append", help="run only this check (repeatable)")
+    parser.add_argument("--benchmark", action="store_true", help="simulated slow box: serial vs concurrent, "
+                                                                 "cold vs warm cache, a hung tool")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            result = benchmark(directory)
+        print(f"serial (system_check.sh): {result['serial']:.2f} s of tool time")
+        for name in ("cold", "warm", "invalidated", "hung"):
+            report = result[name]
+            timed_out = [check["name"] for check in report["checks"] if check.get("timed_out")]
+            print(f"{name + ':':<13} {report['seconds']:.2f} s, cached {report['cache']['hits'] or '-'}, "
+                  f"fetched {report['cache']['misses'] or '-'}"
+                  f"{', timed out ' + ', '.join(timed_out) if timed_out else ''}")
+        ok = (result["warm"]["seconds"] < 0.6 and not result["warm"]["cache"]["misses"]
+              and "packages" in result["invalidated"]["cache"]["misses"] and result["hung"]["seconds"] < 1.5)
+        return 0 if ok else 1
+
+    config = load_config(args.config)
+    diagnostics = Diagnostics.from_config(config)
+    if args.no_cache:
+        diagnostics.cache.entries = {}
+    report = asyncio.run(diagnostics.run(args.check))
+    if args.output:
+        write_report(report, args.output)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("=== Bluetooth Speaker System Check ===\n")
+        print_report(report)
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
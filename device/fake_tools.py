@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Fake Tool Harness
+Simulated bluetoothctl/pactl (with a `pactl subscribe` event stream), parec captures and
+per-adapter latency, for benchmarks and offline runs
+"""
+
+import asyncio
+import shlex
+
+import numpy as np
+
+from bluetooth_daemon import CommandRunner
+
+
+class FakeDevice:
+    def __init__(self, mac, name, paired=True, trusted=False, connected=False):
+        self.mac = mac
+        self.name = name
+        self.paired = paired
+        self.trusted = trusted
+        self.connected = connected
+
+
+class FakeAdapter:
+    def __init__(self, address, alias="BlueZ", latency=0.0, devices=None):
+        self.address = address
+        self.alias = alias
+        self.latency = latency
+        self.powered = False
+        self.discoverable = False
+        self.pairable = False
+        self.devices = {device.mac: device for device in (devices or [])}
+        self.commands = 0
+
+    def show(self):
+        """Output of `bluetoothctl show`"""
+        yes_no = lambda flag: "yes" if flag else "no"
+        return (
+            f"Controller {self.address} (public)\n"
+            f"\tName: {self.alias}\n"
+            f"\tAlias: {self.alias}\n"
+            f"\tClass: 0x00200414\n"
+            f"\tPowered: {yes_no(self.powered)}\n"
+            f"\tDiscoverable: {yes_no(self.discoverable)}\n"
+            f"\tPairable: {yes_no(self.pairable)}\n"
+            + ("\tUUID: Audio Sink                (0000110b-0000-1000-8000-00805f9b34fb)\n" if self.powered else "")
+            + f"\tDiscovering: no\n"
+        )
+
+    def info(self, mac):
+        """Output of `bluetoothctl info <mac>`"""
+        device = self.devices.get(mac)
+        if device is None:
+            return f"Device {mac} not available\n"
+        yes_no = lambda flag: "yes" if flag else "no"
+        return (
+            f"Device {device.mac} (public)\n"
+            f"\tName: {device.name}\n"
+            f"\tAlias: {device.name}\n"
+            f"\tClass: 0x005a020c\n"
+            f"\tIcon: phone\n"
+            f"\tPaired: {yes_no(device.paired)}\n"
+            f"\tTrusted: {yes_no(device.trusted)}\n"
+            f"\tBlocked: no\n"
+            f"\tConnected: {yes_no(device.connected)}\n"
+            f"\tUUID: Audio Source              (0000110a-0000-1000-8000-00805f9b34fb)\n"
+        )
+
+
+class FakeSession:
+    """Stand-in for an interactive bluetoothctl process (pairing agent)"""
+
+    class _Stdin:
+        def __init__(self, session):
+            self.session = session
+
+        def write(self, data):
+            self.session.received.append(data)
+
+        async def drain(self):
+            pass
+
+    class _Stdout:
+        def __init__(self, session):
+            self.session = session
+
+        async def read(self, size=-1):
+            return await self.session.output.get()
+
+    def __init__(self):
+        self.received = []
+        self.output = asyncio.Queue()
+        self.stdin = self._Stdin(self)
+        self.stdout = self._Stdout(self)
+        self.returncode = None
+
+    def prompt(self, text):
+        """Emit agent output, e.g. an authorization prompt"""
+        self.output.put_nowait(text.encode())
+
+    def kill(self):
+        self.output.put_nowait(b"")
+        self.returncode = -9
+
+    async def wait(self):
+        return self.returncode
+
+
+class FakeStream:
+    """Stand-in for a long-running event process such as `pactl subscribe`; lines arrive via emit()"""
+
+    def __init__(self):
+        self.stdout = asyncio.StreamReader()
+        self.returncode = None
+
+    def emit(self, line):
+        if self.returncode is None:
+            self.stdout.feed_data(f"{line}\n".encode())
+
+    def kill(self):
+        if self.returncode is None:
+            self.returncode = -9
+            self.stdout.feed_eof()
+
+    async def wait(self):
+        return self.returncode
+
+
+class FakeCapture(FakeStream):
+    """Stand-in for `parec`: paced float32 noise at the level FakeRunner.levels holds for the source"""
+
+    def __init__(self, runner, args):
+        super().__init__()
+        options = dict(arg[2:].split("=", 1) for arg in args[1:] if arg.startswith("--") and "=" in arg)
+        self.source = options.get("device")
+        self.rate = int(options.get("rate", 44100))
+        self.channels = int(options.get("channels", 2))
+        self.pid = id(self)
+        self._task = asyncio.ensure_future(self._produce(runner))
+
+    async def _produce(self, runner, interval=0.02):
+        rng = np.random.default_rng(abs(hash(self.source)) % (1 << 32))
+        while True:
+            await asyncio.sleep(interval)
+            level = runner.levels.get(self.source, 0.0)
+            frames = rng.normal(0, level, int(self.rate * interval) * self.channels).astype(np.float32)
+            self.stdout.feed_data(frames.tobytes())
+
+    def kill(self):
+        self._task.cancel()
+        super().kill()
+
+
+class FakeRunner(CommandRunner):
+    """CommandRunner that answers from in-memory adapters instead of spawning tools"""
+
+    def __init__(self, adapters, sinks=None, packages=None, tool_latency=None, sources=None):
+        self.adapters = {adapter.address: adapter for adapter in adapters}
+        self.packages = dict(packages or {"bluez": "5.66-1", "pulseaudio-module-bluetooth": "16.1+dfsg1-2",
+                                          "python3": "3.11.2-1"})
+        # Seconds each tool takes to answer, to simulate a slow box
+        self.tool_latency = dict(tool_latency or {})
+        self.default = adapters[0].address if adapters else None
+        self.sinks = list(sinks or ["alsa_output.pci-0000_00_1f.3.analog-stereo"])
+        self.sources = list(sources or [])
+        self.default_sink = self.sinks[0]
+        self.modules = {}
+        self.next_module = 1
+        self.indexes = {}  # (facility, name) -> index, stable like the server's
+        self.streams = []
+        self.levels = {}  # source -> RMS level its parec captures deliver (0 = silence)
+        self.sessions = []
+        self.calls = []
+
+    async def run(self, args, input=None, timeout=10):
+        self.calls.append((tuple(args), input))
+        try:
+            if self.tool_latency.get(args[0]):
+                await asyncio.wait_for(asyncio.sleep(self.tool_latency[args[0]]), timeout)
+            if args[0] == "bluetoothctl":
+                lines = input.splitlines() if input is not None else [" ".join(args[1:])]
+                return await asyncio.wait_for(self._bluetoothctl(lines), timeout)
+            if args[0] == "pactl":
+                return True, self._pactl(args[1:]), ""
+            if args[0] == "systemctl":
+                return True, "active\n", ""
+            if args[0] == "dpkg-query":
+                return self._dpkg_query(args[3:])
+            if args[0] == "btmgmt":
+                return True, self._btmgmt(), ""
+        except asyncio.TimeoutError:
+            return False, "", "Command timed out"
+        return True, "", ""
+
+    async def open_session(self, args):
+        session = FakeSession()
+        self.sessions.append(session)
+        return session
+
+    async def open_pipe(self, args, write=False):
+        if list(args[:2]) == ["pactl", "subscribe"]:
+            stream = FakeStream()
+            self.streams.append(stream)
+            return stream
+        if args[0] == "parec":
+            return FakeCapture(self, args)
+        return await super().open_pipe(args, write=write)
+
+    def _index(self, facility, name):
+        key = (facility, name)
+        if key not in self.indexes:
+            self.indexes[key] = len(self.indexes)
+        return self.indexes[key]
+
+    def emit(self, event, facility, index):
+        """Send a `pactl subscribe` line to every subscriber"""
+        for stream in self.streams:
+            stream.emit(f"Event '{event}' on {facility} #{index}")
+
+    def _objects(self, facility):
+        connected = [device.mac.replace(":", "_") for adapter in self.adapters.values()
+                     for device in adapter.devices.values() if device.connected]
+        if facility == "sink":
+            return self.sinks
+        if facility == "source":
+            return ([f"{sink}.monitor" for sink in self.sinks] + self.sources
+                    + [f"bluez_source.{key}.a2dp_source" for key in connected])
+        return ["alsa_card.pci-0000_00_1f.3"] + [f"bluez_card.{key}" for key in connected]
+
+    def _phone(self, mac, event):
+        key = mac.replace(":", "_")
+        for facility, name in (("card", f"bluez_card.{key}"), ("source", f"bluez_source.{key}.a2dp_source")):
+            self.emit(event, facility, self._index(facility, name))
+
+    def add_sink(self, name):
+        """Hot-plug an output (headphones, HDMI)"""
+        self.sinks.append(name)
+        self.emit("new", "sink", self._index("sink", name))
+        self.emit("new", "source", self._index("source", f"{name}.monitor"))
+
+    def remove_sink(self, name):
+        self.sinks.remove(name)
+        self.emit("remove", "sink", self._index("sink", name))
+        self.emit("remove", "source", self._index("source", f"{name}.monitor"))
+
+    async def _bluetoothctl(self, lines):
+        adapter = self.adapters.get(self.default)
+        output = []
+        for line in lines:
+            words = line.split()
+            if not words:
+                continue
+            command, rest = words[0], words[1:]
+            if command == "quit":
+                break
+            if command == "select":
+                adapter = self.adapters.get(rest[0])
+                if adapter is None:
+                    output.append(f"Controller {rest[0]} not available")
+                    return False, "\n".join(output) + "\n", ""
+                continue
+            if command == "list":
+                for address, item in self.adapters.items():
+                    suffix = " [default]" if address == self.default else ""
+                    output.append(f"Controller {address} {item.alias}{suffix}")
+                continue
+            if adapter is None:
+                return False, "", "No default controller available"
+
+            adapter.commands += 1
+            if adapter.latency:
+                await asyncio.sleep(adapter.latency)
+            output.append(self._adapter_command(adapter, command, rest))
+        return True, "\n".join(output) + "\n", ""
+
+    def _adapter_command(self, adapter, command, rest):
+        if command == "power":
+            adapter.powered = rest[0] == "on"
+            return f"Changing power {rest[0]} succeeded"
+        if command in ("discoverable", "pairable"):
+            setattr(adapter, command, rest[0] == "on")
+            return f"Changing {command} {rest[0]} succeeded"
+        if command == "system-alias":
+            adapter.alias = " ".join(rest)
+            return f"Changing {adapter.alias} succeeded"
+        if command == "show":
+            return adapter.show()
+        if command == "info":
+            return adapter.info(rest[0])
+        if command in ("devices", "paired-devices"):
+            wanted = rest[0] if rest else ("Paired" if command == "paired-devices" else None)
+            selected = [
+                device for device in adapter.devices.values()
+                if wanted is None or getattr(device, wanted.lower(), False)
+            ]
+            return "\n".join(f"Device {device.mac} {device.name}" for device in selected)
+
+        device = adapter.devices.get(rest[0]) if rest else None
+        if device is None:
+            return f"Device {rest[0] if rest else ''} not available"
+        if command == "connect":
+            if not device.connected:
+                device.connected = True
+                self._phone(device.mac, "new")
+            return f"Attempting to connect to {device.mac}\nConnection successful"
+        if command == "disconnect":
+            if device.connected:
+                device.connected = False
+                self._phone(device.mac, "remove")
+            return f"Attempting to disconnect from {device.mac}\nSuccessful disconnected"
+        if command == "trust":
+            device.trusted = True
+            return f"Changing {device.mac} trust succeeded"
+        if command == "untrust":
+            device.trusted = False
+            return f"Changing {device.mac} untrust succeeded"
+        if command == "remove":
+            del adapter.devices[device.mac]
+            return "Device has been removed"
+        return f"Invalid command in menu main: {command}"
+
+    def _dpkg_query(self, names):
+        lines, missing = [], []
+        for name in names:
+            if name in self.packages:
+                lines.append(f"{name}\tii \t{self.packages[name]}\n")
+            else:
+                missing.append(f"dpkg-query: no packages found matching {name}\n")
+        return not missing, "".join(lines), "".join(missing)
+
+    def _btmgmt(self):
+        output = [f"Index list with {len(self.adapters)} items"]
+        for index, adapter in enumerate(self.adapters.values()):
+            output += [f"hci{index}:\tPrimary controller",
+                       f"\taddr {adapter.address} version 8 manufacturer 10 class 0x6c0414",
+                       "\tsupported settings: powered connectable fast-connectable discoverable bondable "
+                       "link-security ssp br/edr le advertising secure-conn privacy",
+                       f"\tcurrent settings: {'powered ' if adapter.powered else ''}ssp br/edr le",
+                       f"\tname {adapter.alias}"]
+        return "\n".join(output) + "\n"
+
+    def _pactl(self, args):
+        if args[0] == "info":
+            return ("Server String: /run/user/1000/pulse/native\nServer Name: pulseaudio\nServer Version: 16.1\n"
+                    f"Default Sink: {self.default_sink}\n")
+        if args[:2] == ["list", "short"]:
+            if args[2] == "modules":
+                return "".join(f"{index}\t{name}\t{argument}\t\n"
+                               for index, (name, argument) in self.modules.items())
+            facility = args[2].rstrip("s")
+            if facility == "card":
+                return "".join(f"{self._index('card', name)}\t{name}\tmodule-{name.split('_')[0]}-card.c\n"
+                               for name in self._objects("card"))
+            if facility in ("sink", "source"):
+                driver = "module-alsa-card.c"
+                return "".join(f"{self._index(facility, name)}\t{name}\t{driver}\ts16le 2ch 44100Hz\tSUSPENDED\n"
+                               for name in self._objects(facility))
+            return ""
+        if args[0] == "load-module":
+            index = self.next_module
+            self.next_module += 1
+            self.modules[index] = (args[1], " ".join(shlex.quote(arg) for arg in args[2:]))
+            self.emit("new", "module", index)
+            return f"{index}\n"
+        if args[0] == "unload-module":
+            index = int(args[1]) if args[1].isdigit() else None
+            if self.modules.pop(index, None) is not None:
+                self.emit("remove", "module", index)
+        if args[0] == "set-default-sink" and args[1] in self.sinks:
+            self.default_sink = args[1]
+            self.emit("change", "server", -1)
+        return ""
+
+
+def make_adapters(count, latency=0.0, devices_per_adapter=2, slow_latency=None):
+    """Build `count` fake adapters with a few paired phones each; the first can be made slow"""
+    adapters = []
+    for index in range(count):
+        address = f"00:1A:7D:DA:{index // 256:02X}:{index % 256:02X}"
+        devices = [
+            FakeDevice(f"AC:37:{index // 256:02X}:{index % 256:02X}:{n // 256:02X}:{n % 256:02X}",
+                       f"Phone {index}-{n}")
+            for n in range(devices_per_adapter)
+        ]
+        adapter_latency = slow_latency if (slow_latency is not None and index == 0) else latency
+        adapters.append(FakeAdapter(address, alias=f"hci{index}", latency=adapter_latency, devices=devices))
+    return adapters
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - FEC Framing
+Sync word, length, CRC32 and interleaved Reed-Solomon coding for data sent over the audio path
+"""
+
+import argparse
+import sys
+import time
+import zlib
+
+import numpy as np
+
+SYNC_WORD = b"\x1a\xcf\xfc\x1d"  # CCSDS attached sync marker
+SYNC_BITS = np.unpackbits(np.frombuffer(SYNC_WORD, dtype=np.uint8))
+HEADER_BYTES = 2  # big-endian payload length
+CRC_BYTES = 4
+GF_PRIMITIVE = 0x11D
+
+
+class FrameError(Exception):
+    """Raised when a frame cannot be decoded"""
+
+
+# ----------------------------------------------------------------- GF(2^8)
+
+def _gf_tables():
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= GF_PRIMITIVE
+    exp[255:510] = exp[:255]
+    a = np.arange(256)
+    mul = exp[(log[a][:, None] + log[a][None, :]) % 255].astype(np.uint8)
+    mul[0, :] = 0
+    mul[:, 0] = 0
+    return exp, log, mul
+
+
+GF_EXP, GF_LOG, GF_MUL = _gf_tables()
+
+
+def gf_mul(x, y):
+    if x == 0 or y == 0:
+        return 0
+    return int(GF_EXP[GF_LOG[x] + GF_LOG[y]])
+
+
+def gf_div(x, y):
+    if y == 0:
+        raise ZeroDivisionError()
+    if x == 0:
+        return 0
+    return int(GF_EXP[(GF_LOG[x] + 255 - GF_LOG[y]) % 255])
+
+
+def gf_pow(x, power):
+    return int(GF_EXP[(GF_LOG[x] * power) % 255])
+
+
+def gf_inverse(x):
+    return int(GF_EXP[255 - GF_LOG[x]])
+
+
+def gf_poly_scale(p, x):
+    return [gf_mul(c, x) for c in p]
+
+
+def gf_poly_add(p, q):
+    r = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        r[i + len(r) - len(p)] = c
+    for i, c in enumerate(q):
+        r[i + len(r) - len(q)] ^= c
+    return r
+
+
+def gf_poly_mul(p, q):
+    r = [0] * (len(p) + len(q) - 1)
+    for j, qc in enumerate(q):
+        for i, pc in enumerate(p):
+            r[i + j] ^= gf_mul(pc, qc)
+    return r
+
+
+def gf_poly_eval(poly, x):
+    y = poly[0]
+    for c in poly[1:]:
+        y = gf_mul(y, x) ^ c
+    return y
+
+
+def gf_poly_div(dividend, divisor):
+    out = list(dividend)
+    for i in range(len(dividend) - (len(divisor) - 1)):
+        coef = out[i]
+        if coef != 0:
+            for j in range(1, len(divisor)):
+                if divisor[j] != 0:
+                    out[i + j] ^= gf_mul(divisor[j], coef)
+    separator = -(len(divisor) - 1)
+    return out[:separator], out[separator:]
+
+
+# ------------------------------------------------------------ Reed-Solomon
+
+class ReedSolomon:
+    """Shortened RS over GF(256) with `nsym` parity bytes; batch encode/syndromes in NumPy"""
+
+    def __init__(self, nsym):
+        self.nsym = nsym
+        gen = [1]
+        for i in range(nsym):
+            gen = gf_poly_mul(gen, [1, gf_pow(2, i)])
+        self.generator = gen
+        self.feedback = np.array(gen[1:], dtype=np.uint8)
+        self._syndrome_exponents = {}
+
+    def encode(self, messages):
+        """(B, k) uint8 messages -> (B, k + nsym) codewords, LFSR vectorized across the batch"""
+        messages = np.asarray(messages, dtype=np.uint8)
+        remainder = np.zeros((messages.shape[0], self.nsym), dtype=np.uint8)
+        feedback_row = self.feedback[None, :]
+        for i in range(messages.shape[1]):
+            feedback = messages[:, i] ^ remainder[:, 0]
+            remainder[:, :-1] = remainder[:, 1:]
+            remainder[:, -1] = 0
+            remainder ^= GF_MUL[feedback[:, None], feedback_row]
+        return np.concatenate([messages, remainder], axis=1)
+
+    def syndromes(self, codewords):
+        """(B, n) codewords -> (B, nsym) syndromes via log/exp lookup, no per-byte Python loop"""
+        n = codewords.shape[1]
+        exponents = self._syndrome_exponents.get(n)
+        if exponents is None:
+            positions = (n - 1 - np.arange(n))[:, None]
+            exponents = (positions * np.arange(self.nsym)[None, :]) % 255
+            self._syndrome_exponents[n] = exponents
+        nonzero = codewords != 0
+        logs = GF_LOG[codewords]
+        terms = GF_EXP[(logs[:, :, None] + exponents[None, :, :]) % 255]
+        terms[~nonzero] = 0
+        return np.bitwise_xor.reduce(terms, axis=1).astype(np.uint8)
+
+    def correct(self, codeword, syndromes):
+        """Berlekamp-Massey, Chien search and Forney for one codeword with nonzero syndromes"""
+        msg = [int(c) for c in codeword]
+        synd = [0] + [int(s) for s in syndromes]
+        nsym = self.nsym
+
+        err_loc, old_loc = [1], [1]
+        for i in range(nsym):
+            k = i + 1
+            delta = synd[k]
+            for j in range(1, len(err_loc)):
+                delta ^= gf_mul(err_loc[-(j + 1)], synd[k - j])
+            old_loc = old_loc + [0]
+            if delta != 0:
+                if len(old_loc) > len(err_loc):
+                    new_loc = gf_poly_scale(old_loc, delta)
+                    old_loc = gf_poly_scale(err_loc, gf_inverse(delta))
+                    err_loc = new_loc
+                err_loc = gf_poly_add(err_loc, gf_poly_scale(old_loc, delta))
+        while err_loc and err_loc[0] == 0:
+            del err_loc[0]
+        errors = len(err_loc) - 1
+        if errors * 2 > nsym:
+            raise FrameError("too many errors")
+
+        # Chien search, evaluated for all positions at once
+        n = len(msg)
+        reversed_loc = err_loc[::-1]
+        powers = np.arange(n)
+        values = np.zeros(n, dtype=np.int32)
+        for coef in reversed_loc:
+            # Horner step: values = values * alpha^i ^ coef
+            nz = values != 0
+            values[nz] = GF_EXP[(GF_LOG[values[nz]] + powers[nz]) % 255]
+            values ^= coef
+        err_pos = [n - 1 - i for i in np.nonzero(values == 0)[0]]
+        if len(err_pos) != errors:
+            raise FrameError("error locator has wrong number of roots")
+
+        # Forney
+        coef_pos = [n - 1 - p for p in err_pos]
+        errata_loc = [1]
+        for i in coef_pos:
+            errata_loc = gf_poly_mul(errata_loc, gf_poly_add([1], [gf_pow(2, i), 0]))
+        _, remainder = gf_poly_div(gf_poly_mul(synd[::-1], errata_loc), [1] + [0] * len(errata_loc))
+        err_eval = remainder[::-1]
+        x = [gf_pow(2, -(255 - c)) for c in coef_pos]
+        for i, xi in enumerate(x):
+            xi_inv = gf_inverse(xi)
+            loc_prime = 1
+            for j, xj in enumerate(x):
+                if j != i:
+                    loc_prime = gf_mul(loc_prime, 1 ^ gf_mul(xi_inv, xj))
+            y = gf_mul(xi, gf_poly_eval(err_eval[::-1], xi_inv))
+            if loc_prime == 0:
+                raise FrameError("could not compute error magnitude")
+            msg[err_pos[i]] ^= gf_div(y, loc_prime)
+        return np.array(msg, dtype=np.uint8), errors
+
+    def decode(self, codewords):
+        """(B, n) codewords -> (corrected (B, n), ok (B,), corrected symbol count (B,))"""
+        codewords = np.array(codewords, dtype=np.uint8)
+        syndromes = self.syndromes(codewords)
+        dirty = np.nonzero(syndromes.any(axis=1))[0]
+        ok = np.ones(len(codewords), dtype=bool)
+        corrected = np.zeros(len(codewords), dtype=np.int32)
+        for index in dirty:
+            try:
+                fixed, errors = self.correct(codewords[index], syndromes[index])
+            except FrameError:
+                ok[index] = False
+                continue
+            codewords[index] = fixed
+            corrected[index] = errors
+        if len(dirty):
+            recheck = self.syndromes(codewords[dirty]).any(axis=1)
+            ok[dirty[recheck]] = False
+        return codewords, ok, corrected
+
+
+# ------------------------------------------------------------------- CRC32
+
+def _crc_table():
+    table = np.zeros(256, dtype=np.uint32)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = (c >> 1) ^ 0xEDB88320 if c & 1 else c >> 1
+        table[i] = c
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc32_rows(data):
+    """zlib-compatible CRC32 of every row of a (B, L) uint8 array, table-driven across rows"""
+    data = np.asarray(data, dtype=np.uint8)
+    crc = np.full(data.shape[0], 0xFFFFFFFF, dtype=np.uint32)
+    for i in range(data.shape[1]):
+        crc = CRC_TABLE[(crc ^ data[:, i]) & 0xFF] ^ (crc >> np.uint32(8))
+    return crc ^ np.uint32(0xFFFFFFFF)
+
+
+# ---------------------------------------------------------------- framing
+
+class FrameStats:
+    __slots__ = ("frames", "good", "crc_failures", "rs_failures", "corrected_symbols")
+
+    def __init__(self):
+        self.frames = 0
+        self.good = 0
+        self.crc_failures = 0
+        self.rs_failures = 0
+        self.corrected_symbols = 0
+
+
+class FrameCodec:
+    """Fixed-size frames: SYNC | interleaved RS( [len | payload | crc32] )"""
+
+    def __init__(self, payload_size=200, nsym=32, codeword_data=223, interleave=True):
+        if nsym + codeword_data > 255:
+            raise ValueError("nsym + codeword_data must not exceed 255")
+        self.payload_size = payload_size
+        self.nsym = nsym
+        self.interleave = interleave
+        self.rs = ReedSolomon(nsym)
+
+        self.data_bytes = HEADER_BYTES + payload_size + CRC_BYTES
+        self.codewords = -(-self.data_bytes // codeword_data)
+        self.codeword_data = -(-self.data_bytes // self.codewords)
+        self.codeword_bytes = self.codeword_data + nsym
+        self.coded_bytes = self.codewords * self.codeword_bytes
+        self.frame_bytes = len(SYNC_WORD) + self.coded_bytes
+        self.frame_bits = self.frame_bytes * 8
+
+    @property
+    def code_rate(self):
+        return self.payload_size / self.frame_bytes
+
+    def encode(self, payloads):
+        """List of byte strings (each <= payload_size) -> (F, frame_bytes) uint8 frames"""
+        count = len(payloads)
+        data = np.zeros((count, self.codewords * self.codeword_data), dtype=np.uint8)
+        for row, payload in enumerate(payloads):
+            if len(payload) > self.payload_size:
+                raise ValueError(f"payload of {len(payload)} bytes exceeds {self.payload_size}")
+            data[row, 0] = len(payload) >> 8
+            data[row, 1] = len(payload) & 0xFF
+            data[row, HEADER_BYTES:HEADER_BYTES + len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+
+        crc_end = HEADER_BYTES + self.payload_size
+        crc = crc32_rows(data[:, :crc_end])
+        data[:, crc_end:crc_end + CRC_BYTES] = crc.astype(">u4").view(np.uint8).reshape(count, CRC_BYTES)
+
+        blocks = data.reshape(count * self.codewords, self.codeword_data)
+        coded = self.rs.encode(blocks).reshape(count, self.codewords, self.codeword_bytes)
+        if self.interleave:
+            # Send byte 0 of every codeword, then byte 1, ... so bursts spread across codewords
+            coded = coded.transpose(0, 2, 1)
+        frames = np.empty((count, self.frame_bytes), dtype=np.uint8)
+        frames[:, :len(SYNC_WORD)] = np.frombuffer(SYNC_WORD, dtype=np.uint8)
+        frames[:, len(SYNC_WORD):] = coded.reshape(count, self.coded_bytes)
+        return frames
+
+    def encode_message(self, data):
+        """Split an arbitrary byte string into frames"""
+        chunks = [data[i:i + self.payload_size] for i in range(0, len(data), self.payload_size)] or [b""]
+        return self.encode(chunks)
+
+    def decode(self, frames, stats=None):
+        """(F, frame_bytes) aligned frames -> list of payload bytes (None for undecodable frames)"""
+        frames = np.asarray(frames, dtype=np.uint8).reshape(-1, self.frame_bytes)
+        stats = stats if stats is not None else FrameStats()
+        count = len(frames)
+        coded = frames[:, len(SYNC_WORD):]
+        if self.interleave:
+            coded = coded.reshape(count, self.codeword_bytes, self.codewords).transpose(0, 2, 1)
+        blocks = coded.reshape(count * self.codewords, self.codeword_bytes)
+
+        fixed, ok, corrected = self.rs.decode(blocks)
+        ok = ok.reshape(count, self.codewords).all(axis=1)
+        data = fixed[:, :self.codeword_data].reshape(count, -1)
+
+        crc_end = HEADER_BYTES + self.payload_size
+        expected = data[:, crc_end:crc_end + CRC_BYTES].copy().view(">u4").reshape(count)
+        lengths = (data[:, 0].astype(np.int32) << 8) | data[:, 1]
+        crc_ok = (crc32_rows(data[:, :crc_end]) == expected) & (lengths <= self.payload_size)
+
+        stats.frames += count
+        stats.rs_failures += int((~ok).sum())
+        stats.crc_failures += int((ok & ~crc_ok).sum())
+        stats.corrected_symbols += int(corrected.sum())
+        good = ok & crc_ok
+        stats.good += int(good.sum())
+        return [bytes(data[i, HEADER_BYTES:HEADER_BYTES + lengths[i]]) if good[i] else None
+                for i in range(count)]
+
+    def find_sync(self, bits, max_errors=3):
+        """Bit offsets where the sync word appears with at most `max_errors` flipped bits"""
+        bits = np.asarray(bits, dtype=np.uint8)
+        if len(bits) < len(SYNC_BITS):
+            return np.zeros(0, dtype=np.int64)
+        signed = bits.astype(np.int8) * 2 - 1
+        pattern = (SYNC_BITS.astype(np.int8) * 2 - 1)[::-1]
+        score = np.convolve(signed, pattern, mode="valid")
+        candidates = np.nonzero(score >= len(SYNC_BITS) - 2 * max_errors)[0]
+        # Keep the first hit of every frame-length window
+        starts = []
+        for offset in candidates:
+            if not starts or offset - starts[-1] >= self.frame_bits:
+                starts.append(offset)
+        return np.array(starts, dtype=np.int64)
+
+    def decode_bits(self, bits, stats=None, max_sync_errors=3):
+        """Find and decode every complete frame in a hard-decision bit stream"""
+        bits = np.asarray(bits, dtype=np.uint8)
+        starts = self.find_sync(bits, max_sync_errors)
+        starts = starts[starts + self.frame_bits <= len(bits)]
+        if not len(starts):
+            return []
+        index = starts[:, None] + np.arange(self.frame_bits)[None, :]
+        frames = np.packbits(bits[index], axis=1)
+        return self.decode(frames, stats)
+
+
+def frames_to_bits(frames):
+    return np.unpackbits(np.asarray(frames, dtype=np.uint8), axis=-1).reshape(-1)
+
+
+def benchmark(frames=2000, payload_size=200, nsym=32, error_rates=(1e-4, 1e-3, 3e-3, 1e-2, 2e-2, 3e-2)):
+    """Encode/decode throughput and residual frame/bit error rates against injected bit errors"""
+    rng = np.random.default_rng(1)
+    codec = FrameCodec(payload_size=payload_size, nsym=nsym)
+    payloads = [rng.integers(0, 256, payload_size, dtype=np.uint8).tobytes() for _ in range(frames)]
+    assert crc32_rows(np.frombuffer(payloads[0], dtype=np.uint8)[None, :])[0] == zlib.crc32(payloads[0])
+
+    started = time.perf_counter()
+    encoded = codec.encode(payloads)
+    encode_rate = frames * payload_size / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    decoded = codec.decode(encoded)
+    decode_rate = frames * payload_size / (time.perf_counter() - started)
+    assert decoded == payloads
+
+    curves = []
+    for ber in error_rates:
+        bits = frames_to_bits(encoded).reshape(frames, -1).copy()
+        flips = rng.random(bits.shape) < ber
+        flips[:, :len(SYNC_BITS)] = False  # frames are assumed aligned here
+        bits ^= flips.astype(np.uint8)
+        stats = FrameStats()
+        started = time.perf_counter()
+        result = codec.decode(np.packbits(bits, axis=1), stats)
+        elapsed = time.perf_counter() - started
+        wrong_bits = 0
+        for sent, got in zip(payloads, result):
+            if got is None:
+                wrong_bits += len(sent) * 8
+            elif got != sent:
+                wrong_bits += int(np.unpackbits(np.frombuffer(sent, np.uint8) ^ np.frombuffer(got, np.uint8)).sum())
+        curves.append((ber, 1 - stats.good / frames, wrong_bits / (frames * payload_size * 8),
+                       frames * payload_size / elapsed))
+    return codec, encode_rate, decode_rate, curves
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FEC framing layer for the audio data channel")
+    parser.add_argument("--benchmark", action="store_true", help="throughput and residual error curves")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--payload", type=int, default=200)
+    parser.add_argument("--nsym", type=int, default=32)
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    codec, encode_rate, decode_rate, curves = benchmark(args.frames, args.payload, args.nsym)
+    print(f"frame: {codec.frame_bytes} bytes, {codec.codewords} x RS({codec.codeword_bytes},"
+          f"{codec.codeword_data}), code rate {codec.code_rate:.3f}")
+    print(f"encode: {encode_rate / 1e6:.2f} MB/s payload   decode (clean): {decode_rate / 1e6:.2f} MB/s payload")
+    print(f"{'input BER':>10} {'frame err':>10} {'residual BER':>13} {'decode MB/s':>12}")
+    for ber, fer, residual, rate in curves:
+        print(f"{ber:>10.0e} {fer:>10.4f} {residual:>13.2e} {rate / 1e6:>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
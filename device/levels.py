@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Level Meters
+Per-channel RMS, peak, peak-hold and clip counts, published in a small mmap'd record
+"""
+
+import argparse
+import math
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from shared_record import SharedRecordReader, SharedRecordWriter, default_path
+
+DEFAULT_LEVELS_FILE = default_path("bluetooth_speaker_levels")
+MAGIC = b"BTLV"
+VERSION = 2
+FLAG_SUSPENDED = 1
+
+# channels, sample rate, blocks metered, wall-clock time of the last block
+SUMMARY = struct.Struct("<IIQd")
+# Per channel: RMS, peak, peak-hold (linear full scale), clipped samples since start
+CHANNEL = struct.Struct("<fff4xQ")
+
+
+def payload_size(channels):
+    return SUMMARY.size + CHANNEL.size * channels
+
+
+def to_db(level):
+    return 20 * math.log10(level) if level > 0 else -math.inf
+
+
+class LevelRecord:
+    """Writer side of the level record (see shared_record.py)"""
+
+    def __init__(self, path=DEFAULT_LEVELS_FILE, channels=2, sample_rate=44100):
+        self.path = path
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self._record = SharedRecordWriter(path, MAGIC, VERSION, payload_size(channels))
+        self._body = struct.Struct("<" + CHANNEL.format[1:] * channels)
+        self.flags = 0
+        self.blocks = 0
+        self.publish(np.zeros(channels), np.zeros(channels), np.zeros(channels), np.zeros(channels, dtype=np.int64))
+
+    def publish(self, rms, peak, hold, clips):
+        values = []
+        for channel in range(self.channels):
+            values += (rms[channel], peak[channel], hold[channel], clips[channel])
+        record = self._record
+        record.flags = self.flags
+        record.begin()
+        record.pack(SUMMARY, 0, self.channels, self.sample_rate, self.blocks, time.time())
+        record.pack(self._body, SUMMARY.size, *values)
+        record.end()
+
+    def close(self):
+        self._record.close()
+
+
+class LevelMeter:
+    """Pipeline stage: measures each block and publishes the result; the audio passes through untouched
+
+    Peak-hold keeps the highest peak for `hold_seconds`, then falls at `fall_db_per_second`.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, path=DEFAULT_LEVELS_FILE, hold_seconds=1.5,
+                 fall_db_per_second=20.0, clip_level=0.999):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.hold_seconds = hold_seconds
+        self.fall_db_per_second = fall_db_per_second
+        self.clip_level = clip_level
+        self.rms = np.zeros(channels)
+        self.peak = np.zeros(channels)
+        self.hold = np.zeros(channels)
+        self.clips = np.zeros(channels, dtype=np.int64)
+        self._hold_age = np.zeros(channels)
+        self.record = LevelRecord(path, channels, sample_rate) if path else None
+
+    def process(self, block):
+        frames = len(block)
+        if not frames:
+            return block
+        seconds = frames / self.sample_rate
+        self.rms = np.sqrt(np.einsum("ij,ij->j", block, block, dtype=np.float64) / frames)
+        self.peak = np.maximum(block.max(axis=0), -block.min(axis=0)).astype(np.float64)
+        if self.peak.max() >= self.clip_level:
+            # Only blocks that reach full scale pay for an exact count
+            self.clips += np.count_nonzero(np.abs(block) >= self.clip_level, axis=0)
+
+        self._hold_age += seconds
+        falling = np.maximum(self._hold_age - self.hold_seconds, 0.0)
+        fall = np.minimum(falling, seconds) * self.fall_db_per_second
+        self.hold *= 10 ** (-fall / 20)
+        higher = self.peak >= self.hold
+        self.hold[higher] = self.peak[higher]
+        self._hold_age[higher] = 0.0
+
+        if self.record:
+            self.record.blocks += 1
+            self.record.publish(self.rms, self.peak, self.hold, self.clips)
+        return block
+
+    def suspend(self):
+        """Publish silence while the pipeline is suspended instead of leaving stale levels behind"""
+        self.rms[:] = self.peak[:] = self.hold[:] = 0.0
+        if self.record:
+            self.record.flags |= FLAG_SUSPENDED
+            self.record.publish(self.rms, self.peak, self.hold, self.clips)
+
+    def resume(self):
+        if self.record:
+            self.record.flags &= ~FLAG_SUSPENDED
+
+    def close(self):
+        if self.record:
+            self.record.close()
+
+
+class LevelReader:
+    """Read-only view of a level record; any number of readers can sample it at any rate"""
+
+    def __init__(self, path=DEFAULT_LEVELS_FILE):
+        self._record = SharedRecordReader(path, MAGIC, VERSION)
+
+    @property
+    def sequence(self):
+        return self._record.sequence
+
+    def read(self):
+        """Consistent snapshot as a dict, or None if the writer kept it busy for every attempt"""
+        snapshot = self._record.snapshot()
+        if snapshot is None:
+            return None
+        flags, _, data = snapshot
+        channels, sample_rate, blocks, stamp = SUMMARY.unpack_from(data, 0)
+        return {
+            "sample_rate": sample_rate,
+            "suspended": bool(flags & FLAG_SUSPENDED),
+            "blocks": blocks,
+            "age_seconds": time.time() - stamp,
+            "channels": [dict(zip(("rms", "peak", "hold", "clips"),
+                                  CHANNEL.unpack_from(data, SUMMARY.size + CHANNEL.size * index)))
+                         for index in range(channels)],
+        }
+
+    def close(self):
+        self._record.close()
+
+
+def _bar(level_db, hold_db, width=40, floor_db=-60.0):
+    filled = int(max(0.0, min(1.0, (level_db - floor_db) / -floor_db)) * width)
+    bar = ["#"] * filled + ["-"] * (width - filled)
+    if hold_db > floor_db:
+        bar[min(width - 1, int((hold_db - floor_db) / -floor_db * width))] = "|"
+    return "".join(bar)
+
+
+def watch(path, interval=0.1):
+    reader = LevelReader(path)
+    try:
+        while True:
+            levels = reader.read()
+            if levels:
+                rows = []
+                for index, channel in enumerate(levels["channels"]):
+                    peak, hold = to_db(channel["peak"]), to_db(channel["hold"])
+                    rows.append(f"ch{index} {_bar(peak, hold)} {to_db(channel['rms']):6.1f} dB RMS "
+                                f"{peak:6.1f} peak  {channel['clips']} clips")
+                state = " (suspended)" if levels["suspended"] else ""
+                print("\033[2K" + "  ".join(rows) + state, end="\r", flush=True)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+    finally:
+        reader.close()
+
+
+def benchmark(sample_rate=44100, block_ms=10.0, seconds=30.0, reads=200000):
+    """Meter + publish cost per block, reader throughput, and a check that peak-hold falls"""
+    import tempfile
+
+    rng = np.random.default_rng(4)
+    block_frames = int(sample_rate * block_ms / 1000)
+    blocks = [rng.normal(0, 0.2, (block_frames, 2)).astype(np.float32) for _ in range(16)]
+    blocks[5][100, 1] = 1.0  # one clipped sample
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "levels")
+        meter = LevelMeter(sample_rate, 2, path)
+        count = int(seconds * 1000 / block_ms)
+        started = time.perf_counter()
+        for index in range(count):
+            meter.process(blocks[index % len(blocks)])
+        per_block = (time.perf_counter() - started) / count
+
+        reader = LevelReader(path)
+        started = time.perf_counter()
+        for _ in range(reads):
+            levels = reader.read()
+        per_read = (time.perf_counter() - started) / reads
+
+        # After a loud burst, hold sits at the burst for hold_seconds and then falls at the set rate
+        loud = np.full((block_frames, 2), 0.5, dtype=np.float32)
+        quiet = np.zeros((block_frames, 2), dtype=np.float32)
+        meter.suspend()  # clears the hold left by the noise
+        meter.resume()
+        meter.process(loud)
+        for _ in range(int(3.5 * 1000 / block_ms)):
+            meter.process(quiet)
+        fallen_db = to_db(0.5) - to_db(reader.read()["channels"][0]["hold"])
+        reader.close()
+        meter.close()
+    return {
+        "meter_us": per_block * 1e6, "read_us": per_read * 1e6, "block_ms": block_ms,
+        "clips": [channel["clips"] for channel in levels["channels"]], "blocks": levels["blocks"],
+        "fallen_db": fallen_db, "expected_fall_db": (3.5 - meter.hold_seconds) * meter.fall_db_per_second,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Level meters published through shared memory")
+    parser.add_argument("--file", default=DEFAULT_LEVELS_FILE, help="level record written by audio_pipeline.py")
+    parser.add_argument("--watch", action="store_true", help="show live meters from the record")
+    parser.add_argument("--benchmark", action="store_true", help="writer and reader cost, peak-hold check")
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        try:
+            watch(args.file)
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}")
+            return 1
+        return 0
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    result = benchmark()
+    print(f"writer:    {result['meter_us']:.1f} us per {result['block_ms']:.0f} ms stereo block "
+          f"({result['blocks']} blocks published)")
+    print(f"reader:    {result['read_us']:.2f} us per consistent snapshot")
+    print(f"clips:     {result['clips']}")
+    print(f"peak-hold: fell {result['fallen_db']:.1f} dB after 3.5 s (expected {result['expected_fall_db']:.1f})")
+    ok = abs(result["fallen_db"] - result["expected_fall_db"]) < 0.5 and result["clips"][1] > 0
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
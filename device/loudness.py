@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Loudness
+Gated (EBU R128 style) loudness measurement, automatic gain and a lookahead limiter per phone
+"""
+
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU below the ungated mean
+HISTOGRAM_FLOOR = -70.0
+HISTOGRAM_STEP = 0.1   # LU per histogram bin
+
+
+def k_weighting_power(sample_rate, size):
+    """|H(f)|^2 of the BS.1770 K-weighting filter (shelf + high-pass) at the rfft bins of `size`"""
+    def response(b, a, w):
+        z = np.exp(-1j * w)
+        return np.abs((b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)) ** 2
+
+    w = 2 * np.pi * np.fft.rfftfreq(size)
+    # Same analog prototypes as libebur128, so any sample rate matches the 48 kHz reference
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0)
+    shelf_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    pass_b = (1.0, -2.0, 1.0)
+    pass_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    return response(shelf_b, shelf_a, w) * response(pass_b, pass_a, w)
+
+
+class LoudnessMeter:
+    """Momentary and gated integrated loudness from 100 ms sub-blocks
+
+    K-weighted power is taken from each sub-block's spectrum (Parseval) instead of running the
+    IIR filters sample by sample. Gated blocks go into a fixed histogram, so memory stays
+    constant however long the session is; `forget_seconds` lets old material fade out.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, forget_seconds=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sub_block = sample_rate // 10
+        self._weights = k_weighting_power(sample_rate, self.sub_block)
+        self._weights[1:-1 if self.sub_block % 2 == 0 else None] *= 2  # one-sided spectrum
+        self._buffer = np.zeros((self.sub_block, channels), dtype=np.float32)
+        self._filled = 0
+        self._powers = np.zeros(4)  # last four sub-blocks make one 400 ms gating block
+        self._count = 0
+        bins = int((10.0 - HISTOGRAM_FLOOR) / HISTOGRAM_STEP)
+        self._histogram = np.zeros(bins)
+        self._bin_power = 10 ** ((HISTOGRAM_FLOOR + (np.arange(bins) + 0.5) * HISTOGRAM_STEP + 0.691) / 10)
+        self._decay = math.exp(-0.1 / forget_seconds) if forget_seconds else 1.0
+        self.momentary = -math.inf
+
+    def add(self, block):
+        """Feed (N, channels) samples; returns the number of completed 100 ms sub-blocks"""
+        completed = 0
+        offset = 0
+        while offset < len(block):
+            take = min(self.sub_block - self._filled, len(block) - offset)
+            self._buffer[self._filled:self._filled + take] = block[offset:offset + take]
+            self._filled += take
+            offset += take
+            if self._filled == self.sub_block:
+                self._sub_block_done()
+                self._filled = 0
+                completed += 1
+        return completed
+
+    def _sub_block_done(self):
+        spectrum = np.fft.rfft(self._buffer, axis=0)
+        power = float(np.sum((spectrum.real ** 2 + spectrum.imag ** 2) * self._weights[:, None]))
+        self._powers[self._count % 4] = power / self.sub_block ** 2
+        self._count += 1
+        if self._count < 4:
+            return
+        block_power = float(np.mean(self._powers))
+        self.momentary = -0.691 + 10 * math.log10(block_power) if block_power > 0 else -math.inf
+        self._histogram *= self._decay
+        if self.momentary > ABSOLUTE_GATE:
+            index = min(int((self.momentary - HISTOGRAM_FLOOR) / HISTOGRAM_STEP), len(self._histogram) - 1)
+            self._histogram[index] += 1
+
+    @property
+    def gated_seconds(self):
+        """Amount of material (above the absolute gate) behind the integrated value"""
+        return float(self._histogram.sum()) * 0.1
+
+    def integrated(self):
+        """Gated loudness in LUFS, or None before anything passed the absolute gate"""
+        total = self._histogram.sum()
+        if total <= 0:
+            return None
+        ungated = np.dot(self._histogram, self._bin_power) / total
+        threshold = -0.691 + 10 * math.log10(ungated) + RELATIVE_GATE
+        first = max(0, int(math.ceil((threshold - HISTOGRAM_FLOOR) / HISTOGRAM_STEP)))
+        counts = self._histogram[first:]
+        if counts.sum() <= 0:
+            return None
+        return -0.691 + 10 * math.log10(np.dot(counts, self._bin_power[first:]) / counts.sum())
+
+
+class LookaheadLimiter:
+    """Brick-wall peak limiter: gain reduction starts `lookahead_ms` before a peak and ramps in"""
+
+    def __init__(self, sample_rate=44100, channels=2, ceiling_db=-1.0, lookahead_ms=5.0, release_ms=100.0):
+        self.ceiling = 10 ** (ceiling_db / 20)
+        self.length = max(2, int(sample_rate * lookahead_ms / 1000))
+        self.release = 20.0 / (sample_rate * release_ms / 1000)  # dB per sample
+        self._delay = np.zeros((self.length - 1, channels), dtype=np.float32)
+        self._holds = np.zeros(self.length - 1)
+        self._attenuation = 0.0
+        self.reduction_db = 0.0
+
+    def process(self, block):
+        length = self.length
+        signal = np.concatenate([self._delay, block])
+        peaks = np.max(np.abs(signal), axis=1)
+        required = 20 * np.log10(np.maximum(peaks, self.ceiling) / self.ceiling)
+        # Hold the worst attenuation of the next `length` samples...
+        hold = np.lib.stride_tricks.sliding_window_view(required, length).max(axis=1)
+        # ...release linearly in dB, carrying the previous block's state
+        index = np.arange(1, len(hold) + 1)
+        released = np.maximum.accumulate(np.maximum(hold + self.release * index,
+                                                    self._attenuation)) - self.release * index
+        self._attenuation = float(released[-1])
+        # ...and average over `length` samples so the reduction ramps in instead of stepping
+        smoothed = np.concatenate([self._holds, released])
+        sums = np.cumsum(np.concatenate([[0.0], smoothed]))
+        attenuation = (sums[length:] - sums[:-length]) / length
+        self._holds = smoothed[-(length - 1):]
+        self._delay = signal[-(length - 1):]
+
+        gain = (10 ** (-attenuation / 20)).astype(np.float32)
+        self.reduction_db = float(attenuation.max()) if len(attenuation) else 0.0
+        out = signal[:len(gain)] * gain[:, None]
+        return np.clip(out, -self.ceiling, self.ceiling, out=out)
+
+
+class LoudnessNormalizer:
+    """Pipeline stage for one phone: measure, steer gain towards the target, then limit"""
+
+    def __init__(self, sample_rate=44100, channels=2, target_lufs=-16.0, max_gain_db=12.0,
+                 slew_db_per_second=1.0, initial_gain_db=0.0, ceiling_db=-1.0, min_seconds=3.0):
+        self.meter = LoudnessMeter(sample_rate, channels, forget_seconds=30.0)
+        self.limiter = LookaheadLimiter(sample_rate, channels, ceiling_db)
+        self.target_lufs = target_lufs
+        self.max_gain_db = max_gain_db
+        self.slew = slew_db_per_second
+        self.min_seconds = min_seconds
+        self.gain_db = max(-max_gain_db, min(max_gain_db, initial_gain_db))
+        self.sample_rate = sample_rate
+
+    def process(self, block):
+        completed = self.meter.add(block)
+        start = self.gain_db
+        loudness = self.meter.integrated()
+        if completed and loudness is not None and self.meter.gated_seconds >= self.min_seconds:
+            wanted = max(-self.max_gain_db, min(self.max_gain_db, self.target_lufs - loudness))
+            step = self.slew * completed * 0.1
+            self.gain_db += max(-step, min(step, wanted - self.gain_db))
+        ramp = np.linspace(start, self.gain_db, len(block), dtype=np.float32) if start != self.gain_db else start
+        gain = 10 ** (ramp / 20)
+        scaled = block * (gain[:, None] if isinstance(gain, np.ndarray) else np.float32(gain))
+        return self.limiter.process(scaled.astype(np.float32, copy=False))
+
+
+def benchmark(sample_rate=44100, seconds=120.0, block_ms=10.0):
+    rng = np.random.default_rng(8)
+    # Meter check: a -20 dBFS 997 Hz sine in both channels reads -20 LUFS
+    t = np.arange(sample_rate * 5) / sample_rate
+    sine = (0.1 * np.sin(2 * np.pi * 997 * t)).astype(np.float32)
+    meter = LoudnessMeter(sample_rate)
+    meter.add(np.stack([sine, sine], axis=1))
+    sine_lufs = meter.integrated()
+
+    # Quiet phone, then a loud one with hot peaks
+    frames = int(seconds * sample_rate)
+    noise = rng.normal(0, 1, (frames, 2)).astype(np.float32)
+    noise *= np.where(np.arange(frames) < frames // 2, 0.01, 0.3).astype(np.float32)[:, None]
+    noise[::sample_rate // 3] *= 6  # transients
+    stage = LoudnessNormalizer(sample_rate)
+    block = int(sample_rate * block_ms / 1000)
+    out = np.empty_like(noise)
+    written = 0
+    started = time.perf_counter()
+    for offset in range(0, frames, block):
+        processed = stage.process(noise[offset:offset + block])
+        out[written:written + len(processed)] = processed
+        written += len(processed)
+    elapsed = time.perf_counter() - started
+
+    def section_lufs(samples):
+        section = LoudnessMeter(sample_rate)
+        section.add(samples)
+        return section.integrated()
+
+    half = frames // 2
+    tail = 20 * sample_rate  # loudness over the last 20 s of each half, after adapting
+    return {
+        "sine_lufs": sine_lufs,
+        "quiet_in": section_lufs(noise[half - tail:half]), "quiet_out": section_lufs(out[half - tail:half]),
+        "loud_in": section_lufs(noise[-tail:]), "loud_out": section_lufs(out[-tail:written]),
+        "peak_dbfs": 20 * math.log10(float(np.max(np.abs(out[:written])))),
+        "gain_db": stage.gain_db,
+        "realtime_factor": seconds / elapsed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Loudness normalization and limiting for incoming streams")
+    parser.add_argument("--benchmark", action="store_true", help="meter accuracy, convergence and speed")
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    result = benchmark()
+    print(f"meter:   -20 dBFS 997 Hz stereo sine reads {result['sine_lufs']:.2f} LUFS")
+    print(f"quiet:   {result['quiet_in']:.1f} LUFS in -> {result['quiet_out']:.1f} LUFS out")
+    print(f"loud:    {result['loud_in']:.1f} LUFS in -> {result['loud_out']:.1f} LUFS out")
+    print(f"peak:    {result['peak_dbfs']:.2f} dBFS (ceiling -1.0)")
+    print(f"speed:   {result['realtime_factor']:.0f}x real time")
+    ok = abs(result["sine_lufs"] + 20) < 0.2 and result["peak_dbfs"] <= -1.0 + 1e-3
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Metrics
+Small in-process registry of counters and gauges, dumped to a JSON file
+"""
+
+import json
+import os
+import time
+
+
+class Metrics:
+    def __init__(self):
+        self.values = {}
+        self.started = time.time()
+
+    def set(self, name, value):
+        """Set a gauge to an absolute value"""
+        self.values[name] = value
+
+    def inc(self, name, amount=1):
+        """Increment a counter"""
+        self.values[name] = self.values.get(name, 0) + amount
+
+    def get(self, name, default=None):
+        """Read back a single value"""
+        return self.values.get(name, default)
+
+    def snapshot(self):
+        """Copy of all values plus uptime"""
+        data = dict(self.values)
+        data["uptime_seconds"] = round(time.time() - self.started, 3)
+        return data
+
+    def write(self, path):
+        """Atomically write the snapshot as JSON so readers never see a partial file"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - OFDM Modem
+Multi-carrier QPSK/16-QAM modulation for high-throughput data through the A2DP audio path
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from bluetooth_daemon import DEFAULT_CONFIG, load_config
+
+# Gray-coded constellations, normalised to unit average power
+QPSK = np.array([1 + 1j, -1 + 1j, 1 - 1j, -1 - 1j]) / np.sqrt(2)
+_LEVELS_16 = np.array([-3, -1, 3, 1])  # Gray order for 2 bits: 00 -3, 01 -1, 10 3, 11 1
+QAM16 = (_LEVELS_16[np.arange(16) >> 2] + 1j * _LEVELS_16[np.arange(16) & 3]) / np.sqrt(10)
+CONSTELLATIONS = {"qpsk": (QPSK, 2), "16qam": (QAM16, 4)}
+
+
+class OfdmModem:
+    """Batched rfft/irfft OFDM with cyclic prefix, a preamble symbol and comb pilots"""
+
+    def __init__(self, sample_rate=44100, fft_size=512, cyclic_prefix=64, low_hz=1000.0, high_hz=15000.0,
+                 subcarriers=None, pilot_spacing=8, modulation="qpsk", level=0.25, seed=0x5EED):
+        if modulation not in CONSTELLATIONS:
+            raise ValueError(f"Unknown modulation: {modulation}")
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.cyclic_prefix = cyclic_prefix
+        self.symbol_samples = fft_size + cyclic_prefix
+        self.modulation = modulation
+        self.constellation, self.bits_per_carrier = CONSTELLATIONS[modulation]
+        self.level = level
+
+        bin_hz = sample_rate / fft_size
+        first = max(1, int(np.ceil(low_hz / bin_hz)))
+        last = min(fft_size // 2 - 1, int(high_hz / bin_hz))
+        if last <= first:
+            raise ValueError("passband contains no subcarriers")
+        carriers = np.arange(first, last + 1)
+        if subcarriers is not None:
+            if subcarriers > len(carriers):
+                raise ValueError(f"only {len(carriers)} subcarriers fit between {low_hz} and {high_hz} Hz")
+            carriers = carriers[np.round(np.linspace(0, len(carriers) - 1, subcarriers)).astype(int)]
+        self.carriers = carriers
+
+        # Pilots on every pilot_spacing-th carrier, always including both band edges
+        pilot_mask = np.zeros(len(carriers), dtype=bool)
+        pilot_mask[::pilot_spacing] = True
+        pilot_mask[-1] = True
+        self.pilot_index = np.nonzero(pilot_mask)[0]
+        self.data_index = np.nonzero(~pilot_mask)[0]
+
+        rng = np.random.default_rng(seed)
+        self.pilot_values = QPSK[rng.integers(0, 4, len(self.pilot_index))]
+        self.preamble_values = QPSK[rng.integers(0, 4, len(carriers))]
+        self.preamble = self._symbols_to_samples(self.preamble_values[None, :])
+
+        # Linear interpolation weights from pilot carriers to every carrier, computed once
+        upper = np.clip(np.searchsorted(self.pilot_index, np.arange(len(carriers))), 1, len(self.pilot_index) - 1)
+        lower = upper - 1
+        span = self.pilot_index[upper] - self.pilot_index[lower]
+        self._interp_lower = lower
+        self._interp_upper = upper
+        self._interp_weight = (np.arange(len(carriers)) - self.pilot_index[lower]) / span
+
+    @classmethod
+    def from_config(cls, config_file=DEFAULT_CONFIG, modulation=None):
+        config = load_config(config_file)
+        subcarriers = config.get("modem", "subcarriers", fallback="auto")
+        return cls(
+            sample_rate=config.getint("audio", "sample_rate", fallback=44100),
+            fft_size=config.getint("modem", "fft_size", fallback=512),
+            cyclic_prefix=config.getint("modem", "cyclic_prefix", fallback=64),
+            low_hz=config.getfloat("modem", "low_hz", fallback=1000.0),
+            high_hz=config.getfloat("modem", "high_hz", fallback=15000.0),
+            subcarriers=None if subcarriers == "auto" else int(subcarriers),
+            pilot_spacing=config.getint("modem", "pilot_spacing", fallback=8),
+            modulation=modulation or config.get("modem", "modulation", fallback="qpsk"),
+        )
+
+    @property
+    def bits_per_symbol(self):
+        return len(self.data_index) * self.bits_per_carrier
+
+    @property
+    def bit_rate(self):
+        """Raw (pre-FEC) bit rate in bit/s"""
+        return self.bits_per_symbol * self.sample_rate / self.symbol_samples
+
+    def _symbols_to_samples(self, carrier_values):
+        """(S, carriers) complex -> flat time signal with cyclic prefixes, one batched irfft"""
+        spectrum = np.zeros((carrier_values.shape[0], self.fft_size // 2 + 1), dtype=np.complex128)
+        spectrum[:, self.carriers] = carrier_values
+        symbols = np.fft.irfft(spectrum, n=self.fft_size, axis=1)
+        with_prefix = np.concatenate([symbols[:, -self.cyclic_prefix:], symbols], axis=1)
+        return with_prefix.reshape(-1)
+
+    def modulate(self, bits):
+        """Bits -> float32 audio: preamble symbol followed by data symbols (bits zero-padded)"""
+        bits = np.asarray(bits, dtype=np.uint8)
+        if not len(bits):
+            raise ValueError("no bits to modulate")
+        count = -(-len(bits) // self.bits_per_symbol)
+        padded = np.zeros(count * self.bits_per_symbol, dtype=np.uint8)
+        padded[:len(bits)] = bits
+
+        groups = padded.reshape(-1, self.bits_per_carrier)
+        indices = groups.dot(1 << np.arange(self.bits_per_carrier - 1, -1, -1))
+        values = np.empty((count, len(self.carriers)), dtype=np.complex128)
+        values[:, self.data_index] = self.constellation[indices].reshape(count, -1)
+        values[:, self.pilot_index] = self.pilot_values
+
+        signal = np.concatenate([self.preamble, self._symbols_to_samples(values)])
+        scale = self.level / max(np.sqrt(np.mean(self.preamble ** 2)) * 4, 1e-12)
+        return np.clip(signal * scale, -1.0, 1.0).astype(np.float32)
+
+    def frame_samples(self, symbols):
+        """Length in samples of a frame with `symbols` data symbols"""
+        return (symbols + 1) * self.symbol_samples
+
+    def demodulate(self, samples, symbols, start=0, return_constellation=False):
+        """Recover `symbols` data symbols of a frame whose preamble starts at `start`"""
+        samples = np.asarray(samples, dtype=np.float64)
+        # Sample a little early inside the cyclic prefix to tolerate timing error; the resulting
+        # phase ramp is common to preamble and pilots, so channel estimation absorbs it
+        backoff = self.cyclic_prefix // 4
+        needed = (symbols + 1) * self.symbol_samples
+        block = samples[start:start + needed]
+        if start < 0 or len(block) < needed:
+            raise ValueError("not enough samples for the requested number of symbols")
+        window = self.cyclic_prefix - backoff
+        block = block.reshape(symbols + 1, self.symbol_samples)[:, window:window + self.fft_size]
+        spectrum = np.fft.rfft(block, axis=1)[:, self.carriers]
+
+        preamble_h = spectrum[0] / self.preamble_values
+        data = spectrum[1:]
+
+        # Per-symbol pilot estimate, interpolated across frequency, smoothed with the preamble estimate
+        pilot_h = data[:, self.pilot_index] / self.pilot_values[None, :]
+        lower = pilot_h[:, self._interp_lower]
+        upper = pilot_h[:, self._interp_upper]
+        pilot_interp = lower + (upper - lower) * self._interp_weight[None, :]
+        # Track slow drift with pilots but keep the finer frequency detail of the preamble
+        drift = np.angle(np.sum(pilot_h * np.conj(preamble_h[self.pilot_index])[None, :], axis=1))
+        preamble_track = preamble_h[None, :] * np.exp(1j * drift)[:, None]
+        h = 0.5 * (pilot_interp + preamble_track)
+
+        equalized = data[:, self.data_index] / h[:, self.data_index]
+        distances = np.abs(equalized[..., None] - self.constellation[None, None, :])
+        indices = distances.argmin(axis=2)
+        shifts = np.arange(self.bits_per_carrier - 1, -1, -1)
+        bits = ((indices[..., None] >> shifts) & 1).astype(np.uint8).reshape(-1)
+        if return_constellation:
+            return bits, equalized
+        return bits
+
+
+def multipath_channel(signal, snr_db, rng, taps=((0, 1.0), (7, 0.35), (19, -0.15), (40, 0.05))):
+    """Short echo (within the cyclic prefix) plus AWGN, for modem self-tests"""
+    impulse = np.zeros(max(delay for delay, _ in taps) + 1)
+    for delay, gain in taps:
+        impulse[delay] = gain
+    out = np.convolve(signal, impulse)[:len(signal)]
+    noise_power = np.mean(out ** 2) / (10 ** (snr_db / 10))
+    return out + rng.normal(0, np.sqrt(noise_power), len(out))
+
+
+def benchmark(modem, symbols=200, snrs=(10, 15, 20, 25, 30, 40), channel=None, seed=2):
+    """Bit error rate vs SNR through a simulated channel plus modulate/demodulate speed"""
+    rng = np.random.default_rng(seed)
+    channel = channel or (lambda signal, snr: multipath_channel(signal, snr, rng))
+    bits = rng.integers(0, 2, symbols * modem.bits_per_symbol, dtype=np.uint8)
+
+    started = time.perf_counter()
+    signal = modem.modulate(bits)
+    modulate_seconds = time.perf_counter() - started
+    audio_seconds = len(signal) / modem.sample_rate
+
+    rows = []
+    for snr in snrs:
+        received = channel(signal, snr)
+        started = time.perf_counter()
+        out = modem.demodulate(received, symbols)
+        demodulate_seconds = time.perf_counter() - started
+        rows.append((snr, float(np.mean(out[:len(bits)] != bits)), audio_seconds / demodulate_seconds))
+    return audio_seconds / modulate_seconds, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OFDM modem for the audio data channel")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--modulation", choices=sorted(CONSTELLATIONS), help="override config.ini")
+    parser.add_argument("--benchmark", action="store_true", help="BER vs SNR over a simulated channel")
+    args = parser.parse_args(argv)
+
+    modem = OfdmModem.from_config(args.config, args.modulation)
+    print(f"{modem.modulation}: {len(modem.carriers)} carriers ({len(modem.data_index)} data), "
+          f"{modem.bits_per_symbol} bits/symbol, {modem.bit_rate / 1000:.1f} kbit/s raw")
+    if not args.benchmark:
+        return 0
+
+    modulate_speed, rows = benchmark(modem)
+    print(f"modulate: {modulate_speed:.0f}x real time")
+    print(f"{'SNR dB':>7} {'BER':>10} {'demod x RT':>11}")
+    for snr, ber, speed in rows:
+        print(f"{snr:>7} {ber:>10.2e} {speed:>11.0f}")
+    return 0 if rows[-1][1] < 1e-3 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
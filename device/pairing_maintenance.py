@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Pairing Maintenance
+Bulk remove/trust/prune of paired devices, batched into a few bluetoothctl sessions
+"""
+
+import argparse
+import asyncio
+import re
+import sys
+import time
+
+from bluetooth_daemon import BluetoothDaemon, CommandRunner, DEFAULT_CONFIG, log
+from device_registry import DEFAULT_REGISTRY, DeviceRegistry
+
+DEFAULT_BATCH_SIZE = 50
+
+
+class PairingMaintenance:
+    def __init__(self, runner=None, registry=None, controller=None, batch_size=DEFAULT_BATCH_SIZE,
+                 config_file=DEFAULT_CONFIG, progress=None):
+        self.daemon = BluetoothDaemon(config_file=config_file, runner=runner or CommandRunner(),
+                                      controller=controller)
+        self.registry = registry
+        self.batch_size = batch_size
+        self.progress = progress or self.print_progress
+
+    def print_progress(self, action, done, total):
+        """Default progress reporter"""
+        log(f"{action}: {done}/{total}")
+
+    async def paired_devices(self):
+        return await self.daemon.list_devices("Paired")
+
+    async def select(self, pattern=None, macs=None):
+        """Paired devices whose MAC or name matches `pattern`, optionally restricted to `macs`"""
+        devices = await self.paired_devices()
+        if pattern is not None:
+            regex = re.compile(pattern, re.IGNORECASE)
+            devices = {mac: name for mac, name in devices.items()
+                       if regex.search(mac) or regex.search(name)}
+        if macs is not None:
+            wanted = set(macs)
+            devices = {mac: name for mac, name in devices.items() if mac in wanted}
+        return devices
+
+    async def apply(self, action, command, macs, done=None):
+        """Run `command <mac>` for every MAC, one bluetoothctl session per batch.
+
+        Returns the MACs handled; when cancelled it logs how far it got and re-raises. Each batch
+        is added to `done` as soon as it succeeds, so a caller still has it after a cancel.
+        """
+        macs = list(macs)
+        done = [] if done is None else done
+        self.progress(action, 0, len(macs))
+        try:
+            for start in range(0, len(macs), self.batch_size):
+                batch = macs[start:start + self.batch_size]
+                success, _, error = await self.daemon.bluetoothctl(
+                    [f"{command} {mac}" for mac in batch], timeout=10 + len(batch))
+                if not success:
+                    log(f"⚠️  {action} batch failed: {error.strip()}")
+                    break
+                done.extend(batch)
+                self.progress(action, len(done), len(macs))
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            log(f"🛑 {action} interrupted after {len(done)}/{len(macs)} devices")
+            raise
+        return done
+
+    async def remove(self, macs):
+        """Remove pairings and forget them in the registry; returns MACs actually gone"""
+        attempted = []
+        try:
+            await self.apply("Removing", "remove", macs, done=attempted)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            # bluetoothctl finished these batches: don't keep registry entries for devices that are gone
+            self.forget(attempted)
+            raise
+        remaining = await self.paired_devices()
+        removed = [mac for mac in attempted if mac not in remaining]
+        self.forget(removed)
+        return removed
+
+    def forget(self, macs):
+        if self.registry is not None and macs:
+            self.registry.forget(macs)
+            self.registry.save()
+
+    async def remove_all(self):
+        return await self.remove(await self.paired_devices())
+
+    async def remove_matching(self, pattern):
+        return await self.remove(await self.select(pattern))
+
+    async def trust_many(self, pattern=None, macs=None):
+        return await self.apply("Trusting", "trust", await self.select(pattern, macs))
+
+    async def select_stale(self, max_age_days, include_unknown=False, now=None):
+        """Paired devices not seen for `max_age_days` according to the device registry"""
+        now = now if now is not None else time.time()
+        cutoff = now - max_age_days * 86400
+        stale = set(self.registry.last_seen_before(cutoff)) if self.registry is not None else set()
+        paired = await self.paired_devices()
+        return {mac: name for mac, name in paired.items()
+                if mac in stale or (include_unknown and (self.registry is None or
+                                                         self.registry.get(mac) is None))}
+
+    async def prune(self, max_age_days, include_unknown=False, now=None):
+        """Remove pairings not seen for `max_age_days` according to the device registry"""
+        return await self.remove(await self.select_stale(max_age_days, include_unknown, now))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk maintenance of the Bluetooth pairing table")
+    parser.add_argument("--controller", help="adapter address (default controller if omitted)")
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY, help="device registry JSON file")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only list the devices that would be touched")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("remove-all", help="remove every pairing")
+    remove = commands.add_parser("remove", help="remove pairings whose MAC or name matches")
+    remove.add_argument("pattern")
+    trust = commands.add_parser("trust", help="trust paired devices whose MAC or name matches")
+    trust.add_argument("pattern", nargs="?")
+    prune = commands.add_parser("prune", help="remove pairings not seen for DAYS days")
+    prune.add_argument("days", type=float)
+    prune.add_argument("--include-unknown", action="store_true",
+                       help="also remove pairings that never appear in the registry")
+    args = parser.parse_args(argv)
+
+    maintenance = PairingMaintenance(registry=DeviceRegistry(args.registry), controller=args.controller,
+                                     batch_size=args.batch_size)
+
+    async def run():
+        if args.dry_run:
+            if args.command == "prune":
+                devices = await maintenance.select_stale(args.days, include_unknown=args.include_unknown)
+            else:
+                devices = await maintenance.select(getattr(args, "pattern", None))
+            for mac, name in devices.items():
+                print(f"   • {name} ({mac})")
+            return devices
+        if args.command == "remove-all":
+            return await maintenance.remove_all()
+        if args.command == "remove":
+            return await maintenance.remove_matching(args.pattern)
+        if args.command == "trust":
+            return await maintenance.trust_many(args.pattern)
+        return await maintenance.prune(args.days, include_unknown=args.include_unknown)
+
+    try:
+        handled = asyncio.run(run())
+    except KeyboardInterrupt:
+        log("🛑 Interrupted")
+        return 130
+    log(f"✅ {len(handled)} device(s) {'matched' if args.dry_run else 'done'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - PipeWire Graph
+One `pw-dump` snapshot kept current from `pw-dump --monitor`, queried and routed in memory
+
+`pw-dump --monitor` prints the whole graph as a JSON array and then one array per change
+(the same objects pw-mon reports, as JSON): changed objects carry their new info, removed
+ones `"info": null`, metadata changes only the keys that changed. The graph keeps typed
+records and indexes (by name, media class, Bluetooth address, node -> ports, node pair ->
+links), so finding the phone's source or the links between two nodes never spawns a tool.
+Routes are pw-link calls for the port pairs the model says are missing.
+"""
+
+import argparse
+import asyncio
+import codecs
+import json
+import sys
+import time
+from collections import defaultdict
+
+from bluetooth_daemon import CommandRunner, log
+from tool_parsers import Record
+
+NODE = "PipeWire:Interface:Node"
+PORT = "PipeWire:Interface:Port"
+LINK = "PipeWire:Interface:Link"
+DEVICE = "PipeWire:Interface:Device"
+METADATA = "PipeWire:Interface:Metadata"
+ROUTABLE = ("Audio/Sink", "Audio/Source")
+
+
+class PwNode(Record):
+    __slots__ = ("id", "name", "description", "media_class", "state", "device_id", "address", "channels")
+
+
+class PwPort(Record):
+    __slots__ = ("id", "node_id", "name", "direction", "channel", "monitor")
+
+
+class PwLink(Record):
+    __slots__ = ("id", "output_node", "output_port", "input_node", "input_port", "state")
+
+
+class PwDevice(Record):
+    __slots__ = ("id", "name", "description", "api", "address")
+
+
+def _merge(old, new):
+    """pw-dump updates may carry only what changed; nested dicts (info, props) are merged"""
+    merged = dict(old)
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class JsonStream:
+    """Splits a text stream into complete top-level JSON values as they arrive"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        self._buffer += text
+        values = []
+        position = 0
+        while True:
+            while position < len(self._buffer) and self._buffer[position].isspace():
+                position += 1
+            if position >= len(self._buffer):
+                break
+            try:
+                value, position = self._decoder.raw_decode(self._buffer, position)
+            except ValueError:
+                break  # incomplete; wait for more
+            values.append(value)
+        self._buffer = self._buffer[position:]
+        return values
+
+
+class PipeWireGraph:
+    """Nodes, ports, links, devices and default metadata, with the indexes routing needs"""
+
+    def __init__(self):
+        self._raw = {}                      # id -> merged pw-dump object
+        self.nodes = {}
+        self.ports = {}
+        self.links = {}
+        self.devices = {}
+        self.defaults = {}                  # "default" metadata: key -> value
+        self.nodes_by_name = {}
+        self.nodes_by_class = defaultdict(set)
+        self.nodes_by_address = defaultdict(set)
+        self.ports_by_node = defaultdict(set)
+        self.links_by_nodes = defaultdict(set)
+        self.version = 0                    # bumped when sinks or sources come or go (what routing depends on)
+        self.updates = 0
+
+    @classmethod
+    def from_dump(cls, text):
+        graph = cls()
+        for value in JsonStream().feed(text):
+            graph.apply(value)
+        return graph
+
+    def apply(self, objects):
+        """Fold one pw-dump array (snapshot or monitor update) into the model"""
+        for obj in objects:
+            self.updates += 1
+            object_id = obj.get("id")
+            if object_id is None:
+                continue
+            kind = obj.get("type") or self._raw.get(object_id, {}).get("type")
+            if kind == METADATA:
+                self._metadata(obj)
+                continue
+            if "info" in obj and obj["info"] is None:
+                self._remove(object_id)
+                continue
+            before = self._identity(object_id)
+            merged = _merge(self._raw.get(object_id, {}), obj)
+            self._unindex(object_id)
+            self._raw[object_id] = merged
+            self._index(object_id, merged)
+            if self._identity(object_id) != before:
+                self.version += 1
+
+    def _identity(self, object_id):
+        """What routing decisions depend on: devices' sinks and sources, not state or app streams"""
+        node = self.nodes.get(object_id)
+        if node is None or (node.media_class not in ROUTABLE and not node.address):
+            return None
+        return (node.name, node.media_class, node.address)
+
+    def _metadata(self, obj):
+        raw = self._raw.setdefault(obj["id"], {"id": obj["id"], "type": METADATA, "props": {}})
+        raw["props"].update(obj.get("props") or {})
+        if raw["props"].get("metadata.name") != "default":
+            return
+        for entry in obj.get("metadata") or []:
+            if entry.get("subject", 0) != 0:
+                continue
+            if entry.get("value") is None:
+                self.defaults.pop(entry["key"], None)
+            else:
+                self.defaults[entry["key"]] = entry["value"]
+
+    def _index(self, object_id, obj):
+        info = obj.get("info") or {}
+        props = info.get("props") or {}
+        kind = obj.get("type")
+        if kind == NODE:
+            node = PwNode(id=object_id, name=props.get("node.name"), description=props.get("node.description"),
+                          media_class=props.get("media.class"), state=info.get("state"),
+                          device_id=props.get("device.id"), address=props.get("api.bluez5.address"),
+                          channels=props.get("audio.channels"))
+            if node.address is None and node.device_id in self.devices:
+                node.address = self.devices[node.device_id].address
+            self.nodes[object_id] = node
+            if node.name:
+                self.nodes_by_name[node.name] = object_id
+            self.nodes_by_class[node.media_class].add(object_id)
+            if node.address:
+                self.nodes_by_address[node.address.upper()].add(object_id)
+        elif kind == PORT:
+            port = PwPort(id=object_id, node_id=props.get("node.id"), name=props.get("port.name"),
+                          direction=info.get("direction"), channel=props.get("audio.channel"),
+                          monitor=bool(props.get("port.monitor", False)))
+            self.ports[object_id] = port
+            self.ports_by_node[port.node_id].add(object_id)
+        elif kind == LINK:
+            link = PwLink(id=object_id, output_node=info.get("output-node-id"),
+                          output_port=info.get("output-port-id"), input_node=info.get("input-node-id"),
+                          input_port=info.get("input-port-id"), state=info.get("state"))
+            self.links[object_id] = link
+            self.links_by_nodes[(link.output_node, link.input_node)].add(object_id)
+        elif kind == DEVICE:
+            self.devices[object_id] = PwDevice(id=object_id, name=props.get("device.name"),
+                                               description=props.get("device.description"),
+                                               api=props.get("device.api"), address=props.get("api.bluez5.address"))
+
+    def _unindex(self, object_id):
+        if object_id in self.nodes:
+            node = self.nodes.pop(object_id)
+            if self.nodes_by_name.get(node.name) == object_id:
+                del self.nodes_by_name[node.name]
+            self.nodes_by_class[node.media_class].discard(object_id)
+            if node.address:
+                self.nodes_by_address[node.address.upper()].discard(object_id)
+        elif object_id in self.ports:
+            port = self.ports.pop(object_id)
+            self.ports_by_node[port.node_id].discard(object_id)
+        elif object_id in self.links:
+            link = self.links.pop(object_id)
+            self.links_by_nodes[(link.output_node, link.input_node)].discard(object_id)
+        else:
+            self.devices.pop(object_id, None)
+
+    def _remove(self, object_id):
+        if self._identity(object_id) is not None:
+            self.version += 1
+        self._unindex(object_id)
+        self._raw.pop(object_id, None)
+
+    # Queries
+
+    def node(self, name):
+        object_id = self.nodes_by_name.get(name)
+        return self.nodes.get(object_id) if object_id is not None else None
+
+    def by_class(self, media_class):
+        return sorted((self.nodes[i] for i in self.nodes_by_class.get(media_class, ())), key=lambda n: n.id)
+
+    def sinks(self):
+        return self.by_class("Audio/Sink")
+
+    def sources(self):
+        return self.by_class("Audio/Source")
+
+    def bluetooth_sources(self, address=None):
+        """Nodes carrying audio from phones: bluez sources (or streams, depending on the session manager)"""
+        ids = (self.nodes_by_address.get(address.upper(), ()) if address
+               else set().union(*self.nodes_by_address.values()) if self.nodes_by_address else ())
+        return sorted((self.nodes[i] for i in ids if self.nodes[i].media_class in ("Audio/Source", "Stream/Output/Audio")),
+                      key=lambda n: n.id)
+
+    def default_sink(self):
+        for key in ("default.configured.audio.sink", "default.audio.sink"):
+            value = self.defaults.get(key)
+            if isinstance(value, dict) and value.get("name") in self.nodes_by_name:
+                return self.node(value["name"])
+        return None
+
+    def node_ports(self, node_id, direction):
+        """{channel: port} of a node, without monitor ports"""
+        ports = (self.ports[i] for i in self.ports_by_node.get(node_id, ()))
+        return {port.channel or port.name: port for port in sorted(ports, key=lambda p: p.id)
+                if port.direction == direction and not port.monitor}
+
+    def port_pairs(self, source, sink):
+        """(output port, input port) pairs that connect `source` to `sink` channel by channel"""
+        outputs = self.node_ports(source.id, "output")
+        inputs = self.node_ports(sink.id, "input")
+        if len(outputs) == 1:  # mono into everything
+            (output,) = outputs.values()
+            return [(output, port) for port in inputs.values()]
+        if len(inputs) == 1:
+            (port,) = inputs.values()
+            return [(output, port) for output in outputs.values()]
+        return [(outputs[channel], inputs[channel]) for channel in outputs if channel in inputs]
+
+    def links_between(self, source, sink):
+        return [self.links[i] for i in sorted(self.links_by_nodes.get((source.id, sink.id), ()))]
+
+    def records(self):
+        """Every typed record, for status output and the golden corpus"""
+        for collection in (self.devices, self.nodes, self.ports, self.links):
+            for object_id in sorted(collection):
+                yield collection[object_id]
+
+
+def parse_pw_dump(source):
+    """Yield PwDevice, PwNode, PwPort and PwLink records from `pw-dump` output"""
+    yield from PipeWireGraph.from_dump(source).records()
+
+
+async def is_pipewire(runner):
+    """True when the audio server behind pactl is pipewire-pulse"""
+    success, output, _ = await runner.run(["pactl", "info"], timeout=5)
+    return success and "PipeWire" in output
+
+
+class PipeWireBackend:
+    """Keeps a PipeWireGraph current from a pw-dump monitor and routes against it"""
+
+    name = "pipewire"
+
+    def __init__(self, runner=None):
+        self.runner = runner or CommandRunner()
+        self.loopback_latency_ms = 0  # unused: links add no buffering, the quantum sets latency
+        self.graph = PipeWireGraph()
+        self.ready = asyncio.Event()
+        self.changed = asyncio.Event()   # set on every update; waiters clear it
+        self._watchers = []
+        self._process = None
+        self._task = None
+
+    async def start(self, timeout=5.0):
+        """Start the monitor and wait for its first (full) snapshot"""
+        self._process = await self.runner.open_pipe(["pw-dump", "--monitor", "--no-colors"], write=False)
+        self._task = asyncio.ensure_future(self._read())
+        await asyncio.wait_for(self.ready.wait(), timeout)
+        return self
+
+    async def _read(self):
+        stream = JsonStream()
+        # A multi-byte character (e.g. in a node description) may straddle two reads
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            while True:
+                chunk = await self._process.stdout.read(65536)
+                if not chunk:
+                    break
+                for value in stream.feed(decoder.decode(chunk)):
+                    if isinstance(value, list):
+                        self.graph.apply(value)
+                        self.ready.set()
+                        self._notify()
+        finally:
+            if not self.ready.is_set():
+                self.ready.set()  # do not leave start() waiting on a monitor that died
+        log("⚠️  pw-dump monitor ended; the PipeWire model is no longer updated")
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+
+    def _notify(self):
+        self.changed.set()
+        for event in self._watchers:
+            event.set()
+
+    def watch(self):
+        """An event of the caller's own, set on every update (nobody else clears it)"""
+        event = asyncio.Event()
+        self._watchers.append(event)
+        return event
+
+    @property
+    def version(self):
+        return self.graph.version
+
+    # The same queries the pactl-based code answered by spawning tools
+
+    def sinks(self):
+        return self.graph.sinks()
+
+    def sources(self):
+        return self.graph.sources()
+
+    def bluetooth_sources(self, address=None):
+        return self.graph.bluetooth_sources(address)
+
+    def default_sink(self):
+        return self.graph.default_sink()
+
+    async def wait_for(self, lookup, timeout=5.0):
+        """lookup()'s first truthy result, re-checked as monitor updates arrive (e.g. a phone's node)"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            self.changed.clear()
+            result = lookup()
+            remaining = deadline - asyncio.get_running_loop().time()
+            if result or remaining <= 0:
+                return result
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def route(self, source_name, sink_name):
+        """Link source -> sink port by port; only missing links are created. Returns the route handle"""
+        graph = self.graph
+        source, sink = graph.node(source_name), graph.node(sink_name)
+        if source is None or sink is None:
+            raise LookupError(f"no such node: {source_name if source is None else sink_name}")
+        existing = {(link.output_port, link.input_port) for link in graph.links_between(source, sink)}
+        missing = [(output, port) for output, port in graph.port_pairs(source, sink)
+                   if (output.id, port.id) not in existing]
+        results = await asyncio.gather(*[
+            self.runner.run(["pw-link", str(output.id), str(port.id)], timeout=5) for output, port in missing])
+        failed = [error.strip() for success, _, error in results if not success]
+        if failed:
+            raise RuntimeError(f"pw-link failed: {failed[0]}")
+        return (source_name, sink_name)
+
+    async def unroute(self, route):
+        source_name, sink_name = route
+        source, sink = self.graph.node(source_name), self.graph.node(sink_name)
+        if source is None or sink is None:
+            return  # a node that is gone took its links with it
+        await asyncio.gather(*[self.runner.run(["pw-link", "-d", str(link.id)], timeout=5)
+                               for link in self.graph.links_between(source, sink)])
+
+    async def set_default_sink(self, sink_name):
+        value = json.dumps({"name": sink_name})
+        success, _, error = await self.runner.run(
+            ["pw-metadata", "0", "default.configured.audio.sink", value, "Spa:String:JSON"], timeout=5)
+        if not success:
+            raise RuntimeError(f"pw-metadata failed: {error.strip()}")
+
+    async def set_quantum(self, frames):
+        """Force the graph's quantum (0 hands it back to the session manager); True if applied"""
+        success, _, error = await self.runner.run(
+            ["pw-metadata", "-n", "settings", "0", "clock.force-quantum", str(frames)], timeout=5)
+        if not success:
+            log(f"⚠️  Cannot set quantum: {error.strip()}")
+        return success
+
+
+def synthetic_dump(sinks=6, sources=4, phones=2, streams=20):
+    """A pw-dump snapshot of a busy desktop: ALSA/HDMI sinks, mics, phones, app streams, links"""
+    objects = []
+    next_id = [100]
+
+    def new_id():
+        next_id[0] += 1
+        return next_id[0]
+
+    def node(name, media_class, channels=("FL", "FR"), address=None, device_id=None, monitor=False):
+        node_id = new_id()
+        props = {"node.name": name, "node.description": name.replace("_", " "), "media.class": media_class,
+                 "audio.channels": len(channels)}
+        if address:
+            props["api.bluez5.address"] = address
+        if device_id:
+            props["device.id"] = device_id
+        objects.append({"id": node_id, "type": NODE, "version": 3,
+                        "info": {"state": "suspended", "props": props}})
+        ports = {}
+        directions = {"Audio/Sink": ["input"], "Audio/Source": ["output"], "Stream/Output/Audio": ["output"],
+                      "Stream/Input/Audio": ["input"]}[media_class]
+        if monitor:
+            directions = directions + ["output"]
+        for direction in directions:
+            for channel in channels:
+                port_id = new_id()
+                is_monitor = monitor and direction == "output"
+                objects.append({"id": port_id, "type": PORT, "version": 3, "info": {
+                    "direction": direction, "props": {
+                        "node.id": node_id, "audio.channel": channel, "port.monitor": is_monitor,
+                        "port.name": f"{'monitor' if is_monitor else direction}_{channel}"}}})
+                ports[(direction, channel, is_monitor)] = port_id
+        return node_id, ports
+
+    sink_nodes = [node(f"alsa_output.card{n}.{'hdmi-stereo' if n else 'analog-stereo'}", "Audio/Sink", monitor=True)
+                  for n in range(sinks)]
+    for n in range(sources):
+        node(f"alsa_input.card{n}.analog-stereo", "Audio/Source")
+    for n in range(phones):
+        address = f"AC:37:43:00:00:{n:02X}"
+        device_id = new_id()
+        objects.append({"id": device_id, "type": DEVICE, "version": 3, "info": {"props": {
+            "device.name": f"bluez_card.{address.replace(':', '_')}", "device.api": "bluez5",
+            "api.bluez5.address": address, "device.description": f"Phone {n}"}}})
+        node(f"bluez_input.{address.replace(':', '_')}.2", "Audio/Source", address=address, device_id=device_id)
+    for n in range(streams):
+        stream_id, ports = node(f"app{n}", "Stream/Output/Audio")
+        sink_id, sink_ports = sink_nodes[n % len(sink_nodes)]
+        for channel in ("FL", "FR"):
+            objects.append({"id": new_id(), "type": LINK, "version": 3, "info": {
+                "output-node-id": stream_id, "output-port-id": ports[("output", channel, False)],
+                "input-node-id": sink_id, "input-port-id": sink_ports[("input", channel, False)],
+                "state": "active", "props": {}}})
+    objects.append({"id": 40, "type": METADATA, "version": 3, "props": {"metadata.name": "default"},
+                    "metadata": [{"subject": 0, "key": "default.audio.sink", "type": "Spa:String:JSON",
+                                  "value": {"name": "alsa_output.card0.analog-stereo"}}]})
+    return objects
+
+
+def benchmark(rounds=2000):
+    """Snapshot load, per-event update and query cost, against spawning one process per lookup"""
+    import subprocess
+
+    dump = json.dumps(synthetic_dump())
+    started = time.perf_counter()
+    graph = PipeWireGraph.from_dump(dump)
+    load = time.perf_counter() - started
+
+    # A phone's node changes state and a link comes and goes, as the monitor would report them
+    phone = graph.bluetooth_sources()[0]
+    events = [
+        json.dumps([{"id": phone.id, "info": {"state": "running"}}]),
+        json.dumps([{"id": 9000, "type": LINK, "info": {"output-node-id": phone.id, "output-port-id": 1,
+                                                         "input-node-id": graph.sinks()[0].id,
+                                                         "input-port-id": 2, "state": "active"}}]),
+        json.dumps([{"id": 9000, "info": None}]),
+    ]
+    stream = JsonStream()
+    started = time.perf_counter()
+    for index in range(rounds):
+        for value in stream.feed(events[index % len(events)]):
+            graph.apply(value)
+    update = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        source = graph.bluetooth_sources(phone.address)[0]
+        sink = graph.default_sink()
+        graph.port_pairs(source, sink)
+        graph.links_between(source, sink)
+    query = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for _ in range(20):
+        subprocess.run(["true"], check=False)
+    spawn = (time.perf_counter() - started) / 20
+    return {"objects": len(graph._raw), "nodes": len(graph.nodes), "load": load, "update": update,
+            "query": query, "spawn": spawn, "dump_bytes": len(dump)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="In-memory PipeWire graph from pw-dump")
+    parser.add_argument("--dump", help="read a saved pw-dump file instead of the live graph")
+    parser.add_argument("--benchmark", action="store_true", help="load/update/query cost against a process spawn")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        result = benchmark()
+        print(f"snapshot: {result['objects']} objects ({result['dump_bytes'] / 1024:.0f} KB JSON) "
+              f"loaded in {result['load'] * 1000:.1f} ms")
+        print(f"update:   {result['update'] * 1e6:.1f} us per monitor event")
+        print(f"query:    {result['query'] * 1e6:.1f} us for phone source + default sink + port pairs + links")
+        print(f"spawn:    {result['spawn'] * 1000:.2f} ms for one `true` process "
+              f"(a lower bound for each pactl lookup it replaces)")
+        return 0
+
+    if args.dump:
+        with open(args.dump) as f:
+            graph = PipeWireGraph.from_dump(f.read())
+    else:
+        success, output, error = asyncio.run(CommandRunner().run(["pw-dump", "--no-colors"], timeout=10))
+        if not success:
+            print(f"pw-dump failed: {error.strip()}")
+            return 1
+        graph = PipeWireGraph.from_dump(output)
+    default = graph.default_sink()
+    print(f"default sink: {default.name if default else '-'}")
+    for title, nodes in (("sinks", graph.sinks()), ("sources", graph.sources()),
+                         ("bluetooth", graph.bluetooth_sources())):
+        print(f"{title}:")
+        for node in nodes:
+            print(f"  {node.id:>5} {node.name} [{node.state}]" + (f" {node.address}" if node.address else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
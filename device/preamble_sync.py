@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Preamble Synchronizer
+Streaming overlap-save FFT correlation that finds frame starts in continuous captured audio
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from bluetooth_daemon import DEFAULT_CONFIG
+from ofdm_modem import OfdmModem, multipath_channel
+
+
+class Detection:
+    __slots__ = ("position", "score", "cfo_hz")
+
+    def __init__(self, position, score, cfo_hz):
+        self.position = position  # absolute stream index of the preamble start, sub-sample
+        self.score = score        # normalized correlation envelope, 0..1
+        self.cfo_hz = cfo_hz      # frequency offset of the received spectrum
+
+    @property
+    def sample(self):
+        return int(round(self.position))
+
+    def __repr__(self):
+        return f"Detection(position={self.position:.2f}, score={self.score:.3f}, cfo_hz={self.cfo_hz:.2f})"
+
+
+def analytic(signal):
+    """Analytic signal (positive frequencies only) via one rfft/ifft"""
+    n = len(signal)
+    spectrum = np.zeros(n, dtype=np.complex128)
+    half = np.fft.rfft(signal)
+    spectrum[:len(half)] = half
+    spectrum[1:(n + 1) // 2] *= 2
+    return np.fft.ifft(spectrum)
+
+
+def shift_frequency(signal, hz, sample_rate):
+    """Shift every component of a real signal by `hz`; use -cfo_hz to correct a detection"""
+    t = np.arange(len(signal)) / sample_rate
+    return np.real(analytic(signal) * np.exp(2j * np.pi * hz * t))
+
+
+def fractional_delay(signal, delay):
+    """Delay a signal by a (possibly fractional) number of samples"""
+    n = len(signal)
+    spectrum = np.fft.rfft(signal)
+    spectrum *= np.exp(-2j * np.pi * np.fft.rfftfreq(n) * delay)
+    return np.fft.irfft(spectrum, n)
+
+
+class PreambleSync:
+    """Feed arbitrary chunks of audio, get back detections as soon as they are final"""
+
+    def __init__(self, preamble, sample_rate=44100, cyclic_prefix=0, threshold=0.4, fft_size=None, holdoff=None):
+        self.preamble = np.asarray(preamble, dtype=np.float64)
+        self.sample_rate = sample_rate
+        self.cyclic_prefix = cyclic_prefix
+        self.threshold = threshold
+        length = len(self.preamble)
+        self.fft_size = fft_size or 1 << int(np.ceil(np.log2(4 * length)))
+        if self.fft_size < 2 * length:
+            raise ValueError("fft_size must be at least twice the preamble length")
+        # Each FFT block yields `hop` valid correlation lags; the last length-1 samples overlap
+        self.hop = self.fft_size - length + 1
+        self.holdoff = holdoff or length
+        self._energy = float(np.dot(self.preamble, self.preamble))
+        self._reference = analytic(self.preamble)
+        self._kernel = np.conj(np.fft.fft(self._reference, self.fft_size))
+        self._silence = length * 1e-8  # windows quieter than -80 dBFS never score
+
+        self._history = np.zeros(0)
+        self._history_start = 0  # absolute index of _history[0]
+        self._next = 0           # absolute index of the next correlation lag to compute
+        self._carry = np.zeros(0)
+        self._pending = None     # (position, left, peak, right) of the best peak in the holdoff window
+
+    @classmethod
+    def for_modem(cls, modem, **kwargs):
+        return cls(modem.preamble, modem.sample_rate, modem.cyclic_prefix, **kwargs)
+
+    def reset(self):
+        self.__init__(self.preamble, self.sample_rate, self.cyclic_prefix, self.threshold, self.fft_size,
+                      self.holdoff)
+
+    def feed(self, samples):
+        self._history = np.concatenate([self._history, np.asarray(samples, dtype=np.float64)])
+        detections = []
+        while self._next - self._history_start + self.fft_size <= len(self._history):
+            self._process_block(detections)
+        return detections
+
+    def flush(self):
+        """Pad the tail with silence so the last lags are searched, then emit the pending peak"""
+        tail = self._history_start + len(self._history) - self._next
+        self._history = np.concatenate([self._history, np.zeros(self.fft_size)])
+        detections = []
+        while tail > 0:
+            self._process_block(detections)
+            tail -= self.hop
+        if self._pending is not None:
+            detections.append(self._finish(*self._pending))
+            self._pending = None
+        return detections
+
+    def _process_block(self, detections):
+        offset = self._next - self._history_start
+        block = self._history[offset:offset + self.fft_size]
+        length = len(self.preamble)
+
+        # Correlation against the analytic preamble; its magnitude ignores carrier phase
+        correlation = np.abs(np.fft.ifft(np.fft.fft(block) * self._kernel)[:self.hop])
+        squares = np.concatenate([[0.0], np.cumsum(block * block)])
+        window_energy = squares[length:length + self.hop] - squares[:self.hop]
+        scores = correlation / np.sqrt(np.maximum(window_energy, self._silence) * self._energy)
+
+        # Two lags carried over so peaks at block edges still see both neighbours
+        values = np.concatenate([self._carry, scores])
+        first = self._next - len(self._carry)
+        inner = values[1:-1]
+        peaks = np.nonzero((inner >= self.threshold) & (inner >= values[:-2]) & (inner > values[2:]))[0] + 1
+        for index in peaks:
+            self._offer(first + index, values[index - 1], values[index], values[index + 1], detections)
+
+        self._carry = values[-2:]
+        self._next += self.hop
+        last_searched = first + len(values) - 2
+        if self._pending is not None and last_searched - self._pending[0] > self.holdoff:
+            detections.append(self._finish(*self._pending))
+            self._pending = None
+
+        keep_from = self._next - 2 if self._pending is None else min(self._next - 2, self._pending[0])
+        self._history = self._history[keep_from - self._history_start:]
+        self._history_start = keep_from
+
+    def _offer(self, position, left, peak, right, detections):
+        if self._pending is not None:
+            if position - self._pending[0] <= self.holdoff:
+                if peak > self._pending[2]:
+                    self._pending = (position, left, peak, right)
+                return
+            detections.append(self._finish(*self._pending))
+        self._pending = (position, left, peak, right)
+
+    def _finish(self, position, left, peak, right):
+        # Parabolic interpolation of the correlation envelope around its peak
+        curvature = left - 2 * peak + right
+        fraction = 0.5 * (left - right) / curvature if curvature < 0 else 0.0
+
+        offset = position - self._history_start
+        received = analytic(self._history[offset:offset + len(self.preamble)])
+        if self.cyclic_prefix:
+            # Phase advance between the cyclic prefix and the symbol tail it copies; both went through
+            # the same channel, so echoes do not bias it. The prefix start is skipped as it holds the echo onset.
+            period = len(self.preamble) - self.cyclic_prefix
+            tail = slice(self.cyclic_prefix // 2, self.cyclic_prefix)
+            rotation = np.sum(received[period:][tail] * np.conj(received[tail]))
+        else:
+            # Phase advance between the two halves of the preamble, relative to the reference
+            period = len(received) // 2
+            product = received * np.conj(self._reference)
+            rotation = np.sum(product[period:2 * period]) * np.conj(np.sum(product[:period]))
+        cfo_hz = float(np.angle(rotation) * self.sample_rate / (2 * np.pi * period))
+        return Detection(position + float(np.clip(fraction, -0.5, 0.5)), float(peak), cfo_hz)
+
+
+def synthetic_stream(modem, seconds, rng, symbols=8, snr_db=15.0, cfo_hz=3.0):
+    """Frames at random gaps with fractional delay, echo, frequency offset and noise"""
+    stream = np.zeros(int(seconds * modem.sample_rate))
+    frame_length = modem.frame_samples(symbols)
+    starts, payloads = [], []
+    position = int(rng.integers(1000, 5000))
+    while position + frame_length < len(stream):
+        bits = rng.integers(0, 2, symbols * modem.bits_per_symbol, dtype=np.uint8)
+        stream[position:position + frame_length] = modem.modulate(bits)
+        starts.append(position)
+        payloads.append(bits)
+        position += frame_length + int(rng.integers(2000, 20000))
+
+    delay = float(rng.uniform(0, 1))
+    stream = fractional_delay(stream, delay)
+    stream = shift_frequency(stream, cfo_hz, modem.sample_rate)
+    stream = multipath_channel(stream, snr_db, rng)
+    return stream.astype(np.float32), np.array(starts) + delay, payloads
+
+
+def benchmark(modem, seconds=30.0, chunk=1024, snr_db=15.0, cfo_hz=3.0, seed=3):
+    rng = np.random.default_rng(seed)
+    symbols = 8
+    stream, starts, payloads = synthetic_stream(modem, seconds, rng, symbols, snr_db, cfo_hz)
+    sync = PreambleSync.for_modem(modem)
+
+    started = time.perf_counter()
+    detections = []
+    for offset in range(0, len(stream), chunk):
+        detections.extend(sync.feed(stream[offset:offset + chunk]))
+    detections.extend(sync.flush())
+    elapsed = time.perf_counter() - started
+
+    timing_errors, cfo_errors, bit_errors, bits_total, matched = [], [], 0, 0, set()
+    for detection in detections:
+        nearest = int(np.argmin(np.abs(starts - detection.position)))
+        if abs(starts[nearest] - detection.position) > modem.cyclic_prefix // 2:
+            continue
+        matched.add(nearest)
+        timing_errors.append(detection.position - starts[nearest])
+        cfo_errors.append(detection.cfo_hz - cfo_hz)
+        frame = stream[detection.sample:detection.sample + modem.frame_samples(symbols)]
+        out = modem.demodulate(shift_frequency(frame, -detection.cfo_hz, modem.sample_rate), symbols)
+        bit_errors += int(np.sum(out[:len(payloads[nearest])] != payloads[nearest]))
+        bits_total += len(payloads[nearest])
+
+    # Reference cost of the direct O(N*M) correlation over the first ten seconds
+    reference = stream[:10 * modem.sample_rate].astype(np.float64)
+    naive_started = time.perf_counter()
+    np.correlate(reference, sync.preamble, "valid")
+    naive_speed = (len(reference) / modem.sample_rate) / (time.perf_counter() - naive_started)
+
+    return {
+        "frames": len(starts),
+        "detected": len(matched),
+        "false_alarms": len(detections) - len(matched),
+        "timing_rms_samples": float(np.sqrt(np.mean(np.square(timing_errors)))) if timing_errors else None,
+        "cfo_rms_hz": float(np.sqrt(np.mean(np.square(cfo_errors)))) if cfo_errors else None,
+        "ber": bit_errors / bits_total if bits_total else None,
+        "realtime_factor": (len(stream) / modem.sample_rate) / elapsed,
+        "naive_realtime_factor": naive_speed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streaming preamble detection for the OFDM modem")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--benchmark", action="store_true", help="detect frames in a simulated capture")
+    parser.add_argument("--seconds", type=float, default=30.0, help="length of the simulated capture")
+    parser.add_argument("--snr", type=float, default=15.0, help="channel SNR in dB")
+    parser.add_argument("--cfo", type=float, default=3.0, help="injected frequency offset in Hz")
+    args = parser.parse_args(argv)
+
+    modem = OfdmModem.from_config(args.config)
+    sync = PreambleSync.for_modem(modem)
+    print(f"preamble {len(sync.preamble)} samples, FFT {sync.fft_size}, hop {sync.hop}, "
+          f"threshold {sync.threshold}")
+    if not args.benchmark:
+        return 0
+
+    result = benchmark(modem, args.seconds, snr_db=args.snr, cfo_hz=args.cfo)
+    print(f"frames:          {result['detected']}/{result['frames']} detected, "
+          f"{result['false_alarms']} false alarms")
+    if result["detected"]:
+        print(f"timing error:    {result['timing_rms_samples']:.3f} samples rms")
+        print(f"cfo error:       {result['cfo_rms_hz']:.3f} Hz rms")
+        print(f"payload BER:     {result['ber']:.2e}")
+    print(f"speed:           {result['realtime_factor']:.0f}x real time "
+          f"(direct correlation: {result['naive_realtime_factor']:.0f}x)")
+    return 0 if result["detected"] == result["frames"] and result["false_alarms"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Latency/Power Profiles
+Named profiles that set every buffer in the audio path together, plus a probe that measures them
+
+A profile fills in, when config.ini is loaded: the server quantum (`[audio] buffer_size`,
+forced on PipeWire), the loopback latency PulseAudio routes get, the pipeline's capture
+block, parec/pacat stream latency, the latency the drift controller holds, and how often
+the output is analysed, pushed to viewers and added to the spectrogram (never more often
+than it is analysed). A key config.ini sets itself wins over the profile; `profile = custom`
+fills in nothing. The probe runs the real pipeline stages on this box, paced like live
+capture, and reports the queue the pipeline held, underruns, scheduler lateness and CPU per
+profile. By default the sink is modelled from the monotonic clock, so
+the latency is an estimate; `--live` plays silence through the default sink and measures it.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROFILES = {
+    "low-latency": {
+        "audio": {"buffer_size": 256},
+        "pulseaudio": {"loopback_latency_ms": 20},
+        "pipeline": {"block_ms": 5, "stream_latency_ms": 5, "target_latency_ms": 30, "spectrum_rate": 30},
+        "bridge": {"frame_rate": 30, "history_rate": 20},
+    },
+    "balanced": {
+        "audio": {"buffer_size": 1024},
+        "pulseaudio": {"loopback_latency_ms": 60},
+        "pipeline": {"block_ms": 10, "stream_latency_ms": 20, "target_latency_ms": 80, "spectrum_rate": 30},
+        "bridge": {"frame_rate": 20, "history_rate": 20},
+    },
+    "power-saver": {
+        "audio": {"buffer_size": 4096},
+        "pulseaudio": {"loopback_latency_ms": 200},
+        "pipeline": {"block_ms": 40, "stream_latency_ms": 60, "target_latency_ms": 250, "spectrum_rate": 10},
+        "bridge": {"frame_rate": 10, "history_rate": 10},
+    },
+}
+
+
+def apply_profile(config, profile=None, override=False):
+    """Fill in the profile's settings that `config` leaves unset (all of them with `override`);
+    profile defaults to [audio] profile. Returns its name"""
+    name = profile or config.get("audio", "profile", fallback="custom")
+    if name == "custom":
+        return name
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile: {name} (choose from {', '.join(PROFILES)} or custom)")
+    for section, values in PROFILES[name].items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            if override or not config.has_option(section, key):
+                config.set(section, key, str(value))
+    config.set("audio", "profile", name)
+    return name
+
+
+def server_latency_ms(config):
+    """What the server adds on top of the pipeline: one quantum at the configured rate"""
+    return config.getint("audio", "buffer_size", fallback=0) * 1000 / config.getint("audio", "sample_rate",
+                                                                                    fallback=44100)
+
+
+async def _probe(pipeline, seconds, live=False):
+    from mixer import Mixer
+
+    name = "bluez_source.AC_37_43_00_00_01.a2dp_source"
+    pipeline.mixer = Mixer(pipeline.block_frames, pipeline.channels, pipeline.sample_rate, pipeline.duck_db)
+    pipeline.add_source(name)
+    rng = np.random.default_rng(1)
+    block_seconds = pipeline.block_frames / pipeline.sample_rate
+    t = np.arange(pipeline.block_frames) / pipeline.sample_rate
+
+    if live:
+        # Silence through the default sink, its queue measured the way the pipeline does live
+        playback = await pipeline._open_playback()
+        measuring = asyncio.ensure_future(pipeline._measure_task())
+    else:
+        # Playback starts with the latency budget queued, as _open_playback does
+        pipeline._written = int(pipeline.drift.target_frames)
+        pipeline._captured = 0
+        pipeline._started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    lateness, fills, underruns = [], [], 0
+    cpu = time.process_time()
+    for index in range(int(seconds / block_seconds)):
+        deadline += block_seconds
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+        now = time.monotonic()
+        lateness.append(loop.time() - deadline)
+
+        phase = 2 * np.pi * 440 * (t + index * block_seconds)
+        tone = (0.2 * np.sin(phase) + 0.01 * rng.standard_normal(len(t))).astype(np.float32)
+        blocks = {name: np.repeat(tone[:, None], pipeline.channels, axis=1)}
+        pipeline.silence.update(blocks.values())
+        for source, normalizer in pipeline.normalizers.items():
+            blocks[source] = normalizer.process(blocks[source])
+        mixed = pipeline.mixer.mix(blocks)
+        fill = pipeline.estimated_fill(now)
+        if fill < 0:
+            underruns += 1
+            pipeline._written -= int(fill)
+            fill = 0
+        out = pipeline.process(mixed, fill, now)
+        fills.append(fill * 1000 / pipeline.sample_rate)
+        if live:
+            playback.stdin.write(np.zeros(out.shape, dtype=np.float32).tobytes())
+            await playback.stdin.drain()
+    cpu = time.process_time() - cpu
+    measured = pipeline._measured is not None
+    if live:
+        measuring.cancel()
+        await asyncio.gather(measuring, return_exceptions=True)
+        await pipeline._close_playback(playback)
+    for stage in pipeline.stages:
+        if hasattr(stage, "close"):
+            stage.close()
+    return {
+        "cpu_percent": round(100 * cpu / seconds, 2),
+        "wakeups_per_second": round(1 / block_seconds, 1),
+        "lateness_p99_ms": round(float(np.percentile(lateness, 99)) * 1000, 2),
+        "queue_ms": round(float(np.mean(fills)), 1),
+        "underruns": underruns,
+        "latency_source": "measured" if measured else "modelled",
+    }
+
+
+def probe(profile, seconds=3.0, config_file=None, live=False):
+    """Run the pipeline's per-block work for `seconds` under `profile` and measure what it achieves;
+    with `live` the sink queue is measured through the default sink instead of modelled"""
+    from audio_pipeline import AudioPipeline
+    from bluetooth_daemon import DEFAULT_CONFIG, load_config
+
+    # Profiles are compared as defined, whatever config.ini pins
+    config = load_config(config_file or DEFAULT_CONFIG)
+    apply_profile(config, profile, override=True)
+    with tempfile.TemporaryDirectory(prefix="bluetooth_speaker_probe_") as directory:
+        # Meters write to scratch files, nothing is recorded and no learned gain is saved
+        config.set("pipeline", "levels_file", os.path.join(directory, "levels"))
+        config.set("pipeline", "spectrum_file", os.path.join(directory, "spectrum"))
+        if config.has_section("recorder"):
+            config.set("recorder", "directory", "")
+        if not config.has_section("daemon"):
+            config.add_section("daemon")
+        config.set("daemon", "registry_file", os.path.join(directory, "registry.json"))
+        path = os.path.join(directory, "config.ini")
+        with open(path, "w") as f:
+            config.write(f)
+        pipeline = AudioPipeline(path)
+        result = asyncio.run(_probe(pipeline, seconds, live))
+
+    block_ms = pipeline.block_frames * 1000 / pipeline.sample_rate
+    stream_ms = config.getfloat("pipeline", "stream_latency_ms", fallback=pipeline.target_ms / 4)
+    # A measured queue already includes what the sink and server hold
+    server_ms = server_latency_ms(config) if result["latency_source"] == "modelled" else 0.0
+    result.update({
+        "profile": profile,
+        "block_ms": round(block_ms, 2),
+        "server_ms": round(server_ms, 1),
+        # Capture buffering + one block + what the sink holds + the server's quantum + scheduler lateness
+        "latency_ms": round(stream_ms + block_ms + result["queue_ms"] + server_ms
+                            + result["lateness_p99_ms"], 1),
+    })
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency/power profiles for the audio path")
+    parser.add_argument("--config", default=None, help="path to config.ini")
+    parser.add_argument("--probe", "--benchmark", action="store_true", dest="probe",
+                        help="measure latency and CPU of every profile on this machine")
+    parser.add_argument("--seconds", type=float, default=3.0, help="probe duration per profile")
+    parser.add_argument("--live", action="store_true",
+                        help="play silence through the default sink and measure its queue instead of modelling it")
+    args = parser.parse_args(argv)
+
+    if not args.probe:
+        for name, sections in PROFILES.items():
+            settings = ", ".join(f"{key}={value}" for values in sections.values() for key, value in values.items())
+            print(f"{name:<12} {settings}")
+        return 0
+
+    print(f"{'profile':<12} {'latency ms':>10} {'queue':>7} {'server':>7} {'late p99':>9} "
+          f"{'underruns':>9} {'wakeups/s':>9} {'CPU %':>6}  source")
+    modelled = False
+    for name in PROFILES:
+        result = probe(name, args.seconds, args.config, args.live)
+        modelled |= result["latency_source"] == "modelled"
+        print(f"{name:<12} {result['latency_ms']:>10.1f} {result['queue_ms']:>7.1f} "
+              f"{result['server_ms']:>7.1f} {result['lateness_p99_ms']:>9.2f} {result['underruns']:>9} "
+              f"{result['wakeups_per_second']:>9.0f} {result['cpu_percent']:>6.2f}  {result['latency_source']}")
+    if modelled:
+        print("modelled: latency and underruns are estimates from the monotonic clock, not the sink; "
+              "--live measures them")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
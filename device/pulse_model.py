@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - PulseAudio Model
+Sinks, sources, cards and modules kept current from one `pactl subscribe`, queried in memory
+
+`pactl subscribe` only names what changed ("Event 'new' on source #12"). Removals are applied
+straight from the event. New and changed objects mark their kind dirty, and after a short
+settle time each dirty kind is listed once, however many events a hot-plug produced.
+Everything else (the phone's source, the default sink, whether a loopback already exists)
+is a dictionary lookup instead of a `pactl list` and a substring scan.
+"""
+
+import argparse
+import asyncio
+import re
+import shlex
+import sys
+import time
+from collections import defaultdict
+
+from bluetooth_daemon import CommandRunner, log
+from tool_parsers import (PulseModule, parse_pactl_info, parse_pactl_modules, parse_pactl_short,
+                          parse_pactl_subscribe)
+
+KINDS = ("sink", "source", "card", "module")
+BLUEZ_SOURCE = re.compile(r"^bluez_(?:source|input)\.([0-9A-Fa-f]{2}(?:_[0-9A-Fa-f]{2}){5})")
+
+
+def module_arguments(argument):
+    """`source=a sink=b latency_msec=20` -> dict; tolerant of unbalanced quotes"""
+    try:
+        words = shlex.split(argument or "")
+    except ValueError:
+        words = (argument or "").split()
+    return dict(word.split("=", 1) for word in words if "=" in word)
+
+
+class PulseModel:
+    """Index of the server's objects by index, by name, by phone address and by loopback route"""
+
+    def __init__(self):
+        self.objects = {kind: {} for kind in KINDS}       # kind -> index -> record
+        self.by_name = {kind: {} for kind in KINDS}
+        self.sources_by_address = defaultdict(set)
+        self.loopbacks = {}                                # (source, sink) -> module index
+        self.server = None
+        self.version = 0  # bumped when the set of sinks or sources changes
+
+    def replace(self, kind, records):
+        """Install a fresh listing of one kind"""
+        before = set(self.by_name[kind]) if kind in ("sink", "source") else None
+        for index in list(self.objects[kind]):
+            self._unindex(kind, index)
+        for record in records:
+            self.add(kind, record, count=False)
+        if before is not None and before != set(self.by_name[kind]):
+            self.version += 1
+
+    def add(self, kind, record, count=True):
+        if record.index in self.objects[kind]:
+            self._unindex(kind, record.index)
+        self.objects[kind][record.index] = record
+        self.by_name[kind][record.name] = record.index
+        if kind == "source":
+            match = BLUEZ_SOURCE.match(record.name)
+            if match:
+                self.sources_by_address[match.group(1).replace("_", ":").upper()].add(record.index)
+        elif kind == "module" and record.name == "module-loopback":
+            arguments = module_arguments(record.argument)
+            self.loopbacks[(arguments.get("source"), arguments.get("sink"))] = record.index
+        if count and kind in ("sink", "source"):
+            self.version += 1
+
+    def remove(self, kind, index):
+        if index in self.objects.get(kind, {}):
+            self._unindex(kind, index)
+            if kind in ("sink", "source"):
+                self.version += 1
+
+    def _unindex(self, kind, index):
+        record = self.objects[kind].pop(index)
+        if self.by_name[kind].get(record.name) == index:
+            del self.by_name[kind][record.name]
+        if kind == "source":
+            match = BLUEZ_SOURCE.match(record.name)
+            if match:
+                self.sources_by_address[match.group(1).replace("_", ":").upper()].discard(index)
+        elif kind == "module" and record.name == "module-loopback":
+            arguments = module_arguments(record.argument)
+            if self.loopbacks.get((arguments.get("source"), arguments.get("sink"))) == index:
+                del self.loopbacks[(arguments.get("source"), arguments.get("sink"))]
+
+    def get(self, kind, name):
+        index = self.by_name[kind].get(name)
+        return self.objects[kind][index] if index is not None else None
+
+    def sinks(self):
+        return sorted(self.objects["sink"].values(), key=lambda entry: entry.index)
+
+    def sources(self):
+        """Real sources; the .monitor of every sink is left out"""
+        return sorted((entry for entry in self.objects["source"].values() if not entry.name.endswith(".monitor")),
+                      key=lambda entry: entry.index)
+
+    def bluetooth_sources(self, address=None):
+        if address:
+            indexes = self.sources_by_address.get(address.upper(), ())
+        else:
+            indexes = set().union(*self.sources_by_address.values()) if self.sources_by_address else ()
+        return sorted((self.objects["source"][index] for index in indexes), key=lambda entry: entry.index)
+
+    def default_sink(self):
+        return self.get("sink", self.server.default_sink) if self.server else None
+
+
+class PulseBackend:
+    """Keeps a PulseModel current from `pactl subscribe` and routes with module-loopback"""
+
+    name = "pulse"
+
+    def __init__(self, runner=None, settle=0.05):
+        self.runner = runner or CommandRunner()
+        self.loopback_latency_ms = 0  # latency_msec of the loopbacks route() loads; 0 = module default
+        self.model = PulseModel()
+        self.settle = settle
+        self.changed = asyncio.Event()
+        self._watchers = []
+        self.events = 0
+        self.listings = 0  # pactl calls made to refresh the model
+        self._dirty = set()
+        self._flush = None
+        self._removed = defaultdict(list)  # kind -> one set per listing in flight, of indexes removed since it began
+        self._process = None
+        self._task = None
+
+    async def start(self, timeout=5.0):
+        """Subscribe first so nothing between the snapshot and the subscription is missed"""
+        self._process = await self.runner.open_pipe(["pactl", "subscribe"], write=False)
+        self._task = asyncio.ensure_future(self._read())
+        await asyncio.wait_for(self.refresh(KINDS + ("server",)), timeout)
+        return self
+
+    def close(self):
+        for task in (self._task, self._flush):
+            if task is not None:
+                task.cancel()
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+
+    async def _list(self, kind):
+        self.listings += 1
+        if kind == "server":
+            success, output, _ = await self.runner.run(["pactl", "info"], timeout=5)
+            if success:
+                self.model.server = next(parse_pactl_info(output), None)
+            return
+        # A removal applied while the listing is in flight must not be undone by it
+        removed = set()
+        self._removed[kind].append(removed)
+        try:
+            success, output, _ = await self.runner.run(["pactl", "list", "short", f"{kind}s"], timeout=5)
+        finally:
+            self._removed[kind].remove(removed)
+        if success:
+            parser = parse_pactl_modules if kind == "module" else parse_pactl_short
+            self.model.replace(kind, [record for record in parser(output) if record.index not in removed])
+
+    def _remove(self, kind, index):
+        for removed in self._removed.get(kind, ()):
+            removed.add(index)
+        self.model.remove(kind, index)
+
+    async def refresh(self, kinds):
+        await asyncio.gather(*[self._list(kind) for kind in kinds])
+        self._notify()
+
+    async def _read(self):
+        while True:
+            line = await self._process.stdout.readline()
+            if not line:
+                break
+            for event in parse_pactl_subscribe([line.decode(errors="replace")]):
+                self.apply(event)
+        log("⚠️  pactl subscribe ended; the PulseAudio model is no longer updated")
+
+    def apply(self, event):
+        """Fold one subscribe event in: removals now, everything else in the next coalesced listing"""
+        if event.facility not in KINDS and event.facility != "server":
+            return  # streams and clients come and go with every sound; routing does not look at them
+        self.events += 1
+        if event.event == "remove":
+            self._remove(event.facility, event.index)
+            self._notify()
+            return
+        self._dirty.add(event.facility)
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._settle())
+
+    async def _settle(self):
+        await asyncio.sleep(self.settle)
+        kinds, self._dirty, self._flush = self._dirty, set(), None
+        await self.refresh(kinds)
+
+    def _notify(self):
+        self.changed.set()
+        for event in self._watchers:
+            event.set()
+
+    def watch(self):
+        """An event of the caller's own, set on every update (nobody else clears it)"""
+        event = asyncio.Event()
+        self._watchers.append(event)
+        return event
+
+    # The same interface as PipeWireBackend
+
+    @property
+    def version(self):
+        return self.model.version
+
+    def sinks(self):
+        return self.model.sinks()
+
+    def sources(self):
+        return self.model.sources()
+
+    def bluetooth_sources(self, address=None):
+        return self.model.bluetooth_sources(address)
+
+    def default_sink(self):
+        return self.model.default_sink()
+
+    async def wait_for(self, lookup, timeout=5.0):
+        """lookup()'s first truthy result, re-checked as events arrive (e.g. a phone's source)"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            self.changed.clear()
+            result = lookup()
+            remaining = deadline - asyncio.get_running_loop().time()
+            if result or remaining <= 0:
+                return result
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def route(self, source_name, sink_name, latency_msec=None):
+        """Loop source into sink, reusing a loopback the model already has. Returns the module index"""
+        existing = self.model.loopbacks.get((source_name, sink_name))
+        if existing is not None:
+            return str(existing)
+        args = ["pactl", "load-module", "module-loopback", f"source={source_name}", f"sink={sink_name}"]
+        latency_msec = latency_msec or self.loopback_latency_ms
+        if latency_msec:
+            args.append(f"latency_msec={latency_msec}")
+        success, output, error = await self.runner.run(args, timeout=5)
+        if not success or not output.strip().isdigit():
+            raise RuntimeError(f"load-module failed: {error.strip() or output.strip()}")
+        # Known at once, so a second route() before the event arrives does not load another
+        self.model.add("module", PulseModule(index=int(output), name="module-loopback",
+                                             argument=" ".join(shlex.quote(arg) for arg in args[3:])))
+        return output.strip()
+
+    async def unroute(self, route):
+        await self.runner.run(["pactl", "unload-module", route], timeout=5)
+        self._remove("module", int(route))
+
+    async def set_default_sink(self, sink_name):
+        success, _, error = await self.runner.run(["pactl", "set-default-sink", sink_name], timeout=5)
+        if not success:
+            raise RuntimeError(f"set-default-sink failed: {error.strip()}")
+
+    async def set_quantum(self, frames):
+        """PulseAudio fragments are fixed in daemon.conf; the profile reaches it per stream instead"""
+        return False
+
+
+async def _benchmark(phones, rounds):
+    from fake_tools import FakeRunner, make_adapters
+
+    adapters = make_adapters(1, devices_per_adapter=phones)
+    runner = FakeRunner(adapters, sinks=[f"alsa_output.card{n}.analog-stereo" for n in range(4)],
+                        tool_latency={"pactl": 0.002})
+    backend = await PulseBackend(runner).start()
+    macs = list(adapters[0].devices)
+
+    # Every phone connects at once: two events each, coalesced into one listing per kind
+    listings = backend.listings
+    started = time.perf_counter()
+    await runner.run(["bluetoothctl"], input="".join(f"connect {mac}\n" for mac in macs))
+    await backend.wait_for(lambda: len(backend.bluetooth_sources()) == phones or None)
+    burst = time.perf_counter() - started
+    burst_listings = backend.listings - listings
+
+    started = time.perf_counter()
+    for index in range(rounds):
+        backend.bluetooth_sources(macs[index % phones])
+        backend.default_sink()
+        backend.model.loopbacks.get(("a", "b"))
+    query = (time.perf_counter() - started) / rounds
+
+    # The old way: list sources and scan the names for the phone
+    from tool_parsers import parse_pactl_short
+
+    started = time.perf_counter()
+    for index in range(20):
+        _, output, _ = await runner.run(["pactl", "list", "short", "sources"])
+        key = macs[index % phones].replace(":", "_")
+        [entry.name for entry in parse_pactl_short(output) if key in entry.name]
+    scan = (time.perf_counter() - started) / 20
+    backend.close()
+    return {"phones": phones, "events": backend.events, "burst": burst, "burst_listings": burst_listings,
+            "query": query, "scan": scan}
+
+
+def benchmark(phones=8, rounds=10000):
+    """Model lookups against listing and scanning, and how a connect burst is coalesced"""
+    return asyncio.run(_benchmark(phones, rounds))
+
+
+async def _show(runner):
+    backend = await PulseBackend(runner).start()
+    model = backend.model
+    print(f"server: {model.server.name if model.server else '-'}")
+    default = model.default_sink()
+    print(f"default sink: {default.name if default else '-'}")
+    for title, entries in (("sinks", model.sinks()), ("sources", model.sources()),
+                           ("bluetooth", model.bluetooth_sources())):
+        print(f"{title}:")
+        for entry in entries:
+            print(f"  {entry.index:>5} {entry.name} [{entry.state}]")
+    print(f"loopbacks: {len(model.loopbacks)}")
+    backend.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="In-memory PulseAudio model from pactl subscribe")
+    parser.add_argument("--benchmark", action="store_true", help="lookup cost and event coalescing, offline")
+    parser.add_argument("--phones", type=int, default=8, help="phones connecting at once in the benchmark")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        result = benchmark(args.phones)
+        print(f"connect burst: {result['phones']} phones, {result['events']} events -> "
+              f"{result['burst_listings']} pactl listings, model current after {result['burst'] * 1000:.0f} ms")
+        print(f"lookup: {result['query'] * 1e6:.1f} us (phone source + default sink + loopback) against "
+              f"{result['scan'] * 1000:.2f} ms to list and scan sources with a 2 ms pactl")
+        return 0
+    asyncio.run(_show(CommandRunner()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
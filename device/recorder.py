@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Recorder
+Crash-safe WAV segments of what each phone sent, with a pre-trigger ring ("save the last 60 s")
+
+Segments are float32 WAV, the capture format, so audio goes from the capture buffer to the
+kernel without a conversion copy. The data is appended with plain write() calls; the RIFF and
+data sizes are rewritten in place every `fixup_seconds`, always after the audio they cover, so
+a file left behind by a crash or a power cut reads as everything up to the last fix-up.
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from bluetooth_daemon import log
+
+# RIFF header, 16-byte fmt chunk (format 3 = IEEE float), data chunk header
+WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+RIFF_SIZE_OFFSET = 4
+DATA_SIZE_OFFSET = WAV_HEADER.size - 4
+MAX_DATA_BYTES = 0xFFFFFFFF - WAV_HEADER.size
+_SIZE = struct.Struct("<I")
+
+
+def wav_header(sample_rate, channels, data_bytes=0):
+    frame_bytes = 4 * channels
+    return WAV_HEADER.pack(b"RIFF", WAV_HEADER.size - 8 + data_bytes, b"WAVE", b"fmt ", 16, 3, channels,
+                           sample_rate, sample_rate * frame_bytes, frame_bytes, 32, b"data", data_bytes)
+
+
+class WavSegment:
+    """One float32 WAV file, written sequentially with its header kept valid as it grows
+
+    Disk space is reserved `preallocate_bytes` at a time with posix_fallocate so a long segment
+    does not fragment; close() trims the file back to the audio. pwrite() does not honour the
+    file position on O_APPEND descriptors under Linux, so the file is opened without it and the
+    header fix-ups go to offset 4 and 40 while the audio keeps streaming at the end.
+    """
+
+    def __init__(self, path, sample_rate, channels, fixup_seconds=1.0, sync_seconds=0.0,
+                 preallocate_bytes=4 << 20):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_bytes = 4 * channels
+        self.frames = 0
+        self.fixup_frames = max(1, int(fixup_seconds * sample_rate))
+        self.sync_frames = int(sync_seconds * sample_rate)
+        self.preallocate_bytes = preallocate_bytes
+        self._fixed = 0     # frames the header covers
+        self._synced = 0
+        self._allocated = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.write(self._fd, wav_header(sample_rate, channels))
+        self._reserve(WAV_HEADER.size)
+
+    @property
+    def data_bytes(self):
+        return self.frames * self.frame_bytes
+
+    @property
+    def seconds(self):
+        return self.frames / self.sample_rate
+
+    def _reserve(self, end):
+        if not self.preallocate_bytes or end <= self._allocated:
+            return
+        size = end + self.preallocate_bytes
+        try:
+            os.posix_fallocate(self._fd, self._allocated, size - self._allocated)
+            self._allocated = size
+        except OSError:
+            self.preallocate_bytes = 0  # not supported here (e.g. vfat); plain appends still work
+
+    def write(self, frames):
+        """Append a C-contiguous (N, channels) float32 array straight from its buffer"""
+        data = memoryview(frames).cast("B")
+        self._reserve(WAV_HEADER.size + self.data_bytes + len(data))
+        while data:
+            written = os.write(self._fd, data)
+            data = data[written:]
+        self.frames += len(frames)
+        if self.frames - self._fixed >= self.fixup_frames:
+            self.fix_header()
+        if self.sync_frames and self.frames - self._synced >= self.sync_frames:
+            os.fdatasync(self._fd)
+            self._synced = self.frames
+
+    def fix_header(self):
+        """Make the header cover every frame written so far (the audio itself is already in the file)"""
+        data_bytes = self.data_bytes
+        os.pwrite(self._fd, _SIZE.pack(WAV_HEADER.size - 8 + data_bytes), RIFF_SIZE_OFFSET)
+        os.pwrite(self._fd, _SIZE.pack(data_bytes), DATA_SIZE_OFFSET)
+        self._fixed = self.frames
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            self.fix_header()
+            os.ftruncate(self._fd, WAV_HEADER.size + self.data_bytes)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Recorder:
+    """Pipeline stage: keeps the last `pre_trigger_seconds` of a source and records segments on request
+
+    Every block is copied once into a preallocated ring; that copy is the whole cost while
+    nothing is being recorded. A recording starts at the oldest frame the ring still holds and
+    catches up by writing `catch_up_seconds` of ring per block, straight from the ring's memory;
+    once it reaches the present each block goes to the file directly from the capture buffer.
+    Segments rotate after `segment_seconds` or `segment_bytes`, whichever comes first.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, directory="/tmp/bluetooth_speaker_recordings",
+                 prefix="capture", pre_trigger_seconds=60.0, segment_seconds=900.0, segment_bytes=0,
+                 fixup_seconds=1.0, sync_seconds=0.0, catch_up_seconds=0.5, preallocate_bytes=4 << 20):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.directory = directory
+        self.prefix = prefix
+        frame_bytes = 4 * channels
+        limit = MAX_DATA_BYTES // frame_bytes
+        if segment_bytes:
+            limit = min(limit, (segment_bytes - WAV_HEADER.size) // frame_bytes)
+        if segment_seconds:
+            limit = min(limit, int(segment_seconds * sample_rate))
+        self.segment_frames = max(1, limit)
+        self.segment_options = {"fixup_seconds": fixup_seconds, "sync_seconds": sync_seconds,
+                                "preallocate_bytes": preallocate_bytes}
+        self.catch_up_frames = max(1, int(catch_up_seconds * sample_rate))
+        self._ring = np.zeros((int(pre_trigger_seconds * sample_rate), channels), dtype=np.float32)
+        self.head = 0           # frames captured since start; the ring holds the last len(_ring)
+        self.segment = None
+        self.cursor = 0         # next frame the recording writes
+        self.until = None       # frame the recording stops at, None = until stop()
+        self.segments = []      # paths of every segment started
+        self.recorded_frames = 0
+        self.errors = 0
+
+    @property
+    def recording(self):
+        return self.segment is not None
+
+    @property
+    def continuous(self):
+        """Recording until stop(), as opposed to saving the buffered past"""
+        return self.segment is not None and self.until is None
+
+    @property
+    def buffered_seconds(self):
+        return min(self.head, len(self._ring)) / self.sample_rate
+
+    def start(self, pre_trigger=True):
+        """Record from the oldest buffered frame (or from now) until stop()"""
+        if self.recording:
+            self.until = None
+            return
+        self.cursor = max(0, self.head - len(self._ring)) if pre_trigger else self.head
+        self.until = None
+        self._open()
+
+    def save_last(self, seconds=None):
+        """Write the buffered past (the last `seconds`, default all of it) to its own segment"""
+        if self.recording:
+            return None
+        available = min(self.head, len(self._ring))
+        if seconds is not None:
+            available = min(available, int(seconds * self.sample_rate))
+        if not available:
+            return None
+        self.cursor = self.head - available
+        self.until = self.head
+        return self._open()
+
+    def stop(self):
+        """Finish now; audio still waiting in the ring is written first"""
+        if self.segment is not None:
+            self.until = self.head
+            self._catch_up(self.head)
+            self._finish()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{len(self.segments):03d}.wav")
+        try:
+            self.segment = WavSegment(path, self.sample_rate, self.channels, **self.segment_options)
+        except OSError as e:
+            self._fail(e)
+            return None
+        self.segments.append(path)
+        return path
+
+    def _finish(self):
+        segment, self.segment, self.until = self.segment, None, None
+        if segment is not None:
+            try:
+                segment.close()
+            except OSError as e:
+                self._fail(e)
+
+    def _fail(self, error):
+        log(f"Recorder error: {error}")
+        self.errors += 1
+        segment, self.segment, self.until = self.segment, None, None
+        if segment is not None:
+            try:
+                segment.close()
+            except OSError:
+                pass
+
+    def _write(self, frames):
+        """Append to the current segment, rotating to a new one at the size/time limit"""
+        while len(frames) and self.segment is not None:
+            room = self.segment_frames - self.segment.frames
+            if room <= 0:
+                self._rotate()
+                continue
+            part = frames[:room]
+            try:
+                self.segment.write(part)
+            except OSError as e:
+                self._fail(e)
+                return
+            self.cursor += len(part)
+            self.recorded_frames += len(part)
+            frames = frames[room:]
+
+    def _rotate(self):
+        until = self.until
+        self._finish()
+        self.until = until
+        self._open()
+
+    def _catch_up(self, limit):
+        """Write ring contents from the cursor up to `limit` (an absolute frame number)"""
+        size = len(self._ring)
+        self.cursor = max(self.cursor, self.head - size)  # anything older has been overwritten
+        while self.segment is not None and self.cursor < limit:
+            start = self.cursor % size
+            count = min(limit - self.cursor, size - start)
+            self._write(self._ring[start:start + count])
+
+    def process(self, block):
+        if self.segment is not None:
+            if self.cursor < self.head:
+                end = self.head if self.until is None else self.until
+                self._catch_up(min(end, self.cursor + self.catch_up_frames))
+            if self.until is not None and self.cursor >= self.until:
+                self._finish()
+            elif self.cursor == self.head:
+                self._write(block)  # caught up: straight from the capture buffer
+        self._store(block)
+        return block
+
+    def _store(self, block):
+        size = len(self._ring)
+        if len(block) > size:
+            self.head += len(block) - size
+            block = block[len(block) - size:]
+        if not size:
+            return
+        start = self.head % size
+        first = min(len(block), size - start)
+        self._ring[start:start + first] = block[:first]
+        self._ring[:len(block) - first] = block[first:]
+        self.head += len(block)
+
+    def close(self):
+        self.stop()
+
+
+def _signal(frames, start, channels=2):
+    """Deterministic test audio: every sample encodes its own frame number"""
+    index = np.arange(start, start + frames, dtype=np.float64)
+    mono = (np.sin(index * 0.01) * 0.5 + (index % 97) * 1e-4).astype(np.float32)
+    return np.repeat(mono[:, None], channels, axis=1)
+
+
+def _read(path):
+    from batch_decode import Capture
+
+    capture = Capture.from_wav(path)
+    data = np.memmap(path, dtype=capture.dtype, mode="r", offset=capture.offset,
+                     shape=(capture.frames, capture.channels)) if capture.frames else np.zeros((0, capture.channels))
+    return capture, np.array(data)
+
+
+def crash_test(directory, sample_rate=44100, block_frames=441, blocks=310, fixup_seconds=0.25):
+    """Record in a child process, SIGKILL it mid-segment, and read back what the file says it holds"""
+    import signal
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            recorder = Recorder(sample_rate, 2, directory, "crash", pre_trigger_seconds=0,
+                                fixup_seconds=fixup_seconds)
+            recorder.start()
+            for index in range(blocks):
+                recorder.process(_signal(block_frames, index * block_frames))
+            os.kill(os.getpid(), signal.SIGKILL)
+        finally:
+            os._exit(1)
+    os.waitpid(pid, 0)
+    path = os.path.join(directory, sorted(name for name in os.listdir(directory) if name.startswith("crash"))[0])
+    capture, data = _read(path)
+    written = blocks * block_frames
+    return {
+        "written_seconds": written / sample_rate,
+        "readable_seconds": capture.frames / sample_rate,
+        "lost_seconds": (written - capture.frames) / sample_rate,
+        "intact": bool(np.array_equal(data, _signal(capture.frames, 0))),
+        "file_bytes": os.path.getsize(path),
+    }
+
+
+def benchmark(sample_rate=44100, block_ms=10.0, seconds=90.0, pre_trigger_seconds=60.0):
+    import tempfile
+
+    block_frames = int(sample_rate * block_ms / 1000)
+    count = int(seconds * sample_rate) // block_frames
+    blocks = [_signal(block_frames, index * block_frames) for index in range(count)]
+    result = {"block_ms": block_ms}
+    with tempfile.TemporaryDirectory() as directory:
+        # Idle: only the ring copy
+        recorder = Recorder(sample_rate, 2, directory, "idle", pre_trigger_seconds)
+        started = time.perf_counter()
+        for block in blocks:
+            recorder.process(block)
+        result["idle_us"] = (time.perf_counter() - started) / count * 1e6
+
+        # "Save the last 60 s": the file must hold exactly the last 60 s, written while blocks keep coming
+        path = recorder.save_last()
+        started = time.perf_counter()
+        catch_up_blocks = 0
+        worst = 0.0
+        while recorder.recording:
+            block_started = time.perf_counter()
+            recorder.process(blocks[catch_up_blocks % count])
+            worst = max(worst, time.perf_counter() - block_started)
+            catch_up_blocks += 1
+        result["save_seconds"] = time.perf_counter() - started
+        result["save_blocks"] = catch_up_blocks
+        result["save_worst_ms"] = worst * 1000
+        capture, data = _read(path)
+        expected = _signal(int(pre_trigger_seconds * sample_rate), count * block_frames
+                           - int(pre_trigger_seconds * sample_rate))
+        result["saved_seconds"] = capture.frames / sample_rate
+        result["saved_exact"] = bool(np.array_equal(data, expected))
+
+        # Continuous recording with rotation every 20 s
+        recorder = Recorder(sample_rate, 2, directory, "rotate", pre_trigger_seconds=0, segment_seconds=20.0)
+        recorder.start()
+        started = time.perf_counter()
+        for block in blocks:
+            recorder.process(block)
+        result["recording_us"] = (time.perf_counter() - started) / count * 1e6
+        recorder.close()
+        parts = [_read(path)[1] for path in recorder.segments]
+        result["segments"] = [len(part) / sample_rate for part in parts]
+        result["rotation_exact"] = bool(np.array_equal(np.concatenate(parts), _signal(count * block_frames, 0)))
+
+        crash_directory = os.path.join(directory, "crash")
+        os.makedirs(crash_directory)
+        result["crash"] = crash_test(crash_directory, sample_rate, block_frames)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crash-safe recorder for received audio")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="per-block cost, pre-trigger save, rotation and a SIGKILL mid-recording")
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    result = benchmark()
+    crash = result["crash"]
+    print(f"idle:       {result['idle_us']:.1f} us per {result['block_ms']:.0f} ms block (ring copy only)")
+    print(f"recording:  {result['recording_us']:.1f} us per block, segments of "
+          f"{', '.join(f'{seconds:.0f}' for seconds in result['segments'])} s, "
+          f"{'identical' if result['rotation_exact'] else 'DIFFERENT'} when joined")
+    print(f"save last:  {result['saved_seconds']:.0f} s written over {result['save_blocks']} blocks "
+          f"({result['save_seconds'] * 1000:.0f} ms, worst block {result['save_worst_ms']:.1f} ms), "
+          f"{'exact' if result['saved_exact'] else 'DIFFERENT'}")
+    print(f"crash:      killed after {crash['written_seconds']:.2f} s, file reads "
+          f"{crash['readable_seconds']:.2f} s ({crash['lost_seconds']:.2f} s after the last header fix-up), "
+          f"{'intact' if crash['intact'] else 'CORRUPT'}")
+    ok = result["saved_exact"] and result["rotation_exact"] and crash["intact"] and crash["lost_seconds"] <= 0.25
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Audio Routing Rules
+Declarative phone -> sink rules, compiled once and re-resolved only when the sink set changes
+
+Rules come from `[route:<name>]` sections (then the hub's `[adapter:*] sink`, then
+`[pulseaudio] default_sink`). The first rule whose mac/class/adapter filters match a phone
+wins. Its `sinks` are tried in order: a name or glob pattern (the newest matching sink
+wins, so hot-plugged headphones take over), `default` for the server's default sink, or
+`none` to leave the phone alone. A device's rule is found once. A rule's sink is resolved
+once per sink/source set of the audio model, so a hot-plug costs one resolution per rule
+and one batch of route changes however many phones are connected.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import re
+import sys
+import time
+
+from bluetooth_daemon import DEFAULT_CONFIG, load_config, log
+
+# Major device class (bits 8-12 of the Class of Device) -> name usable in `class =`
+MAJOR_CLASSES = {1: "computer", 2: "phone", 3: "network", 4: "audio-video", 5: "peripheral",
+                 6: "imaging", 7: "wearable", 8: "toy", 9: "health"}
+
+
+def device_classes(info):
+    """Names a `class =` filter can match for a DeviceInfo: its icon and its major class"""
+    names = set()
+    if info is None:
+        return names
+    if info.icon:
+        names.add(info.icon.lower())
+    try:
+        major = (int(info.device_class or "", 16) >> 8) & 0x1F
+    except ValueError:
+        major = None
+    if major in MAJOR_CLASSES:
+        names.add(MAJOR_CLASSES[major])
+    return names
+
+
+def _list(value):
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+class Rule:
+    """One compiled rule: filters on the phone, then sink targets in preference order"""
+
+    def __init__(self, name, macs=(), classes=(), adapters=(), sinks=("default",)):
+        self.name = name
+        self.macs = list(macs)
+        self.mac = re.compile("|".join(fnmatch.translate(mac.upper()) for mac in macs)) if macs else None
+        self.classes = frozenset(item.lower() for item in classes)
+        self.adapters = frozenset(adapters)
+        self.sinks = list(sinks)
+        self.targets = []
+        for target in sinks:
+            if target in ("default", "none"):
+                self.targets.append((target, None))
+            else:
+                self.targets.append(("sink", re.compile(fnmatch.translate(target))))
+        if not self.targets:
+            raise ValueError(f"Route {name} has no sinks")
+
+    @classmethod
+    def from_section(cls, name, section):
+        """Build from a `[route:<name>]` config section"""
+        return cls(name, macs=_list(section.get("mac")), classes=_list(section.get("class")),
+                   adapters=_list(section.get("adapter")), sinks=_list(section.get("sinks", fallback="default")))
+
+    def matches(self, mac, classes, adapter):
+        return ((self.mac is None or self.mac.match(mac.upper()) is not None)
+                and (not self.classes or not self.classes.isdisjoint(classes))
+                and (not self.adapters or adapter in self.adapters))
+
+
+class RoutingEngine:
+    """Picks a sink per phone from compiled rules; results are cached per sink set"""
+
+    def __init__(self, rules, default_sink="auto"):
+        self.rules = list(rules)
+        self.default = None if default_sink in ("", "auto") else Rule("default_sink", sinks=_list(default_sink))
+        self.uses_class = any(rule.classes for rule in self.rules)
+        self._rule_for = {}       # (mac, classes, adapter) -> rule; a phone's attributes do not change
+        self._key = None          # (model version, server default) the resolutions below belong to
+        self._resolved = {}       # rule -> sink name or None
+        self.evaluations = 0
+
+    @classmethod
+    def from_config(cls, config, adapters=()):
+        rules = [Rule.from_section(section.split(":", 1)[1], config[section])
+                 for section in config.sections() if section.startswith("route:")]
+        rules += [Rule(adapter.name, adapters=[adapter.name], sinks=[adapter.sink])
+                  for adapter in adapters if adapter.sink]
+        return cls(rules, config.get("pulseaudio", "default_sink", fallback="auto"))
+
+    @property
+    def active(self):
+        """False when there is nothing to decide: the server's own policy already routes to its default"""
+        return bool(self.rules or self.default)
+
+    def rule_for(self, mac, classes=frozenset(), adapter=None):
+        key = (mac.upper(), frozenset(classes), adapter)
+        if key not in self._rule_for:
+            self._rule_for[key] = next((rule for rule in self.rules if rule.matches(*key)), None)
+        return self._rule_for[key]
+
+    def _current(self, backend):
+        default = backend.default_sink()
+        key = (backend.version, default.name if default else None)
+        if key != self._key:
+            self._key, self._resolved = key, {}
+        return default
+
+    def resolve(self, rule, backend):
+        """The sink a rule picks in the backend's current sink set (cached until that set changes)"""
+        default = self._current(backend)
+        if rule not in self._resolved:
+            self.evaluations += 1
+            self._resolved[rule] = self._resolve(rule, backend, default)
+        return self._resolved[rule]
+
+    def _resolve(self, rule, backend, default):
+        names = [sink.name for sink in backend.sinks()]
+        for kind, pattern in rule.targets:
+            if kind == "none":
+                return None
+            if kind == "default":
+                configured = self.resolve(self.default, backend) if self.default and rule is not self.default else None
+                if configured or default:
+                    return configured or default.name
+                continue
+            matches = [name for name in names if pattern.match(name)]
+            if matches:
+                return matches[-1]
+        return None
+
+    def target(self, backend, mac, classes=frozenset(), adapter=None):
+        rule = self.rule_for(mac, classes, adapter)
+        return self.resolve(rule, backend) if rule is not None else None
+
+    def default_target(self, backend):
+        """The sink `[pulseaudio] default_sink` names right now, or None for auto"""
+        return self.resolve(self.default, backend) if self.default else None
+
+
+class Router:
+    """Keeps every connected phone routed as the engine says, one batch per change"""
+
+    def __init__(self, engine, backend, settle=0.05):
+        self.engine = engine
+        self.backend = backend
+        self.settle = settle
+        self.devices = {}          # mac -> (classes, adapter)
+        self.routes = {}           # mac -> (source, sink, backend handle)
+        self.sources = {}          # mac -> source of every phone the rules route, even while suspended
+        self.suspended = False
+        self.syncs = 0
+        self.skipped = 0
+        self._generation = 0
+        self._applied = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self, mac, classes=(), adapter=None):
+        self.devices[mac.upper()] = (frozenset(classes), adapter)
+        self._generation += 1
+        await self.sync()
+
+    async def disconnect(self, mac):
+        if self.devices.pop(mac.upper(), None) is not None:
+            self._generation += 1
+            await self.sync()
+
+    def _state(self):
+        default = self.backend.default_sink()
+        return (self.backend.version, default.name if default else None, self._generation)
+
+    async def sync(self):
+        """Bring the routes in line with the rules; nothing to do unless devices or sinks/sources changed"""
+        async with self._lock:
+            state = self._state()
+            if state == self._applied:
+                self.skipped += 1
+                return
+            self._applied = state
+            self.syncs += 1
+
+            desired = {}
+            for mac, (classes, adapter) in self.devices.items():
+                sources = self.backend.bluetooth_sources(mac)
+                sink = self.engine.target(self.backend, mac, classes, adapter) if sources else None
+                if sink:
+                    desired[mac] = (sources[0].name, sink)
+            self.sources = {mac: pair[0] for mac, pair in desired.items()}
+            if self.suspended:
+                desired = {}
+            stale = [mac for mac, route in self.routes.items() if route[:2] != desired.get(mac)]
+            await asyncio.gather(*[self._unroute(mac) for mac in stale])
+
+            batch = [self._route(mac, *pair) for mac, pair in desired.items() if mac not in self.routes]
+            default = self.engine.default_target(self.backend)
+            current = self.backend.default_sink()
+            if default and (current is None or current.name != default):
+                batch.append(self._set_default(default))
+            await asyncio.gather(*batch)
+
+    async def _route(self, mac, source, sink):
+        try:
+            self.routes[mac] = (source, sink, await self.backend.route(source, sink))
+        except (LookupError, RuntimeError) as e:
+            log(f"⚠️  Cannot route {mac}: {e}")
+            return
+        log(f"🔊 Routing {mac} -> {sink}")
+
+    async def _unroute(self, mac):
+        _, _, handle = self.routes.pop(mac)
+        await self.backend.unroute(handle)
+
+    async def _set_default(self, sink):
+        try:
+            await self.backend.set_default_sink(sink)
+        except RuntimeError as e:
+            log(f"⚠️  Cannot set default sink {sink}: {e}")
+            return
+        log(f"🔈 Default sink -> {sink}")
+
+    async def suspend(self, suspended):
+        """Drop every route while all phones are silent so the sinks can idle; put them back after"""
+        if suspended == self.suspended:
+            return
+        self.suspended = suspended
+        self._generation += 1
+        log(f"💤 Silent - dropping {len(self.routes)} route(s)" if suspended else "🔊 Sound again - restoring routes")
+        await self.sync()
+
+    async def run(self):
+        """Re-check after every model update; unchanged sink/source sets cost one tuple compare"""
+        updated = self.backend.watch()
+        while True:
+            await updated.wait()
+            await asyncio.sleep(self.settle)  # let a hot-plug's burst of updates land
+            updated.clear()
+            await self.sync()
+
+    async def clear(self):
+        """Forget every device and remove every route, as one batch"""
+        self.devices.clear()
+        self._generation += 1
+        self.sources = {}
+        async with self._lock:
+            await asyncio.gather(*[self._unroute(mac) for mac in list(self.routes)])
+            self._applied = None
+
+
+async def _benchmark(phones, hotplugs):
+    from fake_tools import FakeRunner, make_adapters
+    from pulse_model import PulseBackend
+    from tool_parsers import parse_pactl_short
+
+    adapters = make_adapters(1, devices_per_adapter=phones)
+    runner = FakeRunner(adapters, sinks=["alsa_output.pci-0000_00_1f.3.analog-stereo",
+                                         "alsa_output.pci-0000_00_1f.3.hdmi-stereo"],
+                        tool_latency={"pactl": 0.002})
+    backend = await PulseBackend(runner).start()
+    engine = RoutingEngine([Rule("headphones", classes=["phone"], sinks=["alsa_output.usb-*", "default"])])
+    router = Router(engine, backend)
+    task = asyncio.ensure_future(router.run())
+    macs = list(adapters[0].devices)
+
+    # The hard-coded way, per connection: list sinks, take the first analog ALSA one
+    started = time.perf_counter()
+    for _ in macs:
+        _, output, _ = await runner.run(["pactl", "list", "short", "sinks"])
+        next((entry.name for entry in parse_pactl_short(output)
+              if "alsa_output" in entry.name and "analog-stereo" in entry.name), None)
+    legacy = (time.perf_counter() - started) / len(macs)
+
+    await runner.run(["bluetoothctl"], input="".join(f"connect {mac}\n" for mac in macs))
+    await backend.wait_for(lambda: len(backend.bluetooth_sources()) == phones or None)
+    started = time.perf_counter()
+    for mac in macs:
+        await router.connect(mac, {"phone"})
+    connect = (time.perf_counter() - started) / len(macs)
+    evaluations = engine.evaluations
+
+    # A decision for a phone never seen before: rule match plus the cached sink of that rule
+    started = time.perf_counter()
+    for n in range(1000):
+        engine.target(backend, f"AC:37:43:00:{n // 256:02X}:{n % 256:02X}", {"phone"})
+    decide = (time.perf_counter() - started) / 1000
+
+    plugs = []
+    for n in range(hotplugs):
+        sink = f"alsa_output.usb-Headphones_{n}.analog-stereo"
+        calls, syncs, evaluations = len(runner.calls), router.syncs, engine.evaluations
+        started = time.perf_counter()
+        runner.add_sink(sink)
+        await backend.wait_for(lambda: (len(router.routes) == phones
+                                        and all(route[1] == sink for route in router.routes.values())) or None)
+        plugs.append((time.perf_counter() - started, router.syncs - syncs, engine.evaluations - evaluations,
+                      sum(1 for args, _ in runner.calls[calls:] if args[:2] == ("pactl", "load-module"))))
+
+    # Events that do not touch the sink/source set (a loopback reloaded by hand) re-resolve nothing
+    evaluations = engine.evaluations
+    await runner.run(["pactl", "load-module", "module-null-sink-input"])
+    await asyncio.sleep(0.2)
+    unrelated = engine.evaluations - evaluations
+
+    task.cancel()
+    await router.clear()
+    backend.close()
+    return {"phones": phones, "legacy": legacy, "decide": decide, "connect": connect, "plugs": plugs, "unrelated": unrelated,
+            "rules_resolved_on_connect": evaluations}
+
+
+def benchmark(phones=8, hotplugs=3):
+    """Routing decision cost against the per-connection rescan, and what a hot-plug triggers"""
+    return asyncio.run(_benchmark(phones, hotplugs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or benchmark the audio routing rules")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--benchmark", action="store_true", help="offline: connect burst and headphone hot-plugs")
+    parser.add_argument("--phones", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        result = benchmark(args.phones)
+        print(f"sink choice per connection: {result['legacy'] * 1000:.2f} ms list-and-scan (2 ms pactl) vs "
+              f"{result['decide'] * 1e6:.1f} us from the rules; {result['connect'] * 1000:.2f} ms to connect "
+              f"including the loopback itself")
+        for seconds, syncs, evaluations, loads in result["plugs"]:
+            print(f"headphone hot-plug with {result['phones']} phones: {syncs} sync, {evaluations} rule "
+                  f"resolution(s), {loads} loopbacks moved in one batch, {seconds * 1000:.0f} ms")
+        print(f"unrelated module event: {result['unrelated']} rule resolutions")
+        return 0
+
+    config = load_config(args.config)
+    from bluetooth_hub import load_adapters
+
+    engine = RoutingEngine.from_config(config, load_adapters(config))
+    for rule in engine.rules + ([engine.default] if engine.default else []):
+        filters = "; ".join(f"{label} {', '.join(values)}" for label, values in (
+            ("mac", rule.macs), ("class", sorted(rule.classes)), ("adapter", sorted(rule.adapters))) if values)
+        print(f"{rule.name}: {filters or 'any phone'} -> {', '.join(rule.sinks)}")
+    if not engine.active:
+        print("no rules and default_sink = auto: the audio server's own policy routes phones")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
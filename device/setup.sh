@@ -26,9 +26,11 @@ sudo apt-get install -y \
     bluez \
     pulseaudio \
     pulseaudio-module-bluetooth \
+    pulseaudio-utils \
     bluetooth \
     python3 \
     python3-pexpect \
+    python3-numpy \
     pavucontrol
 
 # Add user to bluetooth group
@@ -42,7 +44,7 @@ sudo systemctl start bluetooth
 
 # Make our programs executable
 echo "Making Bluetooth speaker programs executable..."
-chmod +x bluetooth_pairing.py bluetooth_player.py
+chmod +x bluetooth_pairing.py bluetooth_player.py bluetooth_daemon.py bluetooth_hub.py audio_pipeline.py
 
 echo
 echo "=== Setup Complete! ==="
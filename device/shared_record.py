@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Shared Records
+Fixed-size mmap'd records with one writer and lock-free readers (seqlock)
+
+The writer makes the sequence odd, updates the payload and makes it even again. A reader that
+sees the same even sequence before and after copying the payload has a consistent snapshot, so
+nobody ever takes a lock and readers never slow the writer down.
+"""
+
+import mmap
+import os
+import struct
+
+# magic, version, reserved, payload size, flags, sequence
+HEADER = struct.Struct("<4sHHIIQ")
+FLAGS_OFFSET = 12
+SEQUENCE_OFFSET = 16  # 8-byte aligned, so the sequence is stored in a single write
+PAYLOAD_OFFSET = HEADER.size
+_FLAGS = struct.Struct("<I")
+
+
+def default_path(name):
+    """A file in /dev/shm (RAM) when available"""
+    return os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else "/tmp", name)
+
+
+class SharedRecordWriter:
+    def __init__(self, path, magic, version, payload_size):
+        self.path = path
+        self.payload_size = payload_size
+        size = PAYLOAD_OFFSET + payload_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        # struct.pack_into zeroes its target range before packing, which would briefly show
+        # readers a sequence of 0; a memoryview store is one aligned 8-byte write
+        self._sequence = memoryview(self._map)[SEQUENCE_OFFSET:SEQUENCE_OFFSET + 8].cast("Q")
+        self._payload = memoryview(self._map)[PAYLOAD_OFFSET:]
+        if self._sequence[0] % 2:
+            self._sequence[0] += 1  # a previous writer died mid-update
+        self.flags = 0
+        self._sequence[0] += 1
+        struct.pack_into("<4sHHI", self._map, 0, magic, version, 0, payload_size)
+        self._sequence[0] += 1
+
+    def begin(self):
+        self._sequence[0] += 1
+        _FLAGS.pack_into(self._map, FLAGS_OFFSET, self.flags)
+
+    def end(self):
+        self._sequence[0] += 1
+
+    def pack(self, layout, offset, *values):
+        """struct.pack_into the payload; only between begin() and end()"""
+        layout.pack_into(self._payload, offset, *values)
+
+    def write(self, offset, array):
+        """Copy a contiguous array into the payload without an intermediate bytes object"""
+        data = memoryview(array).cast("B")
+        self._payload[offset:offset + len(data)] = data
+
+    def close(self):
+        self._sequence.release()
+        self._payload.release()
+        self._map.close()
+
+
+class SharedRecordReader:
+    def __init__(self, path, magic, version):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        found, found_version, _, payload_size, *_ = HEADER.unpack_from(self._map, 0)
+        if found != magic or found_version != version or len(self._map) < PAYLOAD_OFFSET + payload_size:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {version} {magic.decode()} record")
+        self.payload_size = payload_size
+        self._end = PAYLOAD_OFFSET + payload_size
+
+    @property
+    def sequence(self):
+        """Changes on every update; comparing it is the cheapest way to see if anything is new"""
+        return struct.unpack_from("<Q", self._map, SEQUENCE_OFFSET)[0]
+
+    def snapshot(self, retries=100):
+        """(flags, sequence, payload bytes) from one consistent update, or None if never consistent"""
+        for _ in range(retries):
+            before = self.sequence
+            if before % 2:
+                continue
+            flags = _FLAGS.unpack_from(self._map, FLAGS_OFFSET)[0]
+            payload = self._map[PAYLOAD_OFFSET:self._end]
+            # Re-read after the copy: a write that started meanwhile has moved the sequence on
+            if self.sequence == before:
+                return flags, before, payload
+        return None
+
+    def close(self):
+        self._map.close()
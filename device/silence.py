@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Silence Detection
+Notices when every connected phone has gone quiet so the pipeline can stop working for nothing
+"""
+
+import argparse
+import asyncio
+import math
+import sys
+import time
+
+import numpy as np
+
+
+class SilenceDetector:
+    """Block-rate RMS/peak gate with a hangover before it declares the input silent
+
+    A block counts as sound when its RMS or its peak is above the thresholds. After the last
+    block with sound the detector waits `hangover_seconds` before suspending, and the first
+    block with sound again resumes it, so nothing ever waits longer than one block to restart.
+    Time is counted in frames, not wall clock, so it behaves the same offline.
+    """
+
+    def __init__(self, sample_rate=44100, threshold_db=-60.0, peak_db=-40.0, hangover_seconds=30.0):
+        self.sample_rate = sample_rate
+        # Compared against mean square to skip the square root on every block
+        self.threshold_power = 10 ** (threshold_db / 10)
+        self.peak = 10 ** (peak_db / 20)
+        self.hangover_frames = int(hangover_seconds * sample_rate)
+        self.suspended = False
+        self.silent_frames = 0      # since the last block with sound
+        self.suspended_frames = 0   # total, over the detector's lifetime
+        self.suspensions = 0
+
+    @property
+    def suspended_seconds(self):
+        return self.suspended_frames / self.sample_rate
+
+    def has_sound(self, block):
+        flat = block.reshape(-1)
+        if not len(flat):
+            return False
+        # max/min reduce without the temporary np.abs would allocate
+        if float(flat.max()) > self.peak or -float(flat.min()) > self.peak:
+            return True
+        return float(np.dot(flat, flat)) > self.threshold_power * len(flat)
+
+    def update(self, blocks):
+        """Feed the latest block of every source (None for a source with nothing new).
+
+        Returns "suspend" or "resume" on a state change, otherwise None.
+        """
+        frames = max((len(block) for block in blocks if block is not None), default=0)
+        if any(self.has_sound(block) for block in blocks if block is not None):
+            self.silent_frames = 0
+            if self.suspended:
+                self.suspended = False
+                return "resume"
+            return None
+        self.silent_frames += frames
+        if self.suspended:
+            self.suspended_frames += frames
+        elif self.silent_frames >= self.hangover_frames:
+            self.suspended = True
+            self.suspensions += 1
+            return "suspend"
+        return None
+
+
+class SilenceWatch:
+    """The same gate for routes that carry audio inside the server (module-loopback, pw-link)
+
+    Nothing passes through us on those routes, so each routed phone source is also captured at
+    a low rate, mono, just for the gate. `on_change(True)` is awaited once every phone has been
+    silent for the hangover, so the routes can be dropped and the sinks left to suspend, and
+    `on_change(False)` on the first block with sound. A source that delivers nothing (the phone
+    paused its A2DP stream) counts as silent.
+    """
+
+    def __init__(self, runner, sources, on_change, rate=4000, block_ms=100.0, **detector):
+        self.runner = runner
+        self.sources = sources  # callable -> names of the sources to watch right now
+        self.on_change = on_change
+        self.rate = rate
+        self.block_frames = int(rate * block_ms / 1000)
+        self.detector = SilenceDetector(rate, **detector)
+        self.captures = {}  # source -> (parec process, reader task)
+        self.latest = {}
+
+    @classmethod
+    def from_config(cls, config, runner, sources, on_change):
+        """Thresholds and hangover from the [pipeline] silence_* keys"""
+        return cls(runner, sources, on_change,
+                   threshold_db=config.getfloat("pipeline", "silence_threshold_db", fallback=-60.0),
+                   peak_db=config.getfloat("pipeline", "silence_peak_db", fallback=-40.0),
+                   hangover_seconds=config.getfloat("pipeline", "silence_seconds", fallback=30.0))
+
+    async def _start(self, source):
+        process = await self.runner.open_pipe([
+            "parec", f"--device={source}", "--format=float32le", f"--rate={self.rate}", "--channels=1",
+            f"--latency-msec={int(self.block_frames * 1000 / self.rate)}",
+        ])
+        self.captures[source] = (process, asyncio.ensure_future(self._read(source, process)))
+
+    async def _stop(self, source):
+        process, reader = self.captures.pop(source)
+        reader.cancel()
+        self.latest.pop(source, None)
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    async def _read(self, source, process):
+        try:
+            while True:
+                data = await process.stdout.readexactly(self.block_frames * 4)
+                self.latest[source] = np.frombuffer(data, dtype=np.float32)
+        except asyncio.IncompleteReadError:
+            pass
+
+    async def run(self):
+        silent = np.zeros(self.block_frames, dtype=np.float32)
+        try:
+            while True:
+                await asyncio.sleep(self.block_frames / self.rate)
+                wanted = set(self.sources())
+                for source in self.captures.keys() - wanted:
+                    await self._stop(source)
+                for source in wanted - self.captures.keys():
+                    await self._start(source)
+                if not wanted:
+                    # Nobody left to wait for; the next phone starts out routed
+                    self.detector.silent_frames = 0
+                    event = "resume" if self.detector.suspended else None
+                    self.detector.suspended = False
+                else:
+                    event = self.detector.update([self.latest.pop(source, silent) for source in wanted])
+                if event:
+                    await self.on_change(event == "suspend")
+        finally:
+            for source in list(self.captures):
+                await self._stop(source)
+
+
+def benchmark(sample_rate=44100, block_ms=10.0, hangover_seconds=5.0):
+    """Play 20 s, go quiet (with a -80 dB noise floor) for 60 s, play again; time both paths"""
+    from loudness import LoudnessNormalizer
+
+    rng = np.random.default_rng(3)
+    block_frames = int(sample_rate * block_ms / 1000)
+    sections = [(20.0, 0.2), (60.0, 1e-4), (20.0, 0.2)]
+    detector = SilenceDetector(sample_rate, hangover_seconds=hangover_seconds)
+    stage = LoudnessNormalizer(sample_rate)
+    events = []
+    detector_time = stage_time = 0.0
+    stage_blocks = 0
+    position = 0
+    for seconds, level in sections:
+        pool = [rng.normal(0, level, (block_frames, 2)).astype(np.float32) for _ in range(8)]
+        for index in range(int(seconds * 1000 / block_ms)):
+            block = pool[index % len(pool)]
+            started = time.perf_counter()
+            event = detector.update([block])
+            detector_time += time.perf_counter() - started
+            if event:
+                events.append((event, position / sample_rate))
+            if not detector.suspended:
+                started = time.perf_counter()
+                stage.process(block)
+                stage_time += time.perf_counter() - started
+                stage_blocks += 1
+            position += block_frames
+    total_blocks = position // block_frames
+    return {
+        "events": events,
+        "suspended_seconds": detector.suspended_seconds,
+        "detector_us": detector_time / total_blocks * 1e6,
+        "stage_us": stage_time / max(1, stage_blocks) * 1e6,
+        "block_ms": block_ms,
+    }
+
+
+async def route_benchmark(phones=2, hangover_seconds=1.0):
+    """Phones routed by loopbacks go quiet, then one plays again: when are the loopbacks dropped and back?"""
+    from fake_tools import FakeRunner, make_adapters
+    from pulse_model import PulseBackend
+    from routing import Router, RoutingEngine, Rule
+
+    adapters = make_adapters(1, devices_per_adapter=phones)
+    runner = FakeRunner(adapters)
+    backend = await PulseBackend(runner).start()
+    router = Router(RoutingEngine([Rule("all", sinks=["default"])]), backend)
+    watch = SilenceWatch(runner, lambda: router.sources.values(), router.suspend, hangover_seconds=hangover_seconds)
+    loopbacks = lambda: sum(name == "module-loopback" for name, _ in runner.modules.values())  # noqa: E731
+
+    macs = list(adapters[0].devices)
+    await runner.run(["bluetoothctl"], input="".join(f"connect {mac}\n" for mac in macs))
+    await backend.wait_for(lambda: len(backend.bluetooth_sources()) == phones or None)
+    for mac in macs:
+        await router.connect(mac)
+    sources = list(router.sources.values())
+    for source in sources:
+        runner.levels[source] = 0.1
+    task = asyncio.ensure_future(watch.run())
+    await asyncio.sleep(0.5)
+    playing = loopbacks()
+
+    for source in sources:
+        runner.levels[source] = 0.0
+    quiet = time.perf_counter()
+    while not router.suspended or loopbacks():
+        await asyncio.sleep(0.01)
+    suspend_after = time.perf_counter() - quiet
+    suspended = loopbacks()
+
+    runner.levels[sources[0]] = 0.1
+    sound = time.perf_counter()
+    while router.suspended or loopbacks() < phones:
+        await asyncio.sleep(0.005)
+    resume_after = time.perf_counter() - sound
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    backend.close()
+    return {"loopbacks": (playing, suspended, loopbacks()), "suspend_after": suspend_after,
+            "resume_ms": resume_after * 1000, "hangover": hangover_seconds, "block_ms": 1000 * watch.block_frames / watch.rate}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Silence detection for the capture path")
+    parser.add_argument("--benchmark", action="store_true", help="suspend/resume timing and per-block cost")
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    result = benchmark()
+    for event, at in result["events"]:
+        print(f"{event:>8} at {at:6.2f} s")
+    print(f"suspended: {result['suspended_seconds']:.1f} s")
+    print(f"cost:      detector {result['detector_us']:.1f} us/block, "
+          f"loudness stage {result['stage_us']:.1f} us/block ({result['block_ms']:.0f} ms blocks)")
+    # Sound stops at 20 s (suspend 5 s later) and returns at 80 s (resume on that very block)
+    expected = [("suspend", 25.0), ("resume", 80.0)]
+    ok = len(result["events"]) == 2 and all(
+        event == want and math.isclose(at, when, abs_tol=result["block_ms"] / 1000 + 1e-9)
+        for (event, at), (want, when) in zip(result["events"], expected))
+
+    routes = asyncio.run(route_benchmark())
+    playing, suspended, restored = routes["loopbacks"]
+    print(f"routes:    loopbacks {playing} -> {suspended} after {routes['suspend_after']:.2f} s of silence "
+          f"(hangover {routes['hangover']:.0f} s), {restored} again {routes['resume_ms']:.0f} ms after sound "
+          f"({routes['block_ms']:.0f} ms watch blocks)")
+    ok = ok and playing == restored > 0 and suspended == 0
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
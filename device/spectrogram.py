@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Spectrogram
+Rolling time x log-frequency history of the output, rendered to an image only when asked for
+"""
+
+import argparse
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from spectrum import LogBands
+
+RANGE_DB = 90.0
+# Dark blue -> purple -> orange -> pale yellow, interpolated to 256 entries
+_ANCHORS = [(0.0, (0, 0, 4)), (0.25, (59, 15, 112)), (0.5, (140, 41, 129)),
+            (0.75, (241, 96, 93)), (1.0, (252, 253, 191))]
+
+
+def _palette():
+    positions = np.linspace(0.0, 1.0, 256)
+    anchors = np.array([position for position, _ in _ANCHORS])
+    colours = np.array([colour for _, colour in _ANCHORS], dtype=np.float64)
+    lut = np.empty((256, 4), dtype=np.uint8)
+    for channel in range(3):
+        lut[:, channel] = np.round(np.interp(positions, anchors, colours[:, channel]))
+    lut[:, 3] = 255
+    return lut
+
+
+PALETTE = _palette()
+
+
+def encode_png(rgba):
+    """(height, width, 4) uint8 -> PNG bytes (no filtering, zlib level 1: fast, still compact)"""
+    height, width, _ = rgba.shape
+    rows = np.zeros((height, 1 + width * 4), dtype=np.uint8)  # leading 0 = filter type None
+    rows[:, 1:] = rgba.reshape(height, -1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows.tobytes(), 1))
+            + chunk(b"IEND", b""))
+
+
+class Spectrogram:
+    """Circular (columns, bands) uint8 history; adding a column is a copy into a preallocated row
+
+    Nothing is rendered until image() is called, and the image is cached until the next column
+    arrives, so a box nobody is looking at only pays for add().
+    """
+
+    def __init__(self, seconds=30.0, column_rate=20.0, bands=128):
+        self.seconds = seconds
+        self.column_rate = column_rate
+        self.bands = bands
+        self.columns = int(seconds * column_rate)
+        self._history = np.zeros((self.columns, bands), dtype=np.uint8)
+        self._bands = LogBands(bands)
+        self._next = 0       # row the next column goes into
+        self.written = 0     # columns added since start
+        self._cache = {}     # format -> (written, image)
+        self.renders = 0
+
+    def add(self, spectrum_db=None, bin_hz=None):
+        """One column from a linear dB spectrum; None adds a silent column (nothing was playing)"""
+        row = self._history[self._next]
+        if spectrum_db is None:
+            row.fill(0)
+        else:
+            band_db = self._bands(spectrum_db, bin_hz)
+            np.clip(np.round((band_db + RANGE_DB) * (255 / RANGE_DB)), 0, 255, out=band_db)
+            row[:] = band_db
+        self._next = (self._next + 1) % self.columns
+        self.written += 1
+
+    def repeat(self):
+        """Copy the previous column, for a tick on which the analysis had nothing new yet"""
+        self._history[self._next] = self._history[self._next - 1]
+        self._next = (self._next + 1) % self.columns
+        self.written += 1
+
+    def ordered(self):
+        """(columns, bands) with the oldest column first"""
+        if self.written < self.columns:
+            return self._history[:self._next]
+        return np.concatenate([self._history[self._next:], self._history[:self._next]])
+
+    def image(self, fmt="png"):
+        """Oldest column on the left, highest band at the top; "png" bytes or an (h, w, 4) "rgba" array"""
+        cached = self._cache.get(fmt)
+        if cached and cached[0] == self.written:
+            return cached[1]
+        rgba = PALETTE[self.ordered().T[::-1]]
+        self.renders += 1
+        image = encode_png(rgba) if fmt == "png" else rgba
+        self._cache[fmt] = (self.written, image)
+        return image
+
+
+def benchmark(seconds=30.0, column_rate=20.0, bands=128, requests=50):
+    rng = np.random.default_rng(7)
+    spectrogram = Spectrogram(seconds, column_rate, bands)
+    spectra = [rng.normal(-60, 10, 512).astype(np.float32) for _ in range(16)]
+    columns = spectrogram.columns * 2
+    started = time.perf_counter()
+    for index in range(columns):
+        spectrogram.add(spectra[index % len(spectra)] if index % 50 else None, 43.07)
+    add_us = (time.perf_counter() - started) / columns * 1e6
+
+    timings = {}
+    for fmt in ("rgba", "png"):
+        started = time.perf_counter()
+        image = spectrogram.image(fmt)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(requests):
+            spectrogram.image(fmt)
+        cached = (time.perf_counter() - started) / requests
+        timings[fmt] = (first, cached, len(image) if fmt == "png" else image.nbytes)
+    renders = spectrogram.renders
+    spectrogram.add(spectra[0], 43.07)
+    spectrogram.image("png")
+    return {
+        "add_us": add_us, "columns": spectrogram.columns, "bands": bands, "timings": timings,
+        "renders_before_new_column": renders, "renders_after_new_column": spectrogram.renders,
+        "memory": spectrogram._history.nbytes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rolling spectrogram with on-demand rendering")
+    parser.add_argument("--benchmark", action="store_true", help="column cost, render cost, caching")
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    result = benchmark()
+    print(f"history:  {result['columns']} columns x {result['bands']} bands, {result['memory']} bytes preallocated")
+    print(f"add:      {result['add_us']:.1f} us per column")
+    for fmt, (first, cached, size) in result["timings"].items():
+        print(f"{fmt}:     {first * 1000:6.2f} ms to render ({size} bytes), {cached * 1e6:.1f} us when cached")
+    print(f"renders:  {result['renders_before_new_column']} for 2 x 51 requests, "
+          f"{result['renders_after_new_column']} after one new column")
+    return 0 if result["renders_before_new_column"] == 2 and result["renders_after_new_column"] == 3 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Spectrum
+Waveform and spectrum of the output at display rate, published in a shared-memory record
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from shared_record import SharedRecordReader, SharedRecordWriter, default_path
+
+DEFAULT_SPECTRUM_FILE = default_path("bluetooth_speaker_spectrum")
+MAGIC = b"BTSP"
+VERSION = 1
+FLAG_SUSPENDED = 1
+FLOOR_DB = -120.0
+
+# sample rate, FFT size, waveform length, spectrum bins, frames analysed, wall-clock time
+SUMMARY = struct.Struct("<IIIIQd")
+
+
+class SpectrumAnalyzer:
+    """Pipeline stage: keeps the last `fft_size` mono samples and analyses them `rate_hz` times a second
+
+    Blocks in between only go into the ring buffer, so the FFT costs the same whatever the
+    block size is. The spectrum is Hann-windowed power in dBFS (a full-scale sine reads 0 dB),
+    pooled down to `bins` linear bands from DC up; the waveform is the newest samples.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, path=DEFAULT_SPECTRUM_FILE, fft_size=2048,
+                 waveform_length=1024, bins=512, rate_hz=30.0):
+        if (fft_size // 2) % bins:
+            raise ValueError("bins must divide fft_size / 2")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.fft_size = fft_size
+        self.waveform_length = waveform_length
+        self.bins = bins
+        self.interval = max(1, int(sample_rate / rate_hz))
+        self._ring = np.zeros(fft_size, dtype=np.float32)
+        self._position = 0
+        self._pending = 0
+        self._window = np.hanning(fft_size).astype(np.float32)
+        # Full-scale sine -> 0 dB once its window-widened main lobe (ENBW 1.5 bins) is summed
+        self._scale = (4.0 / fft_size) ** 2 / 1.5
+        self.frames = 0
+        self.waveform = np.zeros(waveform_length, dtype=np.float32)
+        self.spectrum = np.full(bins, FLOOR_DB, dtype=np.float32)
+        self.flags = 0
+        self._record = None
+        if path:
+            self._record = SharedRecordWriter(path, MAGIC, VERSION,
+                                              SUMMARY.size + 4 * (waveform_length + bins))
+            self._publish()
+
+    def process(self, block):
+        mono = block.mean(axis=1, dtype=np.float32) if block.ndim > 1 else block
+        if len(mono) >= self.fft_size:
+            self._ring[:] = mono[-self.fft_size:]
+            self._position = 0
+        else:
+            end = self._position + len(mono)
+            first = min(end, self.fft_size) - self._position
+            self._ring[self._position:self._position + first] = mono[:first]
+            self._ring[:len(mono) - first] = mono[first:]
+            self._position = end % self.fft_size
+        self._pending += len(mono)
+        if self._pending >= self.interval:
+            self._pending %= self.interval
+            self.analyse()
+        return block
+
+    def analyse(self):
+        ordered = np.concatenate([self._ring[self._position:], self._ring[:self._position]])
+        self.waveform = ordered[-self.waveform_length:]
+        spectrum = np.fft.rfft(ordered * self._window)
+        power = (spectrum.real[:-1] ** 2 + spectrum.imag[:-1] ** 2).reshape(self.bins, -1).sum(axis=1)
+        self.spectrum = (10 * np.log10(power * self._scale + 1e-12)).astype(np.float32)
+        np.maximum(self.spectrum, FLOOR_DB, out=self.spectrum)
+        self.frames += 1
+        self._publish()
+
+    def _publish(self):
+        if self._record is None:
+            return
+        record = self._record
+        record.flags = self.flags
+        record.begin()
+        record.pack(SUMMARY, 0, self.sample_rate, self.fft_size, self.waveform_length, self.bins,
+                    self.frames, time.time())
+        record.write(SUMMARY.size, self.waveform)
+        record.write(SUMMARY.size + 4 * self.waveform_length, self.spectrum)
+        record.end()
+
+    def suspend(self):
+        self.waveform = np.zeros(self.waveform_length, dtype=np.float32)
+        self.spectrum = np.full(self.bins, FLOOR_DB, dtype=np.float32)
+        self._ring.fill(0.0)
+        self.flags |= FLAG_SUSPENDED
+        self._publish()
+
+    def resume(self):
+        self.flags &= ~FLAG_SUSPENDED
+
+    def close(self):
+        if self._record is not None:
+            self._record.close()
+
+
+class LogBands:
+    """Pools a linear dB spectrum into log-spaced bands (power average within each band)"""
+
+    def __init__(self, bands=128, low_hz=20.0):
+        self.bands = bands
+        self.low_hz = low_hz
+        self._weights = None
+        self._layout = None
+
+    def edges(self, bin_hz, linear_bins):
+        """Band edges in linear-bin units, from low_hz to the top of the spectrum"""
+        high_hz = bin_hz * linear_bins
+        return self.low_hz * (high_hz / self.low_hz) ** (np.arange(self.bands + 1) / self.bands) / bin_hz
+
+    def _matrix(self, bin_hz, linear_bins):
+        """(bands, linear_bins) averaging weights; bands narrower than a bin take that bin"""
+        edges = self.edges(bin_hz, linear_bins)
+        weights = np.zeros((self.bands, linear_bins), dtype=np.float32)
+        for band in range(self.bands):
+            low, high = edges[band], max(edges[band + 1], edges[band] + 1e-9)
+            for index in range(int(low), min(linear_bins, int(np.ceil(high)))):
+                weights[band, index] = max(0.0, min(high, index + 1) - max(low, index))
+            weights[band] /= weights[band].sum() or 1.0
+        return weights
+
+    def __call__(self, spectrum_db, bin_hz):
+        layout = (len(spectrum_db), bin_hz)
+        if layout != self._layout:
+            self._weights = self._matrix(bin_hz, len(spectrum_db))
+            self._layout = layout
+        power = 10 ** (spectrum_db.astype(np.float32) / 10)
+        return 10 * np.log10(self._weights @ power + 1e-12)
+
+
+class SpectrumReader:
+    """Read-only view of the spectrum record"""
+
+    def __init__(self, path=DEFAULT_SPECTRUM_FILE):
+        self._record = SharedRecordReader(path, MAGIC, VERSION)
+
+    @property
+    def sequence(self):
+        return self._record.sequence
+
+    def read(self):
+        """Consistent snapshot as a dict (NumPy arrays for the data), or None"""
+        snapshot = self._record.snapshot()
+        if snapshot is None:
+            return None
+        flags, sequence, data = snapshot
+        sample_rate, fft_size, waveform_length, bins, frames, stamp = SUMMARY.unpack_from(data, 0)
+        waveform = np.frombuffer(data, dtype=np.float32, count=waveform_length, offset=SUMMARY.size)
+        spectrum = np.frombuffer(data, dtype=np.float32, count=bins, offset=SUMMARY.size + 4 * waveform_length)
+        return {
+            "sequence": sequence,
+            "sample_rate": sample_rate,
+            "fft_size": fft_size,
+            "frames": frames,
+            "suspended": bool(flags & FLAG_SUSPENDED),
+            "age_seconds": time.time() - stamp,
+            "waveform": waveform,
+            "spectrum": spectrum,
+            "bin_hz": sample_rate / fft_size * (fft_size // 2 // bins),
+        }
+
+    def close(self):
+        self._record.close()
+
+
+def benchmark(sample_rate=44100, block_ms=10.0, seconds=30.0, tone_hz=1000.0):
+    """Per-block cost of the stage and where a -6 dBFS tone shows up in the published spectrum"""
+    import tempfile
+
+    block_frames = int(sample_rate * block_ms / 1000)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = (0.5 * np.sin(2 * np.pi * tone_hz * t)).astype(np.float32)
+    signal = np.stack([tone, tone], axis=1)
+    with tempfile.TemporaryDirectory() as directory:
+        analyzer = SpectrumAnalyzer(sample_rate, 2, os.path.join(directory, "spectrum"))
+        count = len(signal) // block_frames
+        started = time.perf_counter()
+        for index in range(count):
+            analyzer.process(signal[index * block_frames:(index + 1) * block_frames])
+        per_block = (time.perf_counter() - started) / count
+        reader = SpectrumReader(os.path.join(directory, "spectrum"))
+        snapshot = reader.read()
+        reader.close()
+        analyzer.close()
+    peak = int(np.argmax(snapshot["spectrum"]))
+    return {
+        "stage_us": per_block * 1e6, "block_ms": block_ms, "frames": snapshot["frames"],
+        "frame_rate": snapshot["frames"] / seconds,
+        "peak_hz": (peak + 0.5) * snapshot["bin_hz"], "peak_db": float(snapshot["spectrum"][peak]),
+        "bin_hz": snapshot["bin_hz"], "tone_hz": tone_hz,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Waveform/spectrum analysis for the visualization bridge")
+    parser.add_argument("--benchmark", action="store_true", help="stage cost and tone accuracy")
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    result = benchmark()
+    print(f"stage:    {result['stage_us']:.1f} us per {result['block_ms']:.0f} ms block, "
+          f"{result['frame_rate']:.1f} spectra/s published")
+    print(f"tone:     {result['tone_hz']:.0f} Hz at -6 dBFS -> peak band {result['peak_hz']:.0f} Hz "
+          f"({result['bin_hz']:.1f} Hz bands) at {result['peak_db']:.1f} dB")
+    ok = abs(result["peak_hz"] - result["tone_hz"]) <= result["bin_hz"] and abs(result["peak_db"] + 6) < 1.5
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Golden-file check for the bluetoothctl/pactl/pw-dump parsers and the btsnoop analyzer
+Run with --update to regenerate the expected JSON after an intentional parser change
+"""
+
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import btsnoop
+import pipewire_graph
+import tool_parsers
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+# Golden input file prefix -> parser
+CASES = {
+    "bluetoothctl_devices": tool_parsers.parse_devices,
+    "bluetoothctl_session": tool_parsers.parse_devices,
+    "bluetoothctl_info": tool_parsers.parse_device_info,
+    "bluetoothctl_show": tool_parsers.parse_controller_info,
+    "bluetoothctl_list": tool_parsers.parse_controller_list,
+    "pactl_short_sinks": tool_parsers.parse_pactl_short,
+    "pactl_short_modules": tool_parsers.parse_pactl_modules,
+    "pactl_list_sinks": tool_parsers.parse_pactl_list,
+    "pactl_list_sink_inputs": tool_parsers.parse_pactl_list,
+    "pactl_json_sinks": lambda text: tool_parsers.parse_pactl_json(text, "sink"),
+    "pactl_subscribe": tool_parsers.parse_pactl_subscribe,
+    "pactl_info": tool_parsers.parse_pactl_info,
+    # A snapshot followed by three monitor updates (state change, removal, metadata key cleared)
+    "pw_dump_monitor": pipewire_graph.parse_pw_dump,
+}
+
+# Golden binary capture prefix -> analyzer taking the path. The captures are synthetic, from
+# btsnoop.make_fixture: monitor = (5, snaplen=40); h4 = (3, link_type=1002, setup=False,
+# fragment=200, snaplen=40, gaps=((1.0, 0.2),), lost=(50, 51), duplicates=())
+CAPTURE_CASES = {
+    "btsnoop_monitor": btsnoop.analyze,
+    "btsnoop_h4": btsnoop.analyze,
+}
+
+
+def results():
+    """(case, actual JSON-ready output) for every golden input"""
+    for case, parser in CASES.items():
+        with open(os.path.join(GOLDEN_DIR, f"{case}.txt"), newline="") as f:
+            yield case, [record.to_dict() for record in parser(f.read())]
+    for case, analyzer in CAPTURE_CASES.items():
+        yield case, analyzer(os.path.join(GOLDEN_DIR, f"{case}.btsnoop"))
+
+
+def _summary(actual):
+    return f"{len(actual)} records" if isinstance(actual, list) else f"{len(actual['streams'])} streams"
+
+
+def check(update=False):
+    failures = 0
+    for case, actual in results():
+        expected_path = os.path.join(GOLDEN_DIR, f"{case}.expected.json")
+
+        if update:
+            with open(expected_path, "w") as f:
+                json.dump(actual, f, indent=2)
+                f.write("\n")
+            print(f"📝 {case}: {_summary(actual)} written")
+            continue
+
+        with open(expected_path) as f:
+            expected = json.load(f)
+        if actual == expected:
+            print(f"✅ {case}: {_summary(actual)}")
+        else:
+            failures += 1
+            print(f"❌ {case}: output differs from {os.path.basename(expected_path)}")
+            print(json.dumps(actual, indent=2))
+    return failures
+
+
+if __name__ == "__main__":
+    print("🧪 Checking parsers against the golden corpus...")
+    print("=" * 50)
+    failures = check(update="--update" in sys.argv)
+    print("=" * 50)
+    sys.exit(1 if failures else 0)
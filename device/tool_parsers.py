@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Tool Output Parsers
+Turns bluetoothctl and pactl output into typed records in a single streaming pass
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+
+MAC = r"[0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5}"
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|[\x01\x02\r]")
+PROMPT = re.compile(r"^(?:\[[^\]\n]*\][#>] ?)+")
+EVENT = re.compile(r"^\[(?:NEW|CHG|DEL)\] ")
+DEVICE_LINE = re.compile(rf"^Device ({MAC}) (.*)$")
+DEVICE_HEADER = re.compile(rf"^Device ({MAC})(?: \((?:public|random)\))?$")
+CONTROLLER_LINE = re.compile(rf"^Controller ({MAC}) (.*?)( \[default\])?$")
+CONTROLLER_HEADER = re.compile(rf"^Controller ({MAC})(?: \((?:public|random)\))?$")
+PULSE_HEADER = re.compile(r"^(Sink|Source|Card|Module|Sink Input|Source Output|Client) #(\d+)$")
+UUID_VALUE = re.compile(r"^(.*?)\s*\(([0-9a-fA-F-]{36})\)$")
+PAREN_NUMBER = re.compile(r"\((-?\d+)\)$")
+USEC = re.compile(r"^(-?\d+) usec")
+PULSE_EVENT = re.compile(r"^Event '([\w-]+)' on ([\w-]+) #(-?\d+)$")
+
+
+class Record:
+    """Base for parsed records: slot-based, comparable and JSON-friendly"""
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for slot in self.__slots__:
+            setattr(self, slot, fields.get(slot))
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        fields = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Device(Record):
+    """One line of `bluetoothctl devices [filter]`"""
+    __slots__ = ("mac", "name")
+
+
+class DeviceInfo(Record):
+    """One `bluetoothctl info <mac>` block"""
+    __slots__ = ("mac", "name", "alias", "icon", "device_class", "paired", "bonded", "trusted",
+                 "blocked", "connected", "uuids", "rssi", "battery")
+
+
+class Controller(Record):
+    """One `bluetoothctl show` block or one `bluetoothctl list` line"""
+    __slots__ = ("address", "name", "alias", "device_class", "powered", "discoverable", "pairable",
+                 "discovering", "uuids", "is_default")
+
+
+class PulseEntry(Record):
+    """One line of `pactl list short sinks|sources`"""
+    __slots__ = ("index", "name", "driver", "sample_spec", "state")
+
+
+class PulseModule(Record):
+    """One line of `pactl list short modules`"""
+    __slots__ = ("index", "name", "argument")
+
+
+class PulseEvent(Record):
+    """One line of `pactl subscribe`"""
+    __slots__ = ("event", "facility", "index")
+
+
+class PulseServer(Record):
+    """The fields of `pactl info` that routing needs"""
+    __slots__ = ("name", "version", "default_sink", "default_source")
+
+
+class PulseObject(Record):
+    """One block of `pactl list sinks|sources|cards|modules` (text or `-f json`)"""
+    __slots__ = ("kind", "index", "name", "description", "driver", "state", "sample_spec",
+                 "owner_module", "argument", "properties", "ports", "active_port", "latency_usec")
+
+
+def iter_lines(source):
+    """Accept a string or any iterable of lines; drop colour codes and interactive prompts"""
+    lines = source.splitlines() if isinstance(source, str) else source
+    for line in lines:
+        if "\x1b" in line or "\r" in line or "\x01" in line:
+            line = ANSI_ESCAPE.sub("", line)
+        if line.startswith("["):
+            line = PROMPT.sub("", line)
+        yield line.rstrip("\n")
+
+
+def yes_no(value):
+    return value.strip() == "yes"
+
+
+# ---------------------------------------------------------------- bluetoothctl
+
+def parse_devices(source):
+    """Yield Device for every `Device <mac> <name>` listing line (events are skipped)"""
+    for line in iter_lines(source):
+        if EVENT.match(line):
+            continue
+        match = DEVICE_LINE.match(line)
+        if match:
+            yield Device(mac=match.group(1).upper(), name=match.group(2))
+
+
+def parse_controller_list(source):
+    """Yield Controller for every `bluetoothctl list` line"""
+    for line in iter_lines(source):
+        if EVENT.match(line):
+            continue
+        match = CONTROLLER_LINE.match(line)
+        if match:
+            yield Controller(address=match.group(1).upper(), name=match.group(2),
+                             is_default=bool(match.group(3)), uuids=[])
+
+
+def _blocks(source, header):
+    """Split indented key/value blocks that start at a `header` match, in one pass"""
+    current = None
+    for line in iter_lines(source):
+        if not line:
+            continue
+        if not line[0].isspace():
+            if current is not None:
+                yield current
+                current = None
+            match = header.match(line)
+            if match and not EVENT.match(line):
+                current = (match, [])
+            continue
+        if current is not None:
+            key, sep, value = line.strip().partition(": ")
+            if not sep and key.endswith(":"):
+                key, value = key[:-1], ""
+            current[1].append((key, value))
+    if current is not None:
+        yield current
+
+
+def _uuid(value):
+    match = UUID_VALUE.match(value)
+    return {"name": match.group(1), "uuid": match.group(2).lower()} if match else {"name": value, "uuid": None}
+
+
+def parse_device_info(source):
+    """Yield DeviceInfo for every `Device <mac> (public)` block"""
+    for match, fields in _blocks(source, DEVICE_HEADER):
+        record = DeviceInfo(mac=match.group(1).upper(), uuids=[])
+        for key, value in fields:
+            if key in ("Name", "Alias", "Icon"):
+                setattr(record, key.lower(), value)
+            elif key == "Class":
+                record.device_class = value.split()[0]
+            elif key in ("Paired", "Bonded", "Trusted", "Blocked", "Connected"):
+                setattr(record, key.lower(), yes_no(value))
+            elif key == "UUID":
+                record.uuids.append(_uuid(value))
+            elif key == "RSSI":
+                number = PAREN_NUMBER.search(value)
+                try:
+                    record.rssi = int(number.group(1) if number else value.split()[0])
+                except (ValueError, IndexError):
+                    record.rssi = None
+            elif key == "Battery Percentage":
+                number = PAREN_NUMBER.search(value)
+                record.battery = int(number.group(1)) if number else None
+        yield record
+
+
+def parse_controller_info(source):
+    """Yield Controller for every `bluetoothctl show` block"""
+    for match, fields in _blocks(source, CONTROLLER_HEADER):
+        record = Controller(address=match.group(1).upper(), uuids=[])
+        for key, value in fields:
+            if key in ("Name", "Alias"):
+                setattr(record, key.lower(), value)
+            elif key == "Class":
+                record.device_class = value.split()[0]
+            elif key in ("Powered", "Discoverable", "Pairable", "Discovering"):
+                setattr(record, key.lower(), yes_no(value))
+            elif key == "UUID":
+                record.uuids.append(_uuid(value))
+        yield record
+
+
+# ---------------------------------------------------------------------- pactl
+
+def parse_pactl_short(source):
+    """Yield PulseEntry for `pactl list short sinks|sources` lines"""
+    for line in iter_lines(source):
+        parts = line.split("\t")
+        if len(parts) >= 2 and parts[0].isdigit():
+            parts += [None] * (5 - len(parts))
+            yield PulseEntry(index=int(parts[0]), name=parts[1], driver=parts[2],
+                             sample_spec=parts[3], state=parts[4])
+
+
+def parse_pactl_modules(source):
+    """Yield PulseModule for `pactl list short modules` lines"""
+    for line in iter_lines(source):
+        parts = line.split("\t")
+        if len(parts) >= 2 and parts[0].isdigit():
+            yield PulseModule(index=int(parts[0]), name=parts[1],
+                              argument=parts[2] if len(parts) > 2 else "")
+
+
+def parse_pactl_subscribe(source):
+    """Yield PulseEvent for `pactl subscribe` lines (index -1 is the server itself)"""
+    for line in iter_lines(source):
+        match = PULSE_EVENT.match(line.strip())
+        if match:
+            yield PulseEvent(event=match.group(1), facility=match.group(2), index=int(match.group(3)))
+
+
+def parse_pactl_info(source):
+    """Yield one PulseServer from `pactl info`"""
+    fields = {}
+    for line in iter_lines(source):
+        key, sep, value = line.partition(":")
+        if sep:
+            fields[key.strip()] = value.strip()
+    if fields:
+        yield PulseServer(name=fields.get("Server Name"), version=fields.get("Server Version"),
+                          default_sink=fields.get("Default Sink"), default_source=fields.get("Default Source"))
+
+
+PULSE_KINDS = {
+    "Sink": "sink", "Source": "source", "Card": "card", "Module": "module",
+    "Sink Input": "sink-input", "Source Output": "source-output", "Client": "client",
+}
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def parse_pactl_list(source):
+    """Yield PulseObject for every block of the long `pactl list ...` text output"""
+    record = None
+    section = None
+    for line in iter_lines(source):
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            if record is not None:
+                yield record
+            match = PULSE_HEADER.match(line)
+            record = None
+            if match:
+                record = PulseObject(kind=PULSE_KINDS[match.group(1)], index=int(match.group(2)),
+                                     properties={}, ports=[])
+            section = None
+            continue
+        if record is None:
+            continue
+
+        depth = len(line) - len(line.lstrip("\t"))
+        text = line.strip()
+        if depth >= 2 and section == "Properties":
+            key, sep, value = text.partition(" = ")
+            if sep:
+                record.properties[key] = _unquote(value)
+            continue
+        if depth >= 2 and section == "Ports":
+            port, sep, _ = text.partition(": ")
+            if sep:
+                record.ports.append(port)
+            continue
+        if depth >= 2 or not text or line.startswith("\t "):
+            # Continuation lines (e.g. volume balance) and unknown nested sections
+            continue
+
+        key, sep, value = text.partition(": ")
+        if not sep and text.endswith(":"):
+            section = text[:-1]
+            continue
+        section = None
+        if key == "Name":
+            record.name = value
+        elif key == "Description":
+            record.description = value
+        elif key == "Driver":
+            record.driver = value
+        elif key == "State":
+            record.state = value
+        elif key == "Sample Specification":
+            record.sample_spec = value
+        elif key == "Owner Module":
+            record.owner_module = _owner_module(value)
+        elif key == "Argument":
+            record.argument = value
+        elif key == "Active Port" or key == "Active Profile":
+            record.active_port = value
+        elif key in ("Latency", "Buffer Latency", "Sink Latency", "Source Latency"):
+            # A sink's or source's own latency; for a stream, its buffer plus its device's
+            usec = USEC.match(value)
+            if usec:
+                record.latency_usec = (record.latency_usec or 0) + int(usec.group(1))
+    if record is not None:
+        yield record
+
+
+PA_INVALID_INDEX = 4294967295
+
+
+def _owner_module(value):
+    """pactl reports "no owner" as PA_INVALID_INDEX; map that to None"""
+    value = str(value if value is not None else "")
+    return int(value) if value.isdigit() and int(value) != PA_INVALID_INDEX else None
+
+
+def parse_pactl_json(text, kind):
+    """Yield PulseObject from `pactl -f json list <kind>` output (PulseAudio 16+/pipewire-pulse)"""
+    for item in json.loads(text):
+        ports = item.get("ports") or []
+        latency = item.get("latency")
+        if isinstance(latency, dict):
+            latency_usec = latency.get("actual")
+        elif "buffer_latency_usec" in item:
+            latency_usec = item["buffer_latency_usec"] + (item.get("sink_latency_usec") or
+                                                         item.get("source_latency_usec") or 0)
+        else:
+            latency_usec = None
+        yield PulseObject(
+            kind=kind,
+            index=item.get("index"),
+            name=item.get("name"),
+            description=item.get("description"),
+            driver=item.get("driver"),
+            state=item.get("state"),
+            sample_spec=item.get("sample_specification"),
+            owner_module=_owner_module(item.get("owner_module")),
+            argument=item.get("argument"),
+            properties=dict(item.get("properties") or {}),
+            ports=[port["name"] if isinstance(port, dict) else port for port in ports],
+            active_port=item.get("active_port") or item.get("active_profile"),
+            latency_usec=latency_usec,
+        )
+
+
+PARSERS = {
+    "devices": parse_devices,
+    "info": parse_device_info,
+    "show": parse_controller_info,
+    "list": parse_controller_list,
+    "pactl-short": parse_pactl_short,
+    "pactl-modules": parse_pactl_modules,
+    "pactl-list": parse_pactl_list,
+    "pactl-subscribe": parse_pactl_subscribe,
+    "pactl-info": parse_pactl_info,
+}
+
+
+def benchmark(repeat=5):
+    """Parse synthetic outputs of realistic shape and report throughput per parser"""
+    devices = "".join(f"Device AC:37:43:{i // 65536 % 256:02X}:{i // 256 % 256:02X}:{i % 256:02X} Phone  {i}\n"
+                      for i in range(20000))
+    info = "".join(
+        f"Device AC:37:43:00:{i // 256:02X}:{i % 256:02X} (public)\n\tName: Phone {i}\n\tAlias: Phone {i}\n"
+        f"\tClass: 0x005a020c\n\tIcon: phone\n\tPaired: yes\n\tTrusted: yes\n\tBlocked: no\n"
+        f"\tConnected: {'yes' if i % 2 else 'no'}\n"
+        f"\tUUID: Audio Source              (0000110a-0000-1000-8000-00805f9b34fb)\n"
+        f"\tUUID: A/V Remote Control        (0000110e-0000-1000-8000-00805f9b34fb)\n\tRSSI: -{i % 90}\n"
+        for i in range(5000))
+    sinks = "".join(
+        f"Sink #{i}\n\tState: SUSPENDED\n\tName: alsa_output.card{i}.analog-stereo\n"
+        f"\tDescription: Card {i}\n\tDriver: module-alsa-card.c\n\tSample Specification: s16le 2ch 44100Hz\n"
+        f"\tOwner Module: {i}\n\tVolume: front-left: 65536 / 100% / 0.00 dB,   front-right: 65536 / 100%\n"
+        f"\t        balance 0.00\n\tProperties:\n\t\tdevice.api = \"alsa\"\n\t\tdevice.class = \"sound\"\n"
+        f"\t\tdevice.description = \"Card {i}\"\n\tPorts:\n"
+        f"\t\tanalog-output-speaker: Speakers (type: Speaker, priority: 10000)\n"
+        f"\tActive Port: analog-output-speaker\n\tFormats:\n\t\tpcm\n\n"
+        for i in range(2000))
+    short = "".join(f"{i}\talsa_output.card{i}.analog-stereo\tmodule-alsa-card.c\ts16le 2ch 44100Hz\tSUSPENDED\n"
+                    for i in range(20000))
+
+    results = []
+    for label, parser, text in [
+        ("devices", parse_devices, devices),
+        ("info", parse_device_info, info),
+        ("pactl-list", parse_pactl_list, sinks),
+        ("pactl-short", parse_pactl_short, short),
+    ]:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            count = sum(1 for _ in parser(text))
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((label, count, len(text) / best / 1e6, count / best))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse bluetoothctl/pactl output into JSON records")
+    parser.add_argument("kind", nargs="?", choices=sorted(PARSERS) + ["pactl-json"])
+    parser.add_argument("--json-kind", default="sink", help="object kind for pactl-json input")
+    parser.add_argument("--benchmark", action="store_true", help="report parse throughput")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        print(f"{'parser':<12} {'records':>8} {'MB/s':>8} {'records/s':>12}")
+        for label, count, mb_per_s, records_per_s in benchmark():
+            print(f"{label:<12} {count:>8} {mb_per_s:>8.1f} {records_per_s:>12.0f}")
+        return 0
+    if not args.kind:
+        parser.error("kind is required unless --benchmark is given")
+
+    if args.kind == "pactl-json":
+        records = parse_pactl_json(sys.stdin.read(), args.json_kind)
+    else:
+        records = PARSERS[args.kind](sys.stdin)
+    json.dump([record.to_dict() for record in records], sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
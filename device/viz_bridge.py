@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Visualization Bridge
+Pushes waveform, spectrum and level frames from the pipeline to browsers over WebSocket or SSE
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import signal
+import socket
+import statistics
+import sys
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+
+from bluetooth_daemon import DEFAULT_CONFIG, load_config, log
+from levels import DEFAULT_LEVELS_FILE, LevelReader, to_db
+from spectrogram import Spectrogram
+from spectrum import DEFAULT_SPECTRUM_FILE, SpectrumReader
+from viz_frames import FrameEncoder
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+SPECTRUM_RANGE_DB = 90.0  # bars are scaled from -90 dBFS (empty) to 0 dBFS (full height)
+
+
+def websocket_accept(key):
+    return base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+
+
+def websocket_frame(payload, opcode=0x1):
+    """Unmasked server -> client frame (FIN set)"""
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+    return header + payload
+
+
+def _db(level):
+    value = to_db(level)
+    return round(value, 1) if math.isfinite(value) else None
+
+
+class Viewer:
+    __slots__ = ("writer", "websocket", "binary", "sent", "dropped", "last_sequence")
+
+    def __init__(self, writer, websocket, binary=False):
+        self.writer = writer
+        self.websocket = websocket
+        self.binary = binary
+        self.sent = 0
+        self.dropped = 0
+        self.last_sequence = None  # binary frame it has, so the next may be a delta
+
+
+class VisualizationBridge:
+    """One reader of the pipeline's shared records, any number of browsers
+
+    Each frame is encoded once per format and the same bytes are handed to every viewer of that
+    format. A viewer whose socket still holds more than `high_water` unsent bytes skips frames
+    until it catches up, so a slow browser costs nothing but its own frame rate. Binary viewers
+    (/ws?format=binary, see viz_frames.py) get delta frames while they keep up, keyframes after
+    a skip.
+    """
+
+    def __init__(self, spectrum_file=DEFAULT_SPECTRUM_FILE, levels_file=DEFAULT_LEVELS_FILE, host="0.0.0.0",
+                 port=8765, frame_rate=20.0, max_viewers=200, high_water=64 * 1024, encoder=None,
+                 spectrogram=None, spectrum_rate=30.0):
+        self.spectrum_file = spectrum_file
+        self.levels_file = levels_file
+        self.host = host
+        self.port = port
+        self.frame_rate = frame_rate
+        self.max_viewers = max_viewers
+        self.high_water = high_water
+        self.viewers = set()
+        self.encoder = encoder or FrameEncoder()
+        self.spectrogram = spectrogram or Spectrogram()
+        self.spectrum_rate = spectrum_rate  # how often the pipeline analyses, [pipeline] spectrum_rate
+        self._history_seen = None
+        self._history_at = None  # loop time the last new spectrum reached the history
+        self.latest = None  # last encoded JSON payload, also served by /api/data
+        self.binary_bytes = 0
+        self._snapshot = None
+        self.frames = 0
+        self.dropped = 0
+        self._spectrum = None
+        self._levels = None
+        self._seen = None
+        self.server = None
+        self._tasks = []
+        self.stopping = asyncio.Event()
+
+    def _open_readers(self):
+        """The pipeline may start after the bridge; keep trying until its records exist"""
+        if self._spectrum is None:
+            try:
+                self._spectrum = SpectrumReader(self.spectrum_file)
+            except (OSError, ValueError):
+                pass
+        if self._levels is None:
+            try:
+                self._levels = LevelReader(self.levels_file)
+            except (OSError, ValueError):
+                pass
+
+    def encode(self, spectrum, levels):
+        """Shared-record snapshots -> JSON frame bytes, shaped like the adapter UI's /api/data"""
+        frame = {"type": "frame", "recording": True, "timestamp": int(time.time() * 1000)}
+        if spectrum:
+            frame["suspended"] = spectrum["suspended"]
+            frame["amplitude"] = np.round(spectrum["waveform"], 4).tolist()
+            bars = np.clip((spectrum["spectrum"] + SPECTRUM_RANGE_DB) / SPECTRUM_RANGE_DB, 0.0, 1.0)
+            frame["frequency"] = np.round(bars, 3).tolist()
+            frame["bin_hz"] = round(spectrum["bin_hz"], 3)
+        if levels:
+            frame["levels"] = [{"rms_db": _db(channel["rms"]), "peak_db": _db(channel["peak"]),
+                                "hold_db": _db(channel["hold"]), "clips": channel["clips"]}
+                               for channel in levels["channels"]]
+        return json.dumps(frame, separators=(",", ":")).encode()
+
+    def poll(self):
+        """Snapshot of the records if the pipeline published anything since the last one"""
+        self._open_readers()
+        seen = (self._spectrum.sequence if self._spectrum else None,
+                self._levels.sequence if self._levels else None)
+        if seen == self._seen or seen == (None, None):
+            return None
+        self._seen = seen
+        self._snapshot = (self._spectrum.read() if self._spectrum else None,
+                          self._levels.read() if self._levels else None)
+        self.latest = None
+        return self._snapshot
+
+    def latest_json(self):
+        if self.latest is None and self._snapshot is not None:
+            self.latest = self.encode(*self._snapshot)
+        return self.latest
+
+    def broadcast(self, snapshot):
+        """Hand one snapshot to every viewer; each format is encoded at most once"""
+        json_frames = binary_frames = None
+        self.frames += 1
+        for viewer in list(self.viewers):
+            transport = viewer.writer.transport
+            if transport.is_closing():
+                self.viewers.discard(viewer)
+                continue
+            if transport.get_write_buffer_size() > self.high_water:
+                viewer.dropped += 1
+                self.dropped += 1
+                continue
+            if viewer.binary:
+                if binary_frames is None:
+                    key, delta = self.encoder.encode(*snapshot)
+                    binary_frames = (websocket_frame(key, 0x2), delta and websocket_frame(delta, 0x2))
+                    self.binary_bytes = len(key)
+                key, delta = binary_frames
+                use_delta = delta and viewer.last_sequence == (self.encoder.sequence - 1) & 0xFFFFFFFF
+                transport.write(delta if use_delta else key)
+                viewer.last_sequence = self.encoder.sequence
+            else:
+                if json_frames is None:
+                    payload = self.latest_json()
+                    json_frames = (websocket_frame(payload), b"data: " + payload + b"\n\n")
+                transport.write(json_frames[0] if viewer.websocket else json_frames[1])
+            viewer.sent += 1
+
+    async def frame_loop(self):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.frame_rate
+        next_frame = loop.time()
+        while not self.stopping.is_set():
+            # Nobody watching: do not even look at the records
+            if self.viewers:
+                snapshot = self.poll()
+                if snapshot is not None:
+                    self.broadcast(snapshot)
+            next_frame += interval
+            delay = next_frame - loop.time()
+            if delay < 0:
+                next_frame = loop.time()  # fell behind; don't burst to catch up
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def history_loop(self):
+        """One spectrogram column per tick, viewers or not, so the last seconds are always there
+
+        Columns can come faster than the pipeline analyses: a tick with nothing new repeats the last
+        column, and only leaves a blank one once the spectrum is suspended or overdue.
+        """
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.spectrogram.column_rate
+        # One analysis interval, plus a tick of slack for the two clocks' phase
+        stale_after = 1.0 / self.spectrum_rate + interval
+        next_column = loop.time()
+        while not self.stopping.is_set():
+            self._open_readers()
+            sequence = self._spectrum.sequence if self._spectrum else None
+            snapshot = None
+            if sequence is not None and sequence != self._history_seen:
+                self._history_seen = sequence
+                snapshot = self._spectrum.read()
+            if snapshot is not None and not snapshot["suspended"]:
+                self.spectrogram.add(snapshot["spectrum"], snapshot["bin_hz"])
+                self._history_at = loop.time()
+            elif (snapshot is None and self._history_at is not None
+                  and loop.time() - self._history_at <= stale_after):
+                self.spectrogram.repeat()  # the next analysis is not due yet
+            else:
+                self._history_at = None
+                self.spectrogram.add(None)  # the pipeline is suspended or stalled
+            next_column += interval
+            delay = next_column - loop.time()
+            if delay < 0:
+                next_column = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "viewers": len(self.viewers),
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "frame_bytes": len(self.latest) if self.latest else 0,
+            "binary_frame_bytes": self.binary_bytes,
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        path, _, query = (parts[1] if len(parts) >= 2 else "").partition("?")
+        binary = parse_qs(query).get("format") == ["binary"]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            if path in ("/ws", "/events"):
+                await self._serve_viewer(reader, writer, path == "/ws", headers, binary)
+            elif path == "/api/data":
+                if not self.viewers:
+                    self.poll()  # the frame loop only polls while someone is watching
+                self._respond(writer, 200, self.latest_json() or b'{"recording":false}')
+            elif path == "/api/spectrogram.png":
+                self._respond(writer, 200, self.spectrogram.image("png"), "image/png")
+            elif path == "/api/spectrogram.rgba":
+                image = self.spectrogram.image("rgba")
+                self._respond(writer, 200, image.tobytes(), "application/octet-stream",
+                              {"X-Width": image.shape[1], "X-Height": image.shape[0]})
+            elif path == "/api/bridge":
+                self._respond(writer, 200, json.dumps(self.stats()).encode())
+            else:
+                self._respond(writer, 404, b'{"error":"not found"}')
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _respond(writer, status, body, content_type="application/json", extra_headers=None):
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}[status]
+        extra = "".join(f"{name}: {value}\r\n" for name, value in (extra_headers or {}).items())
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nAccess-Control-Allow-Origin: *\r\n{extra}"
+                     f"Connection: close\r\n\r\n".encode() + body)
+
+    async def _serve_viewer(self, reader, writer, websocket, headers, binary=False):
+        if len(self.viewers) >= self.max_viewers:
+            self._respond(writer, 503, b'{"error":"too many viewers"}')
+            return
+        if websocket:
+            key = headers.get("sec-websocket-key")
+            if headers.get("upgrade", "").lower() != "websocket" or not key:
+                self._respond(writer, 400, b'{"error":"websocket upgrade required"}')
+                return
+            writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n").encode())
+        else:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n")
+        viewer = Viewer(writer, websocket, binary and websocket)
+        self.viewers.add(viewer)
+        try:
+            if websocket:
+                await self._read_websocket(reader, writer)
+            else:
+                while await reader.read(1024):
+                    pass
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.viewers.discard(viewer)
+
+    @staticmethod
+    async def _read_websocket(reader, writer):
+        """Handle what browsers send: ping and close; anything else is ignored"""
+        while True:
+            head = await reader.readexactly(2)
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(await reader.readexactly(2), "big")
+            elif length == 127:
+                length = int.from_bytes(await reader.readexactly(8), "big")
+            if length > 65536:
+                return
+            mask = await reader.readexactly(4) if head[1] & 0x80 else b"\0\0\0\0"
+            data = await reader.readexactly(length)
+            if opcode == 0x8:
+                writer.write(websocket_frame(b"", 0x8))
+                return
+            if opcode == 0x9:
+                writer.write(websocket_frame(bytes(b ^ mask[i % 4] for i, b in enumerate(data)), 0xA))
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self._tasks = [asyncio.ensure_future(self.frame_loop()), asyncio.ensure_future(self.history_loop())]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        await self.start()
+        log(f"📡 Visualization bridge on {self.host}:{self.port} (/ws, /events, /api/data, "
+            f"/api/spectrogram.png), "
+            f"{self.frame_rate:.0f} frames/s")
+        await self.stopping.wait()
+        await self.close()
+        return 0
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.server.close()
+        for viewer in list(self.viewers):
+            viewer.writer.transport.abort()
+        await self.server.wait_closed()
+        while self.viewers:  # connection handlers see the abort and unregister
+            await asyncio.sleep(0.01)
+
+    @classmethod
+    def from_config(cls, config_file=DEFAULT_CONFIG):
+        config = load_config(config_file)
+        return cls(
+            spectrum_file=config.get("pipeline", "spectrum_file", fallback=DEFAULT_SPECTRUM_FILE),
+            levels_file=config.get("pipeline", "levels_file", fallback=DEFAULT_LEVELS_FILE),
+            host=config.get("bridge", "host", fallback="0.0.0.0"),
+            port=config.getint("bridge", "port", fallback=8765),
+            frame_rate=config.getfloat("bridge", "frame_rate", fallback=20.0),
+            max_viewers=config.getint("bridge", "max_viewers", fallback=200),
+            encoder=FrameEncoder(
+                width=config.getint("bridge", "waveform_width", fallback=400),
+                bands=config.getint("bridge", "spectrum_bands", fallback=128),
+                float16=config.get("bridge", "spectrum_format", fallback="uint8") == "float16"),
+            spectrogram=Spectrogram(
+                seconds=config.getfloat("bridge", "history_seconds", fallback=30.0),
+                column_rate=config.getfloat("bridge", "history_rate", fallback=20.0)),
+            spectrum_rate=config.getfloat("pipeline", "spectrum_rate", fallback=30.0),
+        )
+
+
+async def _viewer(port, counts, index, slow=None, binary=False):
+    """Minimal WebSocket client for the load test; a slow one never reads after the handshake
+    and adds its local port to the `slow` set"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if slow is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await loop.sock_connect(sock, ("127.0.0.1", port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    path = "/ws?format=binary" if binary else "/ws"
+    request = (f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+               f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode()
+    if slow is not None:
+        # Raw socket: a stream reader would keep draining the kernel buffer into memory
+        try:
+            await loop.sock_sendall(sock, request)
+            response = b""
+            while b"\r\n\r\n" not in response:
+                response += await loop.sock_recv(sock, 1024)
+            if websocket_accept(key).encode() not in response:
+                raise RuntimeError("bad handshake")
+            slow.add(sock.getsockname()[1])
+            await asyncio.Event().wait()
+        finally:
+            sock.close()
+    reader, writer = await asyncio.open_connection(sock=sock)
+    writer.write(request)
+    response = await reader.readuntil(b"\r\n\r\n")
+    if websocket_accept(key).encode() not in response:
+        raise RuntimeError("bad handshake")
+    try:
+        while True:
+            head = await reader.readexactly(2)
+            length = head[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(await reader.readexactly(2), "big")
+            elif length == 127:
+                length = int.from_bytes(await reader.readexactly(8), "big")
+            await reader.readexactly(length)
+            counts[index] += 1
+    finally:
+        writer.close()
+
+
+async def load_test(viewers=100, slow_viewers=5, seconds=10.0, frame_rate=20.0, sample_rate=44100, binary=False):
+    """Synthetic pipeline + bridge + `viewers` WebSocket clients (plus a few stalled ones) in one process"""
+    import tempfile
+
+    from levels import LevelMeter
+    from spectrum import SpectrumAnalyzer
+
+    with tempfile.TemporaryDirectory() as directory:
+        spectrum_file, levels_file = os.path.join(directory, "spectrum"), os.path.join(directory, "levels")
+        stages = [SpectrumAnalyzer(sample_rate, 2, spectrum_file), LevelMeter(sample_rate, 2, levels_file)]
+        bridge = VisualizationBridge(spectrum_file, levels_file, "127.0.0.1", 0, frame_rate,
+                                     max_viewers=viewers + slow_viewers)
+        await bridge.start()
+
+        async def feed():
+            rng = np.random.default_rng(5)
+            block = int(sample_rate * 0.02)
+            pool = [rng.normal(0, 0.2, (block, 2)).astype(np.float32) for _ in range(8)]
+            index = 0
+            while True:
+                for stage in stages:
+                    stage.process(pool[index % len(pool)])
+                index += 1
+                await asyncio.sleep(0.02)
+
+        counts = [0] * (viewers + slow_viewers)
+        slow_ports = set()
+        tasks = [asyncio.ensure_future(feed())]
+        for index in range(viewers + slow_viewers):
+            tasks.append(asyncio.ensure_future(_viewer(bridge.port, counts, index,
+                                                       slow=slow_ports if index >= viewers else None,
+                                                       binary=binary)))
+        while len(slow_ports) < slow_viewers or len(bridge.viewers) < viewers + slow_viewers:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(1.0)  # connections settle
+        # Loopback TCP would otherwise autotune megabytes of kernel buffer for the stalled
+        # viewers, hiding them for minutes; a small send buffer makes them back up at once
+        for viewer in bridge.viewers:
+            sock = viewer.writer.get_extra_info("socket")
+            if sock.getpeername()[1] in slow_ports:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        counts[:] = [0] * len(counts)
+        start_frames = bridge.frames
+        cpu, wall = time.process_time(), time.perf_counter()
+        await asyncio.sleep(seconds)
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        published = bridge.frames - start_frames
+        buffered = [viewer.writer.transport.get_write_buffer_size() for viewer in bridge.viewers]
+        stats = bridge.stats()
+        slow_dropped = [viewer.dropped for viewer in bridge.viewers
+                        if viewer.writer.get_extra_info("peername")[1] in slow_ports]
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await bridge.close()
+        for stage in stages:
+            stage.close()
+
+    received = counts[:viewers]
+    return {
+        "viewers": viewers, "slow_viewers": slow_viewers, "connected": stats["viewers"],
+        "frame_rate": published / wall,
+        "frame_bytes": stats["binary_frame_bytes"] if binary else stats["frame_bytes"],
+        "received_min": min(received) / published if published else 0.0,
+        "received_median": statistics.median(received) / published if published else 0.0,
+        "slow_dropped": slow_dropped, "max_buffered": max(buffered, default=0),
+        "cpu_percent": 100 * cpu / wall, "high_water": bridge.high_water,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Push pipeline visualization to browsers (WebSocket/SSE)")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="path to config.ini")
+    parser.add_argument("--port", type=int, help="listen port (default: [bridge] port)")
+    parser.add_argument("--load-test", type=int, metavar="VIEWERS",
+                        help="serve synthetic frames to VIEWERS local WebSocket clients and report")
+    parser.add_argument("--seconds", type=float, default=10.0, help="load test duration")
+    parser.add_argument("--binary", action="store_true", help="load test with binary frames (viz_frames.py)")
+    args = parser.parse_args(argv)
+
+    if args.load_test:
+        result = asyncio.run(load_test(args.load_test, seconds=args.seconds, binary=args.binary))
+        print(f"viewers:   {result['viewers']} + {result['slow_viewers']} stalled, "
+              f"{result['connected']} connected at the end")
+        print(f"frames:    {result['frame_rate']:.1f}/s of {result['frame_bytes']} bytes, encoded once each")
+        print(f"received:  min {100 * result['received_min']:.0f}%, "
+              f"median {100 * result['received_median']:.0f}% of published frames")
+        print(f"stalled:   dropped {result['slow_dropped']} frames, "
+              f"largest send buffer {result['max_buffered']} B (high water {result['high_water']})")
+        print(f"cpu:       {result['cpu_percent']:.0f}% of one core, clients and synthetic pipeline included")
+        # Every stalled viewer must be skipping frames, and nothing may queue up in the bridge
+        # beyond the high-water mark
+        ok = (result["received_min"] >= 0.9
+              and len(result["slow_dropped"]) == result["slow_viewers"] and min(result["slow_dropped"]) > 0
+              and result["max_buffered"] <= result["high_water"] + 2 * result["frame_bytes"] + 16)
+        return 0 if ok else 1
+
+    bridge = VisualizationBridge.from_config(args.config)
+    if args.port:
+        bridge.port = args.port
+    return asyncio.run(bridge.run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Bluetooth Speaker - Visualization Frames
+Compact binary frames for the visualization bridge: decimated waveform, quantized log spectrum
+
+Frame layout (little-endian), version 1:
+    header   magic "BV", version u8, flags u8, sequence u32, timestamp ms u64,
+             width u16, bands u16, channels u8, reserved u8
+    waveform width x (min i8, max i8), full scale = 127
+    spectrum keyframe: bands values; delta: ceil(bands / 8) byte bitmap of changed bands (LSB
+             first), then the new value of each changed band. Values are u8 (0 = -90 dBFS,
+             255 = 0 dBFS) or, with FLAG_FLOAT16, dBFS as float16
+    levels   channels x (rms u8, peak u8, hold u8 in 0.5 dB steps below full scale, clips u32)
+
+A delta frame only applies on top of frame `sequence - 1`; decoders that missed it wait for
+the next keyframe.
+"""
+
+import argparse
+import math
+import struct
+import sys
+import time
+
+import numpy as np
+
+from spectrum import LogBands
+
+MAGIC = b"BV"
+VERSION = 1
+FLAG_SUSPENDED = 1
+FLAG_DELTA = 2
+FLAG_FLOAT16 = 4
+HEADER = struct.Struct("<2sBBIQHHBB")
+LEVEL = struct.Struct("<BBBI")
+RANGE_DB = 90.0
+
+
+class FrameEncoder:
+    """Encodes snapshots of the shared records; keeps the previous spectrum for delta frames"""
+
+    def __init__(self, width=400, bands=128, float16=False, keyframe_interval=50, dead_band=None):
+        self.width = width
+        self.bands = bands
+        self.float16 = float16
+        # Change (u8 steps or dB) below which a delta leaves a band alone
+        self.dead_band = dead_band if dead_band is not None else (0.5 if float16 else 1)
+        self.keyframe_interval = keyframe_interval
+        self.sequence = 0
+        self._previous = None
+        self._bands = LogBands(bands)
+
+    def decimate(self, waveform):
+        """min/max per display column, quantized to int8"""
+        starts = (np.arange(self.width) * len(waveform)) // self.width
+        lows = np.minimum.reduceat(waveform, starts)
+        highs = np.maximum.reduceat(waveform, starts)
+        pairs = np.empty((self.width, 2), dtype=np.float32)
+        pairs[:, 0], pairs[:, 1] = lows, highs
+        return np.clip(np.round(pairs * 127), -127, 127).astype(np.int8)
+
+    def quantize_spectrum(self, spectrum_db, bin_hz):
+        band_db = self._bands(spectrum_db, bin_hz)
+        if self.float16:
+            return band_db.astype(np.float16)
+        return np.clip(np.round((band_db + RANGE_DB) * (255 / RANGE_DB)), 0, 255).astype(np.uint8)
+
+    @staticmethod
+    def _level_byte(level):
+        if level <= 0:
+            return 255
+        return int(min(255, max(0, round(-40 * math.log10(level)))))
+
+    def encode(self, spectrum, levels, delta=True):
+        """(keyframe, delta frame or None) for one snapshot pair; either may be missing data
+
+        Every call advances the sequence, so a delta only applies to the previous call's frame.
+        No delta is offered when it would not be smaller than the keyframe.
+        """
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        flags = FLAG_FLOAT16 if self.float16 else 0
+        if spectrum is not None:
+            if spectrum["suspended"]:
+                flags |= FLAG_SUSPENDED
+            waveform = self.decimate(spectrum["waveform"]).tobytes()
+            values = self.quantize_spectrum(spectrum["spectrum"], spectrum["bin_hz"])
+        else:
+            waveform = bytes(2 * self.width)
+            values = np.zeros(self.bands, dtype=np.float16 if self.float16 else np.uint8)
+        channels = levels["channels"] if levels else []
+        tail = b"".join(LEVEL.pack(self._level_byte(channel["rms"]), self._level_byte(channel["peak"]),
+                                   self._level_byte(channel["hold"]), channel["clips"] & 0xFFFFFFFF)
+                        for channel in channels)
+        stamp = int(time.time() * 1000)
+
+        def header(frame_flags):
+            return HEADER.pack(MAGIC, VERSION, frame_flags, self.sequence, stamp, self.width, self.bands,
+                               len(channels), 0)
+
+        previous = self._previous
+        delta_frame = None
+        if (delta and previous is not None and len(previous) == len(values)
+                and self.sequence % self.keyframe_interval):
+            # Bands that moved less than the dead band keep the value the viewers already have;
+            # the keyframe carries the same state, so both kinds of viewer stay in step
+            changed = np.abs(values.astype(np.float32) - previous.astype(np.float32)) > self.dead_band
+            values = np.where(changed, values, previous)
+            bitmap = np.packbits(changed, bitorder="little").tobytes()
+            delta_frame = header(flags | FLAG_DELTA) + waveform + bitmap + values[changed].tobytes() + tail
+        self._previous = values
+        keyframe = header(flags) + waveform + values.tobytes() + tail
+        if delta_frame is not None and len(delta_frame) >= len(keyframe):
+            delta_frame = None
+        return keyframe, delta_frame
+
+
+class FrameDecoder:
+    """Client-side state: applies keyframes and deltas, returns plain Python values"""
+
+    def __init__(self):
+        self.sequence = None
+        self.spectrum = None
+
+    def decode(self, data):
+        """dict for the frame, or None for a delta that does not apply to what this decoder has"""
+        magic, version, flags, sequence, stamp, width, bands, channels, _ = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a version 1 visualization frame")
+        offset = HEADER.size
+        waveform = np.frombuffer(data, dtype=np.int8, count=2 * width, offset=offset).reshape(width, 2)
+        offset += 2 * width
+        dtype = np.float16 if flags & FLAG_FLOAT16 else np.uint8
+        if flags & FLAG_DELTA:
+            if self.spectrum is None or self.sequence != (sequence - 1) & 0xFFFFFFFF:
+                return None
+            bitmap_size = (bands + 7) // 8
+            changed = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=bitmap_size, offset=offset),
+                                    count=bands, bitorder="little").astype(bool)
+            offset += bitmap_size
+            count = int(changed.sum())
+            spectrum = self.spectrum.copy()
+            spectrum[changed] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += count * spectrum.itemsize
+        else:
+            spectrum = np.frombuffer(data, dtype=dtype, count=bands, offset=offset).copy()
+            offset += bands * spectrum.itemsize
+        self.sequence, self.spectrum = sequence, spectrum
+
+        levels = []
+        for _ in range(channels):
+            rms, peak, hold, clips = LEVEL.unpack_from(data, offset)
+            offset += LEVEL.size
+            levels.append({"rms_db": -rms / 2, "peak_db": -peak / 2, "hold_db": -hold / 2, "clips": clips})
+        spectrum_db = spectrum.astype(np.float32) if flags & FLAG_FLOAT16 \
+            else spectrum.astype(np.float32) * (RANGE_DB / 255) - RANGE_DB
+        return {
+            "sequence": sequence,
+            "timestamp": stamp,
+            "suspended": bool(flags & FLAG_SUSPENDED),
+            "waveform": waveform.astype(np.float32) / 127,
+            "spectrum_db": spectrum_db,
+            "levels": levels,
+        }
+
+
+def synthetic_snapshots(count, sample_rate=44100, seed=6):
+    """Spectrum/level snapshots of music-like audio (drifting tones over noise) via the real stages"""
+    import os
+    import tempfile
+
+    from levels import LevelMeter, LevelReader
+    from spectrum import SpectrumAnalyzer, SpectrumReader
+
+    rng = np.random.default_rng(seed)
+    snapshots = []
+    with tempfile.TemporaryDirectory() as directory:
+        analyzer = SpectrumAnalyzer(sample_rate, 2, os.path.join(directory, "spectrum"), rate_hz=20.0)
+        meter = LevelMeter(sample_rate, 2, os.path.join(directory, "levels"))
+        spectrum_reader = SpectrumReader(os.path.join(directory, "spectrum"))
+        level_reader = LevelReader(os.path.join(directory, "levels"))
+        block = sample_rate // 20
+        t = np.arange(block) / sample_rate
+        for index in range(count):
+            tones = sum(0.2 / (k + 1) * np.sin(2 * np.pi * (220 * (k + 1) * (1 + 0.1 * math.sin(index / 40)))
+                                               * (t + index * block / sample_rate)) for k in range(4))
+            mono = (tones * (0.5 + 0.5 * abs(math.sin(index / 7))) + rng.normal(0, 0.01, block)).astype(np.float32)
+            audio = np.stack([mono, mono], axis=1)
+            analyzer.process(audio)
+            meter.process(audio)
+            snapshots.append((spectrum_reader.read(), level_reader.read()))
+        spectrum_reader.close()
+        level_reader.close()
+        analyzer.close()
+        meter.close()
+    return snapshots
+
+
+def benchmark(frames=400, width=400, bands=128):
+    """Bytes and CPU per frame: the bridge's JSON against binary keyframes and deltas"""
+    from viz_bridge import VisualizationBridge
+
+    snapshots = synthetic_snapshots(frames)
+    bridge = VisualizationBridge.__new__(VisualizationBridge)  # encode() needs no state
+    rows = []
+
+    started = time.perf_counter()
+    json_sizes = [len(bridge.encode(*snapshot)) for snapshot in snapshots]
+    rows.append(("json", np.mean(json_sizes), (time.perf_counter() - started) / frames, None))
+
+    for name, float16 in (("binary u8", False), ("binary f16", True)):
+        encoder, decoder = FrameEncoder(width, bands, float16), FrameDecoder()
+        keys, deltas = [], []
+        started = time.perf_counter()
+        for snapshot in snapshots:
+            key, delta = encoder.encode(*snapshot)
+            keys.append(key)
+            deltas.append(delta or key)
+        encode_time = (time.perf_counter() - started) / frames
+        started = time.perf_counter()
+        for frame in deltas:
+            decoded = decoder.decode(frame)
+        decode_time = (time.perf_counter() - started) / frames
+        reference = FrameDecoder().decode(keys[-1])
+        assert np.array_equal(decoded["spectrum_db"], reference["spectrum_db"])
+        rows.append((f"{name} key", np.mean([len(k) for k in keys]), encode_time, decode_time))
+        rows.append((f"{name} delta", np.mean([len(d) for d in deltas]), encode_time, decode_time))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Binary visualization frame format")
+    parser.add_argument("--benchmark", action="store_true", help="size and CPU against the JSON frames")
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    rows = benchmark()
+    json_size = rows[0][1]
+    print(f"{'format':<18} {'bytes/frame':>11} {'vs json':>8} {'encode us':>10} {'decode us':>10}")
+    for name, size, encode_time, decode_time in rows:
+        decode = f"{decode_time * 1e6:>10.0f}" if decode_time is not None else f"{'-':>10}"
+        print(f"{name:<18} {size:>11.0f} {json_size / size:>7.1f}x {encode_time * 1e6:>10.0f} {decode}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())